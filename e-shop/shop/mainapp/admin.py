@@ -1,12 +1,124 @@
+import os
+import tempfile
+
+from django import forms
 from django.forms import ModelChoiceField, ModelForm
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.db import models
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
+from django.shortcuts import render
+from django.urls import path
+from django.core.exceptions import PermissionDenied
+from django.utils.functional import cached_property
 
+from .exporter import EXPORT_FORMATS, filter_orders
+from .importer import ProductImporter
 from .models import *
+from .utils import estimate_row_count
+
+
+class ApproximateCountPaginator(Paginator):
+    '''
+    Пагинатор списка админки: для списка без фильтров по большой таблице количество строк берется
+    из статистики базы данных вместо COUNT(*) по всей таблице.
+    '''
+
+    # Таблицы меньше этого размера считаются точно.
+    APPROXIMATE_COUNT_THRESHOLD = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.APPROXIMATE_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class FastChangeListAdmin(admin.ModelAdmin):
+    '''
+    Базовый класс админки для больших таблиц: приблизительное количество строк без фильтров и без
+    второго COUNT(*) всей таблицы на отфильтрованных страницах.
+    '''
 
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
 
 
+class ProductImportForm(forms.Form):
+
+    catalog = forms.FileField(label='Файл каталога (.csv или .jsonl)')
+    images_dir = forms.CharField(label='Папка изображений', max_length=255)
+
+    def clean_catalog(self):
+        catalog = self.cleaned_data['catalog']
+        if not catalog.name.endswith(('.csv', '.jsonl')):
+            raise forms.ValidationError('Поддерживаются файлы .csv и .jsonl')
+        return catalog
+
+    def clean_images_dir(self):
+        """
+        Папка изображений должна находиться внутри PRODUCT_IMPORT_ROOT.
+        """
+        root = os.path.realpath(settings.PRODUCT_IMPORT_ROOT)
+        images_dir = os.path.realpath(os.path.join(root, self.cleaned_data['images_dir']))
+        if not images_dir.startswith(root + os.sep) or not os.path.isdir(images_dir):
+            raise forms.ValidationError('Папка не найдена')
+        return images_dir
+
 
-class DressAdmin(admin.ModelAdmin):
+class ProductAdmin(admin.ModelAdmin):
+
+    list_display = ('title', 'category', 'price')
+    list_select_related = ('category',)
+    search_fields = ('=slug',)
+    change_list_template = 'admin/mainapp/product_change_list.html'
+
+    def get_urls(self):
+        opts = self.model._meta
+        return [
+            path(
+                'import/', self.admin_site.admin_view(self.import_view),
+                name='{}_{}_import'.format(opts.app_label, opts.model_name)
+            ),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """
+        Страница импорта товаров из загруженного файла каталога (см. ProductImporter и команду import_products).
+        """
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        errors = []
+        if form.is_valid():
+            catalog = form.cleaned_data['catalog']
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(catalog.name)[1]) as catalog_file:
+                for chunk in catalog.chunks():
+                    catalog_file.write(chunk)
+                catalog_file.flush()
+                with ProductImporter(form.cleaned_data['images_dir'], workers=settings.PRODUCT_IMPORT_WORKERS) as importer:
+                    importer.run(catalog_file.name)
+            errors = importer.errors
+            messages.add_message(request, messages.INFO, 'Создано товаров: {}, обновлено: {}, с ошибками: {}'.format(
+                importer.created, importer.updated, len(errors)
+            ))
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Импорт товаров',
+            'form': form,
+            'errors': errors,
+            'import_root': settings.PRODUCT_IMPORT_ROOT,
+        }
+        return render(request, 'admin/mainapp/import_products.html', context)
+
+
+class DressAdmin(ProductAdmin):
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         """
@@ -21,7 +133,7 @@ class DressAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
-class SkirtAdmin(admin.ModelAdmin):
+class SkirtAdmin(ProductAdmin):
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         """
@@ -36,12 +148,123 @@ class SkirtAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
+class CartProductAdmin(FastChangeListAdmin):
+
+    list_display = ('id', 'cart_id', 'product', 'qty', 'final_price', 'user')
+    list_select_related = ('user__user',)
+    raw_id_fields = ('user', 'cart')
+
+    def get_queryset(self, request):
+        """
+        Продукты строк (Dress, Skirt, ...) загружаются одним запросом на каждый тип контента.
+        """
+        return super().get_queryset(request).prefetch_related('content_object')
+
+    @admin.display(description='Товар')
+    def product(self, obj):
+        return obj.content_object.title if obj.content_object else '{} #{}'.format(obj.content_type_id, obj.object_id)
+
+
+class CartAdmin(FastChangeListAdmin):
+
+    list_display = ('id', 'owner', 'total_products', 'final_price', 'in_order', 'for_anonymous_user')
+    list_select_related = ('owner__user',)
+    list_filter = ('in_order', 'for_anonymous_user')
+    raw_id_fields = ('owner', 'products')
+
+
+class CustomerAdmin(FastChangeListAdmin):
+
+    list_display = ('id', 'user', 'phone', 'address')
+    list_select_related = ('user',)
+    search_fields = ('=phone', '=user__username')
+    raw_id_fields = ('user',)
+
+
+class OrderLineInline(admin.TabularInline):
+
+    model = OrderLine
+    fields = ('product_type', 'object_id', 'title', 'price', 'qty')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderExportForm(forms.Form):
+
+    status = forms.ChoiceField(label='Статус', choices=(('', 'Все'),) + Order.STATUS_CHOICES, required=False)
+    buying_type = forms.ChoiceField(
+        label='Тип заказа', choices=(('', 'Все'),) + Order.BUYING_TYPE_CHOICES, required=False
+    )
+    date_from = forms.DateField(label='Создан с', required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(label='Создан по', required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    format = forms.ChoiceField(label='Формат', choices=[(name, name.upper()) for name in EXPORT_FORMATS])
+
+
+class OrderAdmin(FastChangeListAdmin):
+
+    # Все колонки хранятся в самом заказе (сумма - снимок на момент оформления), поэтому список
+    # строится одним запросом без обращения к покупателям и корзинам.
+    list_display = (
+        'id', 'first_name', 'last_name', 'phone', 'status', 'buying_type', 'final_price', 'created_at', 'order_date'
+    )
+    list_filter = ('status', 'buying_type', 'created_at')
+    search_fields = ('=phone',)
+    raw_id_fields = ('customer', 'cart')
+    readonly_fields = ('final_price', 'created_at')
+    inlines = (OrderLineInline,)
+    change_list_template = 'admin/mainapp/order_change_list.html'
+
+    def get_urls(self):
+        return [
+            path('export/', self.admin_site.admin_view(self.export_view), name='mainapp_order_export'),
+        ] + super().get_urls()
+
+    def export_view(self, request):
+        """
+        Страница выгрузки заказов со строками в CSV или JSON Lines с фильтрами по статусу, типу и периоду.
+        Выгрузка отдается потоком (StreamingHttpResponse) и читается из базы данных частями.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        form = OrderExportForm(request.GET if 'format' in request.GET else None)
+        if form.is_valid():
+            data = form.cleaned_data
+            orders = filter_orders(data['status'], data['buying_type'], data['date_from'], data['date_to'])
+            stream, content_type, extension = EXPORT_FORMATS[data['format']]
+            response = StreamingHttpResponse(stream(orders), content_type=content_type)
+            response['Content-Disposition'] = 'attachment; filename="orders.{}"'.format(extension)
+            return response
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Выгрузка заказов',
+            'form': form,
+        }
+        return render(request, 'admin/mainapp/export_orders.html', context)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск по телефону или номеру заказа выполняется точным сравнением, которое использует индексы.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        condition = models.Q(phone=search_term)
+        if search_term.isdigit() and len(search_term) < 19:
+            condition |= models.Q(pk=int(search_term))
+        return queryset.filter(condition), False
+
+
 admin.site.register(Category)
 admin.site.register(Dress, DressAdmin)
 admin.site.register(Skirt, SkirtAdmin)
-admin.site.register(CartProduct)
-admin.site.register(Cart)
-admin.site.register(Customer)
-admin.site.register(Order)
+admin.site.register(CartProduct, CartProductAdmin)
+admin.site.register(Cart, CartAdmin)
+admin.site.register(Customer, CustomerAdmin)
+admin.site.register(Order, OrderAdmin)
 
 
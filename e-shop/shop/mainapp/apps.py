@@ -5,3 +5,11 @@ class MainappConfig(AppConfig):
     # Создаем новое приложение под названием mainapp.
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mainapp'
+
+    def ready(self):
+        # Подключаем обработчики сигналов, которые поддерживают индекс каталога.
+        from . import signals  # noqa: F401
+        # Настраиваем каждое новое соединение с базой данных (PRAGMA SQLite).
+        from django.db.backends.signals import connection_created
+        from .db import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='mainapp.configure_connection')
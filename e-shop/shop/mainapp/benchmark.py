@@ -0,0 +1,240 @@
+import asyncio
+import math
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Category, CatalogProduct
+
+
+def percentile(samples, fraction):
+    """
+    Функция возвращает перцентиль выборки методом ближайшего ранга.
+    :param samples: Непустой список значений.
+    :param fraction: Доля от 0 до 1 (0.95 - 95-й перцентиль).
+    """
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def get_revision():
+    """
+    Функция возвращает сокращенный хэш текущего коммита git или None, если git недоступен.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_scenarios(category, product):
+    """
+    Функция возвращает запросы одной итерации в порядке выполнения: (название, метод, путь, данные POST).
+    Изменения корзины идут циклом добавить - изменить количество - удалить, поэтому после каждой итерации
+    корзина возвращается в исходное состояние.
+    :param category: Категория для страницы категории.
+    :param product: Объект CatalogProduct, который добавляется в корзину и удаляется из нее.
+    """
+    cart_path = '{}/{}/'.format(product.product_type, product.slug)
+    return [
+        ('base', 'get', '/', None),
+        ('category_detail', 'get', category.get_absolute_url(), None),
+        ('product_detail', 'get', product.get_absolute_url(), None),
+        ('add_to_cart', 'get', '/add-to-cart/' + cart_path, None),
+        ('change_qty', 'post', '/change-qty/' + cart_path, {'qty': 2}),
+        ('cart', 'get', '/cart/', None),
+        ('delete_from_cart', 'get', '/remove-from-cart/' + cart_path, None),
+    ]
+
+
+def run_benchmark(iterations=50, warmup=5, cart_lines=5):
+    """
+    Функция прогоняет представления через тестовый клиент на текущей базе данных.
+    Время замеряется без инструментирования; число запросов к базе и пиковая выделенная память
+    (tracemalloc) замеряются отдельным проходом, чтобы не искажать задержки.
+    :param iterations: Количество замеряемых итераций.
+    :param warmup: Количество итераций прогрева (наполняют кэши, не учитываются).
+    :param cart_lines: Количество товаров, заранее положенных в корзину.
+    :return: Словарь с результатами, пригодный для сериализации в JSON.
+    """
+    category = Category.objects.filter(
+        id__in=CatalogProduct.objects.values('category_id')
+    ).order_by('id').first()
+    if iterations < 1:
+        raise ValueError('Нужна хотя бы одна замеряемая итерация')
+    if category is None:
+        raise ValueError('В каталоге нет товаров, сначала выполните seed_catalog')
+    products = list(CatalogProduct.objects.filter(category=category).order_by('id')[:cart_lines + 1])
+    product, cart_products = products[0], products[1:]
+    scenarios = get_scenarios(category, product)
+
+    with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+        client = Client()
+        for cart_product in cart_products:
+            client.get('/add-to-cart/{}/{}/'.format(cart_product.product_type, cart_product.slug))
+
+        timings = {name: [] for name, *_ in scenarios}
+        statuses = {}
+        for iteration in range(warmup + iterations):
+            for name, method, path, data in scenarios:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                elapsed = time.perf_counter() - started
+                statuses[name] = response.status_code
+                if iteration >= warmup:
+                    timings[name].append(elapsed * 1000)
+
+        instrumented = {}
+        tracemalloc.start()
+        try:
+            for name, method, path, data in scenarios:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                with CaptureQueriesContext(connection) as queries:
+                    getattr(client, method)(path, data)
+                instrumented[name] = (len(queries), tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'revision': get_revision(),
+        'database': connection.vendor,
+        'catalog_size': CatalogProduct.objects.count(),
+        'iterations': iterations,
+        'warmup': warmup,
+        'views': {
+            name: {
+                'method': method.upper(),
+                'path': path,
+                'status': statuses[name],
+                'p50_ms': round(percentile(timings[name], 0.5), 3),
+                'p95_ms': round(percentile(timings[name], 0.95), 3),
+                'mean_ms': round(statistics.fmean(timings[name]), 3),
+                'queries': instrumented[name][0],
+                'peak_memory_kb': round(instrumented[name][1] / 1024, 1),
+            }
+            for name, method, path, data in scenarios
+        },
+    }
+
+
+async def asgi_get(application, path):
+    """
+    Функция выполняет GET-запрос к ASGI-приложению так же, как это делает ASGI-сервер (uvicorn, daphne),
+    но без сети: формирует scope, отдает пустое тело и собирает ответ.
+    :return: (код ответа, размер тела в байтах).
+    """
+    path, _, query_string = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    finished = asyncio.Event()
+    request_sent = False
+    status, size = None, 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status, size
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            size += len(message.get('body', b''))
+            if not message.get('more_body'):
+                finished.set()
+
+    await application(scope, receive, send)
+    return status, size
+
+
+async def _load(application, path, requests, concurrency):
+    latencies = []
+    statuses = set()
+    queue = iter(range(requests))
+
+    async def worker():
+        for _ in queue:
+            started = time.perf_counter()
+            status, _ = await asgi_get(application, path)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses.add(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, statuses
+
+
+def run_asgi_benchmark(requests=200, concurrency=(1, 10, 50), warmup=20):
+    """
+    Функция сравнивает синхронные и асинхронные варианты страниц каталога под ASGI: для каждой страницы
+    и каждого уровня конкурентности выполняется заданное количество запросов к приложению shop.asgi
+    (как их выполнял бы ASGI-сервер) и замеряются пропускная способность и задержки.
+    Кэш не сбрасывается: замеряется обычная работа с прогретыми фрагментами и боковой панелью.
+    :param requests: Количество замеряемых запросов на каждую страницу и уровень конкурентности.
+    :param concurrency: Уровни конкурентности (количество одновременных клиентов).
+    :param warmup: Количество запросов прогрева на каждую страницу.
+    :return: Словарь с результатами, пригодный для сериализации в JSON.
+    """
+    category = Category.objects.filter(
+        id__in=CatalogProduct.objects.values('category_id')
+    ).order_by('id').first()
+    if requests < 1 or not concurrency or min(concurrency) < 1:
+        raise ValueError('Нужен хотя бы один запрос и один клиент')
+    if category is None:
+        raise ValueError('В каталоге нет товаров, сначала выполните seed_catalog')
+    product = CatalogProduct.objects.filter(category=category).order_by('id').first()
+    pages = [
+        ('base', '/'),
+        ('category_detail', category.get_absolute_url()),
+        ('product_detail', product.get_absolute_url()),
+    ]
+
+    async def run():
+        application = get_asgi_application()
+        results = {}
+        for name, path in pages:
+            for mode, mode_path in (('sync', path), ('async', '/async' + path)):
+                await _load(application, mode_path, warmup, 1)
+                for clients in concurrency:
+                    elapsed, latencies, statuses = await _load(application, mode_path, requests, clients)
+                    results.setdefault(name, {}).setdefault(mode, {})[str(clients)] = {
+                        'path': mode_path,
+                        'status': sorted(statuses),
+                        'requests_per_second': round(requests / elapsed, 1),
+                        'p50_ms': round(percentile(latencies, 0.5), 3),
+                        'p95_ms': round(percentile(latencies, 0.95), 3),
+                    }
+        return results
+
+    with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+        results = asyncio.run(run())
+    return {
+        'created_at': timezone.now().isoformat(),
+        'revision': get_revision(),
+        'database': connection.vendor,
+        'catalog_size': CatalogProduct.objects.count(),
+        'requests': requests,
+        'concurrency': list(concurrency),
+        'warmup': warmup,
+        'views': results,
+    }
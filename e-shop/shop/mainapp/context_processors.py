@@ -0,0 +1,11 @@
+from .utils import CART_TOTAL_SESSION_KEY
+
+
+def cart(request):
+    """
+    Функция добавляет в контекст каждого шаблона количество товаров в корзине, сохраненное в сессии.
+    Значок корзины в base.html отображается без запросов к корзине.
+    :param request: Объект запроса.
+    :return: Словарь контекста.
+    """
+    return {'cart_total_products': request.session.get(CART_TOTAL_SESSION_KEY, 0)}
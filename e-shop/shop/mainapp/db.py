@@ -0,0 +1,26 @@
+from django.conf import settings
+
+
+def get_sqlite_pragmas(settings_dict):
+    """
+    Функция возвращает PRAGMA для соединения с SQLite: общие из настройки SQLITE_PRAGMAS, дополненные
+    (или переопределенные) ключом PRAGMAS описания базы данных в DATABASES. Значение None отменяет PRAGMA.
+    :param settings_dict: Описание базы данных соединения.
+    :return: Список пар (имя, значение) в порядке выполнения.
+    """
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    pragmas.update(settings_dict.get('PRAGMAS') or {})
+    return [(name, value) for name, value in pragmas.items() if value is not None]
+
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    Функция настраивает новое соединение с базой данных (обработчик сигнала connection_created).
+    Для SQLite выполняются PRAGMA: synchronous, размер кэша страниц, mmap и время ожидания блокировки.
+    Эти PRAGMA действуют только на соединение и не изменяют файл базы данных.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    # PRAGMA выполняются напрямую драйвером, чтобы не попадать в счетчики запросов (execute_wrapper).
+    for name, value in get_sqlite_pragmas(connection.settings_dict):
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
@@ -0,0 +1,107 @@
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import Order, OrderLine
+
+
+# Колонки заказа и строки заказа в выгрузке.
+ORDER_FIELDS = (
+    'id', 'created_at', 'status', 'buying_type', 'customer_id', 'first_name', 'last_name', 'phone', 'address',
+    'order_date', 'comment', 'final_price',
+)
+LINE_FIELDS = ('product_type', 'object_id', 'title', 'price', 'qty')
+
+# Количество заказов, которые читаются из базы данных (вместе со строками) за один раз.
+EXPORT_CHUNK_SIZE = 1000
+
+
+class Echo:
+    '''
+    Псевдобуфер для csv.writer: запись возвращает строку, а не накапливает ее.
+    '''
+
+    def write(self, value):
+        return value
+
+
+def filter_orders(status=None, buying_type=None, date_from=None, date_to=None):
+    """
+    Функция возвращает заказы для выгрузки в порядке номеров.
+    Даты переводятся в границы created_at, поэтому фильтр по периоду использует индекс по дате создания.
+    :param status: Статус заказа или None.
+    :param buying_type: Тип заказа или None.
+    :param date_from: Первая дата периода (включительно) или None.
+    :param date_to: Последняя дата периода (включительно) или None.
+    """
+    orders = Order.objects.order_by('id')
+    if status:
+        orders = orders.filter(status=status)
+    if buying_type:
+        orders = orders.filter(buying_type=buying_type)
+    if date_from:
+        orders = orders.filter(created_at__gte=_start_of_day(date_from))
+    if date_to:
+        orders = orders.filter(created_at__lt=_start_of_day(date_to + datetime.timedelta(days=1)))
+    return orders
+
+
+def _start_of_day(date):
+    start = datetime.datetime.combine(date, datetime.time.min)
+    return timezone.make_aware(start) if timezone.is_naive(start) else start
+
+
+def iter_orders(orders):
+    """
+    Функция перебирает заказы частями по EXPORT_CHUNK_SIZE: заказы читаются из курсора одного запроса
+    (серверного, если база данных их поддерживает), а строки загружаются одним запросом на каждую часть,
+    поэтому память не зависит от размера выгрузки.
+    :return: Генератор пар (заказ, список строк заказа).
+    """
+    orders = orders.prefetch_related(Prefetch('lines', queryset=OrderLine.objects.order_by('id')))
+    for order in orders.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield order, list(order.lines.all())
+
+
+def _value(obj, field):
+    value = getattr(obj, field)
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+
+
+def iter_csv(orders):
+    """
+    Функция выгружает заказы в CSV: одна строка на каждую строку заказа (заказ без строк - одна строка
+    с пустыми колонками товара).
+    :return: Генератор строк CSV.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(ORDER_FIELDS + tuple('line_' + field for field in LINE_FIELDS))
+    empty_line = [''] * len(LINE_FIELDS)
+    for order, lines in iter_orders(orders):
+        order_values = [_value(order, field) for field in ORDER_FIELDS]
+        if not lines:
+            yield writer.writerow(order_values + empty_line)
+        for line in lines:
+            yield writer.writerow(order_values + [_value(line, field) for field in LINE_FIELDS])
+
+
+def iter_jsonl(orders):
+    """
+    Функция выгружает заказы в JSON Lines: один объект на заказ со списком строк в ключе lines.
+    :return: Генератор строк JSON.
+    """
+    for order, lines in iter_orders(orders):
+        data = {field: _value(order, field) for field in ORDER_FIELDS}
+        data['lines'] = [{field: _value(line, field) for field in LINE_FIELDS} for line in lines]
+        yield json.dumps(data, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+# Форматы выгрузки: имя -> (генератор, тип содержимого, расширение файла).
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8', 'csv'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8', 'jsonl'),
+}
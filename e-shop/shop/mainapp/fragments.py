@@ -0,0 +1,96 @@
+import time
+
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+from .routers import use_primary
+
+
+# Время жизни (в секундах) закэшированного фрагмента. Версии сбрасывают фрагменты сразу при сохранении
+# (в том числе страницы под прежним slug и прежней категории), а время жизни ограничивает случаи,
+# которые версии не покрывают (например, изменения в обход сигналов).
+FRAGMENT_TIMEOUT = 60 * 10
+
+
+def version_key(kind, key):
+    return 'mainapp:version:{}:{}'.format(kind, key)
+
+
+def get_version(kind, key):
+    """
+    Функция возвращает текущую версию объекта (товара или категории).
+    Версия - время ее создания в наносекундах, поэтому после вытеснения из кэша старые фрагменты не оживают.
+    :param kind: Вид объекта ('product', 'category').
+    :param key: Ключ объекта.
+    :return: Номер версии.
+    """
+    version = cache.get(version_key(kind, key))
+    if version is None:
+        cache.add(version_key(kind, key), time.time_ns(), None)
+        version = cache.get(version_key(kind, key))
+    return version
+
+
+def bump_version(kind, key):
+    """
+    Функция задает объекту новую версию, после чего все его закэшированные фрагменты перестают использоваться.
+    :param kind: Вид объекта ('product', 'category').
+    :param key: Ключ объекта.
+    """
+    cache.set(version_key(kind, key), time.time_ns(), None)
+
+
+def bump_versions(kind, keys):
+    """
+    Функция задает новую версию сразу нескольким объектам одной записью в кэш.
+    :param kind: Вид объекта ('product', 'category').
+    :param keys: Ключи объектов.
+    """
+    version = time.time_ns()
+    cache.set_many({version_key(kind, key): version for key in keys}, None)
+
+
+def get_or_render_fragment(name, kind, key, render):
+    """
+    Функция возвращает фрагмент HTML из кэша для текущей версии объекта, а при промахе отрисовывает
+    его функцией render и сохраняет в кэш. При отрисовке данные читаются из основной базы данных: промах
+    обычно следует сразу за сбросом версии после записи, а реплика может отставать.
+    :param name: Имя фрагмента.
+    :param kind: Вид объекта ('product', 'category').
+    :param key: Ключ объекта.
+    :param render: Функция без аргументов, которая возвращает HTML фрагмента.
+    :return: HTML фрагмента.
+    """
+    fragment_key = 'mainapp:fragment:{}:{}:{}:{}'.format(name, kind, key, get_version(kind, key))
+    content = cache.get(fragment_key)
+    if content is None:
+        with use_primary():
+            content = render()
+        cache.set(fragment_key, content, FRAGMENT_TIMEOUT)
+    return mark_safe(content)
+
+
+async def aget_version(kind, key):
+    """
+    Асинхронный вариант get_version.
+    """
+    version = await cache.aget(version_key(kind, key))
+    if version is None:
+        await cache.aadd(version_key(kind, key), time.time_ns(), None)
+        version = await cache.aget(version_key(kind, key))
+    return version
+
+
+async def aget_or_render_fragment(name, kind, key, render):
+    """
+    Асинхронный вариант get_or_render_fragment.
+    :param render: Асинхронная функция без аргументов, которая возвращает HTML фрагмента.
+    :return: HTML фрагмента.
+    """
+    fragment_key = 'mainapp:fragment:{}:{}:{}:{}'.format(name, kind, key, await aget_version(kind, key))
+    content = await cache.aget(fragment_key)
+    if content is None:
+        with use_primary():
+            content = await render()
+        await cache.aset(fragment_key, content, FRAGMENT_TIMEOUT)
+    return mark_safe(content)
@@ -0,0 +1,135 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .storage import product_image_storage
+
+
+# Варианты изображения товара: имя варианта -> максимальные ширина и высота.
+RENDITIONS = {
+    'thumbnail': (150, 150),
+    'card': (400, 400),
+    'detail': (800, 800),
+}
+
+# Форматы, в которых сохраняется каждый вариант: формат -> (формат PIL, расширение, параметры сохранения).
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+RENDITIONS_DIR = 'renditions'
+
+# Пул процессов, в котором варианты создаются вне обработки запроса: кодирование JPEG и WebP удерживает GIL
+# и в потоках веб-процесса конкурировало бы с обработкой запросов. Пул создается при первой загрузке.
+_executor = None
+_executor_lock = threading.Lock()
+
+# Изображения, для которых варианты уже найдены в хранилище (чтобы не проверять файлы при каждом рендеринге).
+_ready = set()
+
+
+def rendition_name(image_name, rendition, fmt='jpeg'):
+    """
+    Функция возвращает имя файла варианта изображения в хранилище.
+    :param image_name: Имя исходного файла изображения.
+    :param rendition: Имя варианта из RENDITIONS.
+    :param fmt: Формат из RENDITION_FORMATS.
+    :return: Имя файла варианта.
+    """
+    stem = os.path.splitext(image_name)[0]
+    return '{}/{}_{}.{}'.format(RENDITIONS_DIR, stem, rendition, RENDITION_FORMATS[fmt][1])
+
+
+def generate_renditions(image_name):
+    """
+    Функция открывает исходное изображение один раз и сохраняет все его варианты во всех форматах в хранилище
+    изображений товаров. Прежние варианты заменяются на месте, без промежутка, когда файла нет.
+    Выполняется в дочернем процессе: в пуле загрузок (см. submit_renditions), команды regenerate_renditions
+    или импорта каталога.
+    :param image_name: Имя исходного файла изображения.
+    :return: Имя исходного файла изображения.
+    """
+    with product_image_storage.open(image_name) as image_file:
+        img = Image.open(image_file)
+        img = img.convert('RGB')
+    for rendition, size in RENDITIONS.items():
+        resized_img = img.copy()
+        resized_img.thumbnail(size, Image.LANCZOS)
+        for fmt, (pil_format, _, options) in RENDITION_FORMATS.items():
+            filestream = BytesIO()
+            resized_img.save(filestream, pil_format, **options)
+            name = rendition_name(image_name, rendition, fmt)
+            product_image_storage.replace(name, ContentFile(filestream.getvalue()))
+    _ready.add(image_name)
+    return image_name
+
+
+def schedule_renditions(image_name):
+    """
+    Функция ставит создание вариантов изображения в фоновый пул после фиксации транзакции.
+    :param image_name: Имя исходного файла изображения.
+    """
+    _ready.discard(image_name)
+    transaction.on_commit(lambda: submit_renditions(image_name))
+
+
+def get_executor():
+    """
+    Функция возвращает пул процессов для создания вариантов (RENDITION_WORKERS процессов), создавая его
+    при первом обращении.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'RENDITION_WORKERS', 2), initializer=setup_worker
+            )
+        return _executor
+
+
+def submit_renditions(image_name):
+    """
+    Функция отправляет создание вариантов изображения в пул процессов. Если процесс пула аварийно
+    завершился и пул больше не принимает задачи, он создается заново.
+    :param image_name: Имя исходного файла изображения.
+    """
+    global _executor
+    executor = get_executor()
+    try:
+        return executor.submit(generate_renditions, image_name)
+    except BrokenProcessPool:
+        with _executor_lock:
+            if _executor is executor:
+                _executor = None
+        return get_executor().submit(generate_renditions, image_name)
+
+
+def renditions_ready(image_name):
+    """
+    Функция проверяет, созданы ли варианты изображения. Положительный результат запоминается.
+    :param image_name: Имя исходного файла изображения.
+    :return: True, если варианты созданы.
+    """
+    if image_name in _ready:
+        return True
+    last_rendition = rendition_name(image_name, list(RENDITIONS)[-1], list(RENDITION_FORMATS)[-1])
+    if product_image_storage.exists(last_rendition):
+        _ready.add(image_name)
+        return True
+    return False
+
+
+def setup_worker():
+    """
+    Функция инициализирует Django в дочернем процессе пула (для методов запуска spawn/forkserver).
+    """
+    import django
+    django.setup()
@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .fragments import bump_versions
+from .images import generate_renditions, renditions_ready, setup_worker
+from .models import Category, CatalogProduct, ProductFacet, get_product_models, get_spec_fields
+from .storage import product_image_storage
+
+
+# Модели товаров, которые можно импортировать: значение колонки type -> модель.
+PRODUCT_MODELS = {model._meta.model_name: model for model in get_product_models()}
+
+
+def read_rows(path):
+    """
+    Функция построчно читает файл каталога (CSV с заголовком или JSON Lines), не загружая его целиком.
+    :param path: Путь к файлу .csv или .jsonl.
+    :return: Генератор пар (номер строки, словарь значений или None, если строку не удалось разобрать).
+    """
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as catalog_file:
+            for number, row in enumerate(csv.DictReader(catalog_file), start=2):
+                yield number, row
+    elif path.endswith(('.jsonl', '.ndjson')):
+        with open(path, encoding='utf-8') as catalog_file:
+            for number, line in enumerate(catalog_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError('Поддерживаются файлы .csv и .jsonl')
+
+
+def store_image(path):
+    """
+    Функция сохраняет исходное изображение в хэшированное хранилище и создает его варианты.
+    Выполняется в процессе пула, не обращается к базе данных.
+    :param path: Путь к файлу изображения.
+    :return: Имя изображения в хранилище.
+    """
+    with open(path, 'rb') as image_file:
+        name = product_image_storage.save(os.path.basename(path), File(image_file))
+    if not renditions_ready(name):
+        generate_renditions(name)
+    return name
+
+
+def save_products(model, rows):
+    """
+    Функция вставляет новые и обновляет существующие товары одной модели (bulk_create и bulk_update), затем
+    одним пакетом обновляет индексы каталога, поиска и фасетов и сбрасывает закэшированные фрагменты.
+    Сигналы сохранения отдельных товаров при этом не вызываются. Вызывается в транзакции.
+    :param model: Модель товара.
+    :param rows: Словарь {slug: значения полей}.
+    :return: (количество созданных товаров, количество обновленных товаров).
+    """
+    existing = model._base_manager.select_related('category').in_bulk(list(rows), field_name='slug')
+    # Прежние категории обновляемых товаров тоже изменяются, если товар перенесен.
+    categories = {product.category for product in existing.values()}
+    now = timezone.now()
+    created, updated = [], []
+    for slug, fields in rows.items():
+        product = existing.get(slug)
+        if product is None:
+            created.append(model(**fields))
+            continue
+        for name, value in fields.items():
+            setattr(product, name, value)
+        product.updated_at = now
+        updated.append(product)
+    model._base_manager.bulk_create(created)
+    update_fields = [name for name in next(iter(rows.values())) if name != 'slug'] + ['updated_at']
+    model._base_manager.bulk_update(updated, update_fields)
+
+    products = created + updated
+    catalog_products = CatalogProduct.objects.sync_products(products)
+    pairs = [(catalog_products[product.pk], product) for product in products]
+    search.index_products(pairs)
+    ProductFacet.objects.sync_products(pairs)
+    categories |= {product.category for product in products}
+    Category.objects.touch({category.pk for category in categories})
+    Category.objects.invalidate_sidebar()
+    bump_versions('product', ['{}:{}'.format(product.get_model_name(), product.slug) for product in products])
+    bump_versions('category', {category.slug for category in categories})
+    return len(created), len(updated)
+
+
+class ProductImporter:
+    '''
+    Импорт товаров из файла каталога пачками. Колонки файла: type (dress, skirt), category (slug категории),
+    title, slug, price, description, image (путь к файлу относительно папки изображений) и характеристики
+    модели (style, structure, cut, silhouette, color, length, landing).
+    Строки проверяются, изображения пачки обрабатываются в пуле процессов, новые товары вставляются
+    через bulk_create, существующие (с тем же slug) обновляются через bulk_update, а индексы каталога,
+    поиска и фасетов обновляются для всей пачки сразу. Повторный импорт того же файла ничего не дублирует.
+    Пример:
+        with ProductImporter('/data/images', workers=4) as importer:
+            importer.run('/data/catalog.jsonl')
+        print(importer.created, importer.updated, importer.errors)
+    '''
+
+    def __init__(self, images_dir, batch_size=500, workers=None):
+        self.images_dir = os.path.realpath(images_dir)
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.categories = {category.slug: category for category in Category.objects.all()}
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self._images = {}
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=setup_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown()
+
+    def run(self, path):
+        """
+        Функция импортирует весь файл каталога.
+        :param path: Путь к файлу .csv или .jsonl.
+        """
+        rows = read_rows(path)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+
+    def import_batch(self, batch):
+        """
+        Функция проверяет строки пачки, обрабатывает их изображения и сохраняет товары одной транзакцией.
+        :param batch: Список пар (номер строки, словарь значений).
+        """
+        valid = {}
+        for number, row in batch:
+            try:
+                model, fields, image_path = self.validate_row(row)
+            except ValueError as error:
+                self.errors.append((number, str(error)))
+                continue
+            # Если slug повторяется в пачке, действует последняя строка.
+            valid[(model, fields['slug'])] = (number, fields, image_path)
+        self.store_images(image_path for _, _, image_path in valid.values())
+
+        by_model = {}
+        for (model, slug), (number, fields, image_path) in valid.items():
+            if self._images.get(image_path) is None:
+                self.errors.append((number, 'Не удалось обработать изображение {}'.format(image_path)))
+                continue
+            fields['image'] = self._images[image_path]
+            by_model.setdefault(model, {})[slug] = fields
+
+        with transaction.atomic():
+            for model, rows in by_model.items():
+                created, updated = save_products(model, rows)
+                self.created += created
+                self.updated += updated
+
+    def validate_row(self, row):
+        """
+        Функция проверяет одну строку файла каталога.
+        :return: (модель, значения полей товара, путь к файлу изображения).
+        :raises ValueError: Если строка некорректна.
+        """
+        if row is None:
+            raise ValueError('Строку не удалось разобрать')
+        model = PRODUCT_MODELS.get(str(row.get('type') or '').strip().lower())
+        if model is None:
+            raise ValueError('Неизвестный тип товара: {}'.format(row.get('type')))
+        category = self.categories.get(str(row.get('category') or '').strip())
+        if category is None:
+            raise ValueError('Неизвестная категория: {}'.format(row.get('category')))
+        fields = {
+            name: str(row.get(name) or '').strip()
+            for name in ('title', 'slug', 'price', 'description')
+        }
+        for _, attname in get_spec_fields(model):
+            fields[attname] = str(row.get(attname) or '').strip()
+        product = model(category=category, **fields)
+        try:
+            exclude = ['image', 'category'] if fields['description'] else ['image', 'category', 'description']
+            product.clean_fields(exclude=exclude)
+        except ValidationError as error:
+            raise ValueError('; '.join(
+                '{}: {}'.format(field, ' '.join(messages)) for field, messages in error.message_dict.items()
+            ))
+        fields.update({'category': category, 'price': product.price, 'description': product.description or None})
+        image_path = os.path.realpath(os.path.join(self.images_dir, str(row.get('image') or '')))
+        if not image_path.startswith(self.images_dir + os.sep) or not os.path.isfile(image_path):
+            raise ValueError('Нет файла изображения: {}'.format(row.get('image')))
+        return model, fields, image_path
+
+    def store_images(self, paths):
+        """
+        Функция обрабатывает в пуле процессов изображения, которые еще не встречались в этом импорте.
+        """
+        paths = sorted(set(paths) - set(self._images))
+        futures = {path: self._executor.submit(store_image, path) for path in paths}
+        for path, future in futures.items():
+            try:
+                self._images[path] = future.result()
+            except Exception:
+                self._images[path] = None
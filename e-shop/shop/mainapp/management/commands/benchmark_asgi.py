@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.benchmark import run_asgi_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность и задержки синхронных и асинхронных страниц каталога под ASGI '
+        'и записывает результаты в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Количество запросов на страницу и уровень')
+        parser.add_argument(
+            '--concurrency', default='1,10,50',
+            help='Уровни конкурентности через запятую (количество одновременных клиентов)'
+        )
+        parser.add_argument('--warmup', type=int, default=20, help='Количество запросов прогрева на страницу')
+        parser.add_argument('--label', default='', help='Метка прогона (например, название ветки)')
+        parser.add_argument('--output', default='benchmark_asgi.json', help='Путь к файлу результатов')
+
+    def handle(self, *args, **options):
+        try:
+            concurrency = [int(value) for value in options['concurrency'].split(',') if value.strip()]
+            results = run_asgi_benchmark(options['requests'], concurrency, options['warmup'])
+        except ValueError as error:
+            raise CommandError(error)
+        results['label'] = options['label']
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        for name, modes in results['views'].items():
+            for mode, levels in modes.items():
+                for clients, view in levels.items():
+                    self.stdout.write(
+                        '{:<16} {:<5} клиентов {:>3}  {:>8.1f} запр/с  p50 {:>8.2f} мс  p95 {:>8.2f} мс'.format(
+                            name, mode, clients, view['requests_per_second'], view['p50_ms'], view['p95_ms']
+                        )
+                    )
+        self.stdout.write(self.style.SUCCESS('Результаты записаны в {}'.format(options['output'])))
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку (p50/p95), количество запросов к базе и выделенную память основных представлений '
+        'магазина и записывает результаты в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Количество замеряемых итераций')
+        parser.add_argument('--warmup', type=int, default=5, help='Количество итераций прогрева')
+        parser.add_argument('--cart-lines', type=int, default=5, help='Количество товаров в корзине')
+        parser.add_argument('--label', default='', help='Метка прогона (например, название ветки)')
+        parser.add_argument('--output', default='benchmark.json', help='Путь к файлу результатов')
+
+    def handle(self, *args, **options):
+        try:
+            results = run_benchmark(options['iterations'], options['warmup'], options['cart_lines'])
+        except ValueError as error:
+            raise CommandError(error)
+        results['label'] = options['label']
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        for name, view in results['views'].items():
+            self.stdout.write('{:<18} {:>4} p50 {:>8.2f} мс  p95 {:>8.2f} мс  запросов {:>3}  память {:>8.1f} КБ'.format(
+                name, view['status'], view['p50_ms'], view['p95_ms'], view['queries'], view['peak_memory_kb']
+            ))
+        self.stdout.write(self.style.SUCCESS('Результаты записаны в {}'.format(options['output'])))
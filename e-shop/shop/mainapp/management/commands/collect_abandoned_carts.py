@@ -0,0 +1,87 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from mainapp.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные (не оформленные и давно не изменявшиеся) корзины небольшими пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='Корзина считается брошенной, если не изменялась указанное количество дней'
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество корзин в одной транзакции')
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Пауза между пачками в секундах, чтобы не задерживать запросы покупателей'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать корзины, которые будут удалены'
+        )
+        parser.add_argument('--analyze', action='store_true', help='Обновить статистику планировщика (ANALYZE)')
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help='Вернуть освободившееся место (VACUUM); на SQLite блокирует базу данных на время выполнения'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Функция удаляет брошенные корзины пачками, каждая пачка - отдельная короткая транзакция,
+        затем выводит количество удаленных строк по моделям и при необходимости обслуживает базу данных.
+        """
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days и --batch-size должны быть положительными')
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                'Найдено брошенных корзин: {}'.format(Cart.objects.get_abandoned(cutoff).count())
+            ))
+            return
+
+        reclaimed = {}
+        batches = 0
+        while True:
+            deleted = Cart.objects.delete_abandoned(cutoff, options['batch_size'])
+            if not deleted:
+                break
+            batches += 1
+            for label, count in deleted.items():
+                reclaimed[label] = reclaimed.get(label, 0) + count
+            if options['pause']:
+                time.sleep(options['pause'])
+        for label, count in sorted(reclaimed.items()):
+            self.stdout.write('{}: {}'.format(label, count))
+        self.stdout.write(self.style.SUCCESS('Удалено брошенных корзин: {}, пачек: {}, строк всего: {}'.format(
+            reclaimed.get(Cart._meta.label, 0), batches, sum(reclaimed.values())
+        )))
+
+        if options['vacuum'] or options['analyze']:
+            self.maintain(options['vacuum'], options['analyze'])
+
+    def maintain(self, vacuum, analyze):
+        """
+        Функция выполняет VACUUM и/или ANALYZE. Обе команды выполняются вне транзакции
+        (соединение команды управления работает в режиме автофиксации).
+        """
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.stderr.write('VACUUM/ANALYZE не поддерживаются для базы данных {}'.format(connection.vendor))
+            return
+        if vacuum and connection.in_atomic_block:
+            self.stderr.write('VACUUM пропущен: команда выполняется внутри транзакции')
+            vacuum = False
+        with connection.cursor() as cursor:
+            if vacuum:
+                started = time.perf_counter()
+                cursor.execute('VACUUM')
+                self.stdout.write('VACUUM: {:.2f} с'.format(time.perf_counter() - started))
+            if analyze:
+                started = time.perf_counter()
+                cursor.execute('ANALYZE')
+                self.stdout.write('ANALYZE: {:.2f} с'.format(time.perf_counter() - started))
@@ -0,0 +1,109 @@
+import datetime
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import timezone
+
+from mainapp.images import RENDITIONS, RENDITION_FORMATS, rendition_name
+from mainapp.models import CatalogProduct
+from mainapp.storage import ContentAddressedStorage, get_reference_counts, product_image_storage
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы хэшированного хранилища изображений (и их варианты), на которые не ссылается ни один товар'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать файлы, которые будут удалены'
+        )
+        parser.add_argument(
+            '--min-age', type=float, default=24,
+            help='Не удалять файлы, измененные менее указанного количества часов назад: их может сохранять '
+                 'товар, транзакция которого еще не завершена'
+        )
+        parser.add_argument(
+            '--adopt-legacy', action='store_true',
+            help='Перенести изображения товаров со старыми именами в хэшированное хранилище и удалить старые копии'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Функция при необходимости переносит старые изображения в хэшированное хранилище, затем считает ссылки
+        на каждый файл и удаляет файлы без ссылок. Файлы моложе --min-age не удаляются: файл записывается
+        в хранилище до того, как транзакция товара со ссылкой на него завершится.
+        """
+        if options['min_age'] < 0:
+            raise CommandError('--min-age не может быть отрицательным')
+        storage = product_image_storage
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - datetime.timedelta(hours=options['min_age'])
+        legacy_names = self.adopt_legacy(storage, dry_run) if options['adopt_legacy'] else set()
+        references = get_reference_counts()
+
+        garbage = [name for name in self.list_stored_files(storage) if not references.get(name)]
+        garbage += sorted(name for name in legacy_names if not references.get(name))
+        garbage = [name for name in garbage if storage.get_modified_time(name) <= cutoff]
+        freed = 0
+        for name in garbage:
+            names = [name] + [
+                rendition_name(name, rendition, fmt) for rendition in RENDITIONS for fmt in RENDITION_FORMATS
+            ]
+            for file_name in names:
+                if not storage.exists(file_name):
+                    continue
+                freed += storage.size(file_name)
+                self.stdout.write(file_name)
+                if not dry_run:
+                    storage.delete(file_name)
+        self.stdout.write(self.style.SUCCESS(
+            '{} файлов без ссылок: {}, освобождено байт: {}'.format(
+                'Найдено' if dry_run else 'Удалено', len(garbage), freed
+            )
+        ))
+
+    def list_stored_files(self, storage):
+        """
+        Функция возвращает имена всех файлов хэшированного хранилища.
+        """
+        if not storage.exists(storage.DIRECTORY):
+            return []
+        names = []
+        directories, _ = storage.listdir(storage.DIRECTORY)
+        for directory in sorted(directories):
+            path = '{}/{}'.format(storage.DIRECTORY, directory)
+            names.extend('{}/{}'.format(path, file_name) for file_name in sorted(storage.listdir(path)[1]))
+        return names
+
+    def adopt_legacy(self, storage, dry_run):
+        """
+        Функция переносит изображения товаров со старыми (не хэшированными) именами в хэшированное хранилище.
+        Одинаковые файлы при этом сводятся к одному.
+        :return: Множество старых имен файлов.
+        """
+        legacy_names = set()
+        for model in apps.get_models():
+            for field in model._meta.concrete_fields:
+                if not isinstance(field, models.FileField) or not isinstance(field.storage, ContentAddressedStorage):
+                    continue
+                rows = model._base_manager.exclude(**{field.name: ''}).exclude(
+                    **{field.name + '__startswith': storage.DIRECTORY + '/'}
+                ).values_list('pk', field.name)
+                content_type = ContentType.objects.get_for_model(model)
+                for pk, name in rows:
+                    if not storage.exists(name):
+                        self.stderr.write('Файл не найден: {}'.format(name))
+                        continue
+                    legacy_names.add(name)
+                    if dry_run:
+                        continue
+                    with storage.open(name) as image_file:
+                        new_name = storage.save(name, image_file)
+                    with transaction.atomic():
+                        model._base_manager.filter(pk=pk).update(**{field.name: new_name})
+                        CatalogProduct.objects.filter(content_type=content_type, object_id=pk).update(image=new_name)
+        if legacy_names and not dry_run:
+            self.stdout.write('Изображения перенесены, для них можно запустить regenerate_renditions')
+        return legacy_names
@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.importer import ProductImporter
+
+
+class Command(BaseCommand):
+    help = 'Импортирует товары из файла каталога (CSV или JSON Lines) с папкой изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу каталога .csv или .jsonl')
+        parser.add_argument('--images', required=True, help='Папка с изображениями товаров')
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество строк в одной пачке')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Количество процессов, в которых обрабатываются изображения'
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['images']):
+            raise CommandError('Папка изображений не найдена: {}'.format(options['images']))
+        try:
+            with ProductImporter(options['images'], options['batch_size'], options['workers']) as importer:
+                importer.run(options['path'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        for number, message in importer.errors:
+            self.stderr.write('Строка {}: {}'.format(number, message))
+        self.stdout.write(self.style.SUCCESS('Создано товаров: {}, обновлено: {}, с ошибками: {}'.format(
+            importer.created, importer.updated, len(importer.errors)
+        )))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mainapp import search
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересоздает полнотекстовый поисковый индекс товаров (FTS5)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество документов в одной вставке'
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stderr.write('Поиск FTS5 доступен только для SQLite')
+            return
+        with transaction.atomic():
+            count = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Проиндексировано товаров: {}'.format(count)))
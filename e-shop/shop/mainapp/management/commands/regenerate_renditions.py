@@ -0,0 +1,37 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from mainapp.images import generate_renditions, setup_worker
+from mainapp.models import CatalogProduct
+
+
+class Command(BaseCommand):
+    help = 'Заново создает варианты (миниатюра, карточка, страница товара; JPEG и WebP) всех изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Количество процессов, в которых обрабатываются изображения'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Функция собирает имена изображений всех товаров из индекса каталога и обрабатывает их в пуле процессов.
+        """
+        image_names = sorted(set(
+            CatalogProduct.objects.exclude(image='').values_list('image', flat=True)
+        ))
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=setup_worker) as executor:
+            futures = {executor.submit(generate_renditions, name): name for name in image_names}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write('{}: {}'.format(futures[future], error))
+        self.stdout.write(self.style.SUCCESS(
+            'Обработано изображений: {}, с ошибками: {}'.format(len(image_names) - failed, failed)
+        ))
@@ -0,0 +1,163 @@
+import random
+from io import BytesIO
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from mainapp.importer import save_products
+from mainapp.models import Category, Dress, Skirt, Customer, Cart, CatalogProduct, Order, get_spec_fields
+from mainapp.storage import product_image_storage
+from mainapp.utils import add_to_cart
+
+
+User = get_user_model()
+
+# Значения характеристик, из которых собираются синтетические товары.
+STYLES = ('вечерний', 'повседневный', 'деловой', 'коктейльный', 'спортивный')
+STRUCTURES = ('хлопок', 'шелк', 'лен', 'вискоза', 'шерсть', 'полиэстер')
+CUTS = ('прямой', 'приталенный', 'свободный', 'асимметричный')
+SILHOUETTES = ('футляр', 'трапеция', 'а-силуэт', 'русалка', 'карандаш')
+COLORS = ('черный', 'белый', 'красный', 'синий', 'зеленый', 'бежевый', 'изумрудный')
+LENGTHS = ('мини', 'миди', 'макси')
+LANDINGS = ('высокая', 'средняя', 'низкая')
+# Значения для каждой характеристики товаров: имя поля -> варианты.
+SPEC_VALUES = {
+    'style': STYLES, 'structure': STRUCTURES, 'cut': CUTS, 'silhouette': SILHOUETTES, 'color': COLORS,
+    'length': LENGTHS, 'landing': LANDINGS,
+}
+# Количество товаров в одной пакетной вставке.
+PRODUCT_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическим каталогом (категории, платья, юбки), покупателями, корзинами и заказами '
+        'для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=5, help='Количество категорий')
+        parser.add_argument('--dresses', type=int, default=500, help='Количество платьев')
+        parser.add_argument('--skirts', type=int, default=500, help='Количество юбок')
+        parser.add_argument('--customers', type=int, default=50, help='Количество покупателей')
+        parser.add_argument('--carts', type=int, default=100, help='Количество открытых корзин')
+        parser.add_argument('--orders', type=int, default=50, help='Количество заказов')
+        parser.add_argument('--max-cart-lines', type=int, default=5, help='Максимальное количество строк в корзине')
+        parser.add_argument('--prefix', default='seed', help='Префикс slug и имен пользователей создаваемых объектов')
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        """
+        Функция создает все объекты в одной транзакции. Изображение не генерируется для каждого товара:
+        одна заглушка записывается в хэшированное хранилище и присваивается всем товарам по имени,
+        поэтому варианты изображений не создаются. Товары вставляются пачками, как при импорте каталога.
+        """
+        prefix = options['prefix']
+        if Category.objects.filter(slug__startswith=prefix + '-').exists():
+            raise CommandError('Объекты с префиксом "{}" уже созданы, укажите другой --prefix'.format(prefix))
+        if options['categories'] < 1 and options['dresses'] + options['skirts']:
+            raise CommandError('Для товаров нужна хотя бы одна категория')
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            image = self.create_stub_image()
+            categories = [
+                Category.objects.create(name='Категория {}'.format(number), slug='{}-category-{}'.format(prefix, number))
+                for number in range(options['categories'])
+            ]
+            self.create_products(rng, prefix, Dress, options['dresses'], categories, image)
+            self.create_products(rng, prefix, Skirt, options['skirts'], categories, image)
+            customers = self.create_customers(prefix, options['customers'])
+            carts = self.create_carts(rng, customers, options['carts'] + options['orders'], options['max_cart_lines'])
+            orders = self.create_orders(rng, carts[options['carts']:])
+        self.stdout.write(self.style.SUCCESS(
+            'Создано категорий: {}, платьев: {}, юбок: {}, покупателей: {}, корзин: {}, заказов: {}'.format(
+                len(categories), options['dresses'], options['skirts'], len(customers),
+                len(carts) - orders, orders
+            )
+        ))
+
+    @staticmethod
+    def create_stub_image():
+        """
+        Функция сохраняет одно маленькое изображение-заглушку и возвращает его имя в хранилище.
+        """
+        filestream = BytesIO()
+        Image.new('RGB', (10, 10), 'gray').save(filestream, 'JPEG')
+        return product_image_storage.save('seed.jpg', ContentFile(filestream.getvalue()))
+
+    @staticmethod
+    def create_products(rng, prefix, model, count, categories, image):
+        """
+        Функция создает товары модели пачками по PRODUCT_BATCH_SIZE через save_products импорта каталога:
+        пакетные вставки и пакетное обновление индексов каталога, поиска и фасетов вместо сигналов
+        сохранения каждого товара.
+        """
+        product_type = model._meta.model_name
+        rows = {}
+        for number in range(count):
+            fields = {
+                'category': rng.choice(categories),
+                'image': image,
+                'title': '{} {}'.format(product_type.capitalize(), number),
+                'slug': '{}-{}-{}'.format(prefix, product_type, number),
+                'description': 'Синтетический товар для нагрузочного тестирования',
+                'price': rng.randrange(1000, 50000, 50),
+            }
+            for _, attname in get_spec_fields(model):
+                fields[attname] = rng.choice(SPEC_VALUES[attname])
+            rows[fields['slug']] = fields
+            if len(rows) == PRODUCT_BATCH_SIZE:
+                save_products(model, rows)
+                rows = {}
+        if rows:
+            save_products(model, rows)
+
+    @staticmethod
+    def create_customers(prefix, count):
+        """
+        Функция создает пользователей без пароля и их профили покупателей пакетными вставками.
+        """
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(username='{}-user-{}'.format(prefix, number), password=password) for number in range(count)
+        ])
+        return Customer.objects.bulk_create([Customer(user=user) for user in users])
+
+    @staticmethod
+    def create_carts(rng, customers, count, max_lines):
+        """
+        Функция создает корзины случайных покупателей (или анонимные, если покупателей нет)
+        со случайными товарами из индекса каталога.
+        """
+        products = list(CatalogProduct.objects.all())
+        carts = []
+        for _ in range(count):
+            owner = rng.choice(customers) if customers else None
+            cart = Cart.objects.create(owner=owner, for_anonymous_user=owner is None)
+            for product in rng.sample(products, min(len(products), rng.randint(1, max(max_lines, 1)))):
+                add_to_cart(cart, product, qty=rng.randint(1, 3))
+            carts.append(cart)
+        return carts
+
+    @staticmethod
+    def create_orders(rng, carts):
+        """
+        Функция оформляет заказы по переданным корзинам (только корзинам покупателей).
+        :return: Количество созданных заказов.
+        """
+        count = 0
+        for cart in carts:
+            if cart.owner is None:
+                continue
+            order = Order(
+                customer=cart.owner, first_name='Имя', last_name='Фамилия',
+                phone='+7900{:07d}'.format(rng.randrange(10 ** 7)), address='Адрес',
+                status=rng.choice(Order.STATUS_CHOICES)[0], buying_type=rng.choice(Order.BUYING_TYPE_CHOICES)[0],
+            )
+            if Order.objects.place_order(order, cart) is not None:
+                count += 1
+        return count
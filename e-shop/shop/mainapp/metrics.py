@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+
+# Замер текущего запроса; рендеринг шаблонов (mainapp.template_backend) добавляет в него свое время.
+_current_sample = ContextVar('metrics_sample', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+    Счетчик в памяти процесса с набором меток (формат Prometheus: counter).
+    '''
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield '{}{} {}'.format(self.name, _format_labels(self.labels, label_values), _format_value(value))
+
+
+class Histogram(Counter):
+    '''
+    Гистограмма в памяти процесса: количество наблюдений по корзинам, сумма и общее количество
+    (формат Prometheus: histogram, корзины выводятся накопительно).
+    '''
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def get(self, *label_values):
+        """
+        :return: (количество наблюдений, сумма) для набора меток.
+        """
+        entry = self._values.get(label_values)
+        return (entry[2], entry[1]) if entry else (0, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items())
+        for label_values, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                yield '{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels, label_values, [('le', le)]), cumulative
+                )
+            yield '{}_sum{} {}'.format(self.name, _format_labels(self.labels, label_values), _format_value(total))
+            yield '{}_count{} {}'.format(self.name, _format_labels(self.labels, label_values), count)
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter('shop_requests_total', 'Количество обработанных запросов', ('view', 'status'))
+REQUEST_DURATION = Histogram(
+    'shop_request_duration_seconds', 'Полное время обработки запроса', DURATION_BUCKETS, ('view',)
+)
+DB_QUERIES = Histogram(
+    'shop_db_queries', 'Количество запросов к базе данных на один запрос', (1, 2, 5, 10, 20, 50, 100), ('view',)
+)
+DB_DURATION = Histogram(
+    'shop_db_duration_seconds', 'Время выполнения запросов к базе данных', DURATION_BUCKETS, ('view',)
+)
+TEMPLATE_DURATION = Histogram(
+    'shop_template_render_seconds', 'Время рендеринга шаблонов', DURATION_BUCKETS, ('view',)
+)
+RESPONSE_SIZE = Histogram(
+    'shop_response_size_bytes', 'Размер тела ответа', (1024, 10240, 102400, 1048576), ('view',)
+)
+
+METRICS = (REQUESTS, REQUEST_DURATION, DB_QUERIES, DB_DURATION, TEMPLATE_DURATION, RESPONSE_SIZE)
+
+
+class RequestSample:
+    '''
+    Контекстный менеджер замеряет один запрос: полное время, количество и время запросов ко всем базам
+    данных и время рендеринга шаблонов верхнего уровня (вложенные рендеринги не суммируются дважды).
+    '''
+
+    def __init__(self):
+        self.duration = 0.0
+        self.queries = 0
+        self.db_duration = 0.0
+        self.template_duration = 0.0
+        self.template_depth = 0
+        self._stack = None
+        self._token = None
+        self._started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_duration += time.perf_counter() - started
+
+    def __enter__(self):
+        self._wrap_connections()
+        self._token = _current_sample.set(self)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self._started
+        _current_sample.reset(self._token)
+        self._stack.close()
+
+    async def __aenter__(self):
+        # Обертки соединений устанавливаются в потоке синхронного кода запроса (см. QueryBudget.__aenter__).
+        await sync_to_async(self._wrap_connections)()
+        self._token = _current_sample.set(self)
+        self._started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.duration = time.perf_counter() - self._started
+        _current_sample.reset(self._token)
+        await sync_to_async(self._stack.close)()
+
+    def _wrap_connections(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+
+    def observe(self, view, response):
+        """
+        Функция добавляет замер в гистограммы процесса с меткой представления.
+        Счетчик запросов (REQUESTS) увеличивает промежуточный слой для каждого запроса, а не только замеренного.
+        """
+        REQUEST_DURATION.observe(self.duration, view)
+        DB_QUERIES.observe(self.queries, view)
+        DB_DURATION.observe(self.db_duration, view)
+        TEMPLATE_DURATION.observe(self.template_duration, view)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view)
+
+
+@contextmanager
+def template_timer():
+    """
+    Контекстный менеджер добавляет время рендеринга шаблона к замеру текущего запроса, если он есть.
+    """
+    sample = _current_sample.get()
+    if sample is None:
+        yield
+        return
+    sample.template_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.template_depth -= 1
+        if not sample.template_depth:
+            sample.template_duration += time.perf_counter() - started
+
+
+def render_metrics():
+    """
+    Функция возвращает все метрики процесса в текстовом формате Prometheus.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
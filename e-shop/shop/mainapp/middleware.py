@@ -0,0 +1,145 @@
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve, reverse
+
+from .metrics import REQUESTS, RequestSample
+from .query_budget import QueryBudget
+from .routers import use_primary
+
+
+logger = logging.getLogger('mainapp.query_budget')
+
+
+class AsyncCapableMiddleware:
+    '''
+    Основа промежуточных слоев, которые работают и в синхронной, и в асинхронной цепочке: под ASGI
+    асинхронные представления вызываются без перехода в поток. Наследник реализует __call__ и __acall__.
+    '''
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class QueryBudgetMiddleware(AsyncCapableMiddleware):
+    '''
+    Промежуточный слой сравнивает количество запросов к базе данных с бюджетом представления
+    (атрибут query_budget). При превышении он пишет в лог предупреждение с SQL, сгруппированным
+    по месту вызова (места вызова ищутся только для запросов сверх бюджета), и добавляет к ответу
+    заголовок X-Query-Budget-Exceeded: <запросов>/<бюджет>.
+    Включается настройкой QUERY_BUDGET_ENABLED (по умолчанию - только при DEBUG).
+    '''
+
+    HEADER = 'X-Query-Budget-Exceeded'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with self.get_budget(request) as budget:
+            response = self.get_response(request)
+        return self.check_budget(request, response, budget)
+
+    async def __acall__(self, request):
+        async with self.get_budget(request) as budget:
+            response = await self.get_response(request)
+        return self.check_budget(request, response, budget)
+
+    def get_budget(self, request):
+        """
+        Функция возвращает счетчик запросов с бюджетом представления, которое обработает запрос.
+        """
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return QueryBudget(collect_call_sites=False)
+        return QueryBudget(match.func, collect_call_sites=False)
+
+    def check_budget(self, request, response, budget):
+        if budget.exceeded:
+            logger.warning('%s %s: превышен бюджет запросов\n%s', request.method, request.path, budget.report())
+            response[self.HEADER] = '{}/{}'.format(len(budget), budget.budget)
+        return response
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    '''
+    Промежуточный слой считает все запросы по представлениям и кодам ответа, а для доли запросов
+    METRICS_SAMPLE_RATE (от 0 до 1) также замеряет время запроса, количество и время запросов к базе данных,
+    время рендеринга шаблонов и размер ответа и добавляет их в гистограммы процесса (см. mainapp.metrics)
+    с меткой представления. Остальные запросы проходят без накладных расходов на замеры, поэтому счетчик
+    запросов точен при любой доле. Отключается настройкой METRICS_ENABLED = False.
+    '''
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.observe(request, self.get_response(request))
+        with RequestSample() as sample:
+            response = self.get_response(request)
+        return self.observe(request, response, sample)
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return self.observe(request, await self.get_response(request))
+        async with RequestSample() as sample:
+            response = await self.get_response(request)
+        return self.observe(request, response, sample)
+
+    def is_sampled(self):
+        sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+        return sample_rate >= 1 or random.random() < sample_rate
+
+    def observe(self, request, response, sample=None):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        REQUESTS.inc(view, response.status_code)
+        if sample is not None:
+            sample.observe(view, response)
+        return response
+
+
+class PrimaryDatabaseMiddleware(AsyncCapableMiddleware):
+    '''
+    Промежуточный слой направляет все чтения запросов, которые изменяют данные (POST и другие небезопасные
+    методы), и запросов админки в основную базу данных (см. mainapp.routers.ReplicaRouter): такие запросы
+    должны видеть собственные записи, а реплика может отставать.
+    '''
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.needs_primary(request):
+            return self.get_response(request)
+        with use_primary():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self.needs_primary(request):
+            return await self.get_response(request)
+        with use_primary():
+            return await self.get_response(request)
+
+    def needs_primary(self, request):
+        return request.method not in self.SAFE_METHODS or request.path.startswith(reverse('admin:index'))
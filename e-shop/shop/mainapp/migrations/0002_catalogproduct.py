@@ -0,0 +1,67 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_catalog(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    CatalogProduct = apps.get_model('mainapp', 'CatalogProduct')
+    for model_name in ('dress', 'skirt'):
+        model = apps.get_model('mainapp', model_name)
+        content_type, _ = ContentType.objects.get_or_create(app_label='mainapp', model=model_name)
+        CatalogProduct.objects.bulk_create([
+            CatalogProduct(
+                content_type=content_type,
+                object_id=product.id,
+                product_type=model_name,
+                category_id=product.category_id,
+                title=product.title,
+                slug=product.slug,
+                price=product.price,
+                image=product.image.name,
+            )
+            for product in model.objects.order_by('id')
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('mainapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('product_type', models.CharField(max_length=100, verbose_name='Тип товара')),
+                ('title', models.CharField(max_length=255, verbose_name='Наименование')),
+                ('slug', models.SlugField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Цена')),
+                ('image', models.ImageField(upload_to='', verbose_name='Изображение')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.category', verbose_name='Категория')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['product_type', 'id'], name='catalog_type_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['category', 'id'], name='catalog_category_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogproduct',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='unique_catalog_product_object'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogproduct',
+            constraint=models.UniqueConstraint(fields=('product_type', 'slug'), name='unique_catalog_product_slug'),
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
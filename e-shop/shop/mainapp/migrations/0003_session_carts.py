@@ -0,0 +1,23 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0002_catalogproduct'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cartproduct',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='mainapp.customer', verbose_name='Покупатель'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['owner', 'in_order'], name='cart_owner_in_order_idx'),
+        ),
+    ]
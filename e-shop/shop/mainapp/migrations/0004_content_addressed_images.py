@@ -0,0 +1,24 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:03
+
+from django.db import migrations, models
+import mainapp.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_session_carts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dress',
+            name='image',
+            field=models.ImageField(storage=mainapp.storage.ContentAddressedStorage(), upload_to='', verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='skirt',
+            name='image',
+            field=models.ImageField(storage=mainapp.storage.ContentAddressedStorage(), upload_to='', verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    Cart = apps.get_model('mainapp', 'Cart')
+    CartProduct = apps.get_model('mainapp', 'CartProduct')
+    duplicates = CartProduct.objects.values('cart_id', 'content_type_id', 'object_id').annotate(
+        count=models.Count('id')
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        lines = list(CartProduct.objects.filter(
+            cart_id=duplicate['cart_id'],
+            content_type_id=duplicate['content_type_id'],
+            object_id=duplicate['object_id'],
+        ).order_by('id'))
+        kept, extra = lines[0], lines[1:]
+        kept.qty = sum(line.qty for line in lines)
+        kept.final_price = sum(line.final_price for line in lines)
+        kept.save()
+        CartProduct.objects.filter(id__in=[line.id for line in extra]).delete()
+    for cart in Cart.objects.filter(id__in=[duplicate['cart_id'] for duplicate in duplicates]):
+        totals = cart.products.aggregate(models.Sum('final_price'), models.Count('id'))
+        cart.final_price = totals['final_price__sum'] or 0
+        cart.total_products = totals['id__count']
+        cart.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartproduct',
+            constraint=models.UniqueConstraint(fields=('cart', 'content_type', 'object_id'), name='unique_cart_product_line'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_unique_cart_lines'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['category', 'price', 'id'], name='catalog_category_price_idx'),
+        ),
+    ]
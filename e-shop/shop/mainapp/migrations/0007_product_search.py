@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+SEARCH_TABLE = 'mainapp_product_search'
+SPEC_FIELDS = {
+    'dress': ('style', 'structure', 'cut', 'silhouette', 'color', 'length'),
+    'skirt': ('style', 'structure', 'cut', 'silhouette', 'landing', 'length'),
+}
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    CatalogProduct = apps.get_model('mainapp', 'CatalogProduct')
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE {} USING fts5("
+        "title, description, specs, tokenize = 'unicode61 remove_diacritics 2')".format(SEARCH_TABLE)
+    )
+    for model_name, spec_fields in SPEC_FIELDS.items():
+        model = apps.get_model('mainapp', model_name)
+        catalog_ids = dict(
+            CatalogProduct.objects.filter(product_type=model_name).values_list('object_id', 'id')
+        )
+        for product in model.objects.order_by('id'):
+            if product.id not in catalog_ids:
+                continue
+            schema_editor.execute(
+                'INSERT INTO {} (rowid, title, description, specs) VALUES (%s, %s, %s, %s)'.format(SEARCH_TABLE),
+                [
+                    catalog_ids[product.id], product.title, product.description or '',
+                    ' '.join(getattr(product, field) for field in spec_fields),
+                ]
+            )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE {}'.format(SEARCH_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_catalog_price_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
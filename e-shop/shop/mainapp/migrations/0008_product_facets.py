@@ -0,0 +1,59 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FACET_FIELDS = {
+    'dress': ('color', 'length', 'silhouette', 'cut', 'style'),
+    'skirt': ('length', 'silhouette', 'cut', 'style', 'landing'),
+}
+
+
+def fill_facets(apps, schema_editor):
+    CatalogProduct = apps.get_model('mainapp', 'CatalogProduct')
+    ProductFacet = apps.get_model('mainapp', 'ProductFacet')
+    for model_name, fields in FACET_FIELDS.items():
+        products = apps.get_model('mainapp', model_name).objects.in_bulk()
+        facets = []
+        for catalog_product in CatalogProduct.objects.filter(product_type=model_name):
+            product = products.get(catalog_product.object_id)
+            if product is None:
+                continue
+            for field in fields:
+                value = ' '.join(getattr(product, field).split()).lower()
+                if value:
+                    facets.append(ProductFacet(
+                        catalog_product=catalog_product, category_id=catalog_product.category_id,
+                        attribute=field, value=value
+                    ))
+        ProductFacet.objects.bulk_create(facets, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0007_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute', models.CharField(max_length=100, verbose_name='Атрибут')),
+                ('value', models.CharField(max_length=255, verbose_name='Значение')),
+                ('catalog_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='mainapp.catalogproduct', verbose_name='Товар каталога')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.category', verbose_name='Категория')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productfacet',
+            index=models.Index(fields=['category', 'attribute', 'value', 'catalog_product'], name='facet_posting_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productfacet',
+            constraint=models.UniqueConstraint(fields=('catalog_product', 'attribute'), name='unique_product_facet'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_orders(apps, schema_editor):
+    Order = apps.get_model('mainapp', 'Order')
+    OrderLine = apps.get_model('mainapp', 'OrderLine')
+    CartProduct = apps.get_model('mainapp', 'CartProduct')
+    CatalogProduct = apps.get_model('mainapp', 'CatalogProduct')
+    catalog = {
+        (product.content_type_id, product.object_id): product for product in CatalogProduct.objects.all()
+    }
+    for order in Order.objects.exclude(cart=None).iterator():
+        lines = []
+        for cart_product in CartProduct.objects.filter(cart_id=order.cart_id).order_by('id'):
+            product = catalog.get((cart_product.content_type_id, cart_product.object_id))
+            lines.append(OrderLine(
+                order=order,
+                product_type=product.product_type if product else '',
+                object_id=cart_product.object_id,
+                title=product.title if product else '',
+                price=cart_product.final_price / cart_product.qty if cart_product.qty else cart_product.final_price,
+                qty=cart_product.qty,
+            ))
+        OrderLine.objects.bulk_create(lines)
+        Order.objects.filter(pk=order.pk).update(final_price=sum(line.price * line.qty for line in lines))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_product_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_type', models.CharField(max_length=100, verbose_name='Тип товара')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Идентификатор товара')),
+                ('title', models.CharField(max_length=255, verbose_name='Наименование')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Цена')),
+                ('qty', models.PositiveIntegerField(verbose_name='Количество')),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='customer',
+            name='orders',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Сумма заказа'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='cart',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mainapp.cart', verbose_name='Корзина'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Дата создания заказа'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', '-created_at'], name='order_customer_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='mainapp.order', verbose_name='Заказ'),
+        ),
+        migrations.RunPython(snapshot_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0010_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['in_order', 'updated_at'], name='cart_in_order_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def set_journal_mode(schema_editor, mode):
+    # Режим журнала WAL хранится в самом файле базы данных, поэтому задается один раз, а не при каждом
+    # соединении. Сменить его можно только вне транзакции (миграция не атомарная).
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode = {}'.format(mode))
+
+
+def enable_wal(apps, schema_editor):
+    set_journal_mode(schema_editor, 'wal')
+
+
+def disable_wal(apps, schema_editor):
+    set_journal_mode(schema_editor, 'delete')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('mainapp', '0012_modification_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -1,57 +1,312 @@
+import asyncio
+import hashlib
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.http import Http404
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.functional import cached_property
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic import View
 
-from .models import Category, Cart, Customer, Dress, Skirt
+from .models import Category, Cart, Customer, CatalogProduct, ProductFacet
+from .fragments import aget_or_render_fragment, get_or_render_fragment
+from .utils import (
+    CART_SESSION_KEY, CART_TOTAL_SESSION_KEY, CART_CHANGED_SESSION_KEY, remember_cart, forget_cart
+)
 
 
 class CategoryDetailMixin(SingleObjectMixin):
 
-    # Словарь, который сопоставляет категорию slug с моделью продукта.
-    CATEGORY_SLUG2PRODUCT_MODEL = {
-        'dress': Dress,
-        'skirt': Skirt
-    }
+    # Максимальное количество выбранных значений одного фасета.
+    MAX_FACET_VALUES = 20
+
+    # Названия порядков сортировки страницы категории.
+    SORT_CHOICES = (
+        (CatalogProduct.objects.SORT_NEWEST, 'Новинки'),
+        (CatalogProduct.objects.SORT_PRICE_ASC, 'Сначала дешевле'),
+        (CatalogProduct.objects.SORT_PRICE_DESC, 'Сначала дороже'),
+    )
+
+    def get_sort(self):
+        """
+        Функция возвращает порядок сортировки из параметра sort (по умолчанию - новинки).
+        """
+        sort = self.request.GET.get('sort')
+        return sort if sort in CatalogProduct.objects.SORT_ORDERS else CatalogProduct.objects.SORT_NEWEST
+
+    def get_cursor(self):
+        """
+        Функция возвращает курсор страницы из параметра after (некорректный курсор означает первую страницу).
+        """
+        return CatalogProduct.objects.parse_cursor(self.request.GET.get('after'))
+
+    def get_selected_facets(self):
+        """
+        Функция возвращает выбранные фасеты из параметров запроса (например, ?color=черный&length=макси)
+        в нормализованном и упорядоченном виде.
+        :return: Словарь {атрибут: отсортированный список значений}.
+        """
+        selected = {}
+        for attribute in ProductFacet.objects.FACET_FIELDS:
+            values = {ProductFacet.objects.normalize(value) for value in self.request.GET.getlist(attribute)}
+            values.discard('')
+            if values:
+                selected[attribute] = sorted(values)[:self.MAX_FACET_VALUES]
+        return selected
+
+    def get_filter_query(self):
+        """
+        Функция возвращает выбранные фасеты в виде строки параметров для ссылок сортировки и пагинации.
+        """
+        return urlencode([
+            (attribute, value) for attribute, values in self.get_selected_facets().items() for value in values
+        ])
 
     def get_context_data(self, **kwargs):
         """
-        Если объект является категорией, то получите модель из словаря, получите контекстные данные из
-        суперкласс, получите категории для левой боковой панели и получите продукты для категории
+        Если объект является категорией, то получите контекстные данные из суперкласса, одну страницу
+        продуктов всех типов для категории из индекса каталога (с сортировкой, фасетами и курсором следующей
+        страницы) и количество товаров для каждого значения фасетов
         :return: Контекст возвращается.
         """
-        if isinstance(self.get_object(), Category):
-            model = self.CATEGORY_SLUG2PRODUCT_MODEL[self.get_object().slug]
-            context = super().get_context_data(**kwargs)
-            context['categories'] = Category.objects.get_categories_for_left_sidebar()
-            context['category_products'] = model.objects.all()
-            return context
-        # Получение контекста из суперкласса, а затем добавление категорий в контекст.
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.get_categories_for_left_sidebar()
+        if isinstance(self.object, Category):
+            sort = self.get_sort()
+            selected = self.get_selected_facets()
+            products, next_cursor = CatalogProduct.objects.get_category_page(
+                self.object, sort, self.get_cursor(), facets=selected
+            )
+            labels = ProductFacet.objects.get_labels()
+            context['category_products'] = products
+            context['next_cursor'] = next_cursor
+            context['sort'] = sort
+            context['sort_choices'] = self.SORT_CHOICES
+            context['filter_query'] = self.get_filter_query()
+            context['facets'] = [
+                {
+                    'attribute': attribute,
+                    'label': labels.get(attribute, attribute),
+                    'values': [
+                        (value, count, value in selected.get(attribute, ())) for value, count in values
+                    ],
+                }
+                for attribute, values in ProductFacet.objects.get_counts(self.object, selected).items()
+            ]
         return context
 
 
-class CartMixin(View):
+class ConditionalPageMixin:
+    '''
+    Условные ответы (304 Not Modified) для страниц каталога. Валидаторы вычисляются без отрисовки страницы:
+    страница зависит только от каталога и значка корзины, а любое изменение каталога меняет время
+    изменения одной из категорий (см. CategoryManager.touch) и сбрасывает кэш боковой панели, в которой
+    это время хранится. Поэтому ETag - хэш данных боковой панели и значка корзины, а Last-Modified -
+    наибольшее из времени изменения категорий и времени изменения значка корзины.
+    '''
+
+    def get_validators(self, categories):
+        """
+        Функция возвращает валидаторы страницы.
+        :param categories: Данные левой боковой панели (Category.objects.get_categories_for_left_sidebar).
+        :return: (ETag, Last-Modified) или (None, None), если страница не должна отвечать 304.
+        """
+        session = self.request.session
+        # Ожидающие сообщения показываются (и удаляются) только при отрисовке страницы.
+        if len(get_messages(self.request)):
+            return None, None
+        cart_total = session.get(CART_TOTAL_SESSION_KEY, 0)
+        cart_changed = session.get(CART_CHANGED_SESSION_KEY, 0)
+        data = repr((self.request.get_full_path(), categories, cart_total, cart_changed)).encode()
+        last_modified = max([category['updated_at'].timestamp() for category in categories] + [cart_changed])
+        return quote_etag(hashlib.sha256(data).hexdigest()[:32]), last_modified
+
+    def get_not_modified_response(self, categories):
+        """
+        Функция возвращает ответ 304 (или 412), если у клиента актуальная версия страницы, иначе None.
+        Вычисленные валидаторы запоминаются для set_validators.
+        """
+        self.etag, self.last_modified = self.get_validators(categories)
+        if self.etag is None:
+            return None
+        return get_conditional_response(self.request, etag=self.etag, last_modified=int(self.last_modified))
+
+    def set_validators(self, response):
+        """
+        Функция добавляет к полному ответу ETag и Last-Modified. Клиент и промежуточный кэш должны
+        проверять страницу перед каждым использованием (Cache-Control: no-cache).
+        """
+        if getattr(self, 'etag', None) is not None and response.status_code == 200:
+            response['ETag'] = self.etag
+            response['Last-Modified'] = http_date(self.last_modified)
+            patch_cache_control(response, no_cache=True)
+        return response
+
+
+class CachedBodyMixin(ConditionalPageMixin):
+
+    # Шаблон основной части страницы, вид объекта для версии фрагмента и формат ключа объекта
+    # (подставляются именованные параметры URL).
+    body_template_name = None
+    fragment_kind = None
+    fragment_key_format = '{slug}'
+
+    def get_fragment_key(self):
+        """
+        Функция возвращает ключ объекта страницы, по которому хранится версия фрагмента.
+        """
+        return self.fragment_key_format.format(**self.kwargs)
+
+    def get_fragment_name(self):
+        """
+        Функция возвращает имя фрагмента. Если основная часть страницы зависит от параметров запроса,
+        они должны входить в имя.
+        """
+        return self.body_template_name
 
-    def dispatch(self, request, *args, **kwargs):
+    def get(self, request, *args, **kwargs):
         """
-        Если пользователь вошел в систему, мы проверяем, есть ли у него корзина, если нет, мы ее создаем.
-        Если пользователь не вошёл в систему, мы проверяем, есть ли у него корзина, если нет, мы создаем ее.
+        Основная часть страницы берется из кэша для текущей версии объекта: при попадании в кэш нет ни
+        запросов к базе, ни отрисовки шаблона товара или категории. Вне фрагмента остаются боковая панель
+        (у нее свой кэш) и значок корзины пользователя. Если у клиента актуальная версия страницы,
+        возвращается 304 без обращения к фрагменту.
         :param request: Объект запроса.
-        :return: Возвращается метод super().dispatch().
+        :return: Страница возвращается.
+        """
+        categories = Category.objects.get_categories_for_left_sidebar()
+        response = self.get_not_modified_response(categories)
+        if response is not None:
+            return response
+        body = get_or_render_fragment(
+            self.get_fragment_name(), self.fragment_kind, self.get_fragment_key(), self.render_body
+        )
+        context = {
+            'categories': categories,
+            'body': body,
+        }
+        return self.set_validators(render(request, self.template_name, context))
+
+    def render_body(self):
+        """
+        Функция отрисовывает основную часть страницы без запроса, чтобы в нее не попали данные пользователя.
+        """
+        self.object = self.get_object()
+        return self.render_object_body()
+
+    def render_object_body(self):
+        """
+        Функция отрисовывает основную часть страницы для уже загруженного объекта.
+        """
+        return render_to_string(self.body_template_name, self.get_context_data(object=self.object))
+
+
+class AsyncRenderMixin(ConditionalPageMixin):
+
+    async def aload_request_state(self):
+        """
+        Функция заранее загружает сессию и пользователя запроса (обращения к базе данных), чтобы шаблон
+        страницы можно было отрисовать в цикле событий без синхронных запросов.
+        """
+        request = self.request
+        await sync_to_async(lambda: (request.session.get(CART_TOTAL_SESSION_KEY), request.user.is_authenticated))()
+
+    async def arender(self, template_name, *lookups):
+        """
+        Функция одновременно загружает сессию с пользователем и боковую панель и проверяет валидаторы страницы;
+        если у клиента нет актуальной версии, одновременно выполняет переданные асинхронные выборки,
+        добавляет их результаты в контекст и отрисовывает страницу.
+        :param lookups: Пары (ключ контекста, асинхронная функция без аргументов).
+        :return: Страница или ответ 304 возвращается.
+        """
+        _, categories = await asyncio.gather(
+            self.aload_request_state(), Category.objects.aget_categories_for_left_sidebar()
+        )
+        response = self.get_not_modified_response(categories)
+        if response is not None:
+            return response
+        results = await asyncio.gather(*(lookup() for _, lookup in lookups))
+        context = dict(zip((key for key, _ in lookups), results), categories=categories)
+        return self.set_validators(render(self.request, template_name, context))
+
+
+class AsyncCachedBodyMixin(AsyncRenderMixin):
+    '''
+    Асинхронный вариант CachedBodyMixin для представлений с одним объектом (DetailView). Сессия
+    с пользователем и боковая панель загружаются одновременно, затем проверяются валидаторы страницы,
+    затем берется основная часть; объект страницы читается асинхронным ORM, а контекст основной части,
+    которому нужны синхронные выборки, строится в потоке.
+    Синхронные запросы одного запроса выполняются одним соединением по очереди, поэтому выигрыш - в том,
+    что ожидание базы данных, кэша и медленного клиента не занимает поток сервера.
+    '''
+
+    async def get(self, request, *args, **kwargs):
+        return await self.arender(self.template_name, ('body', self.aget_body))
+
+    async def aget_body(self):
+        return await aget_or_render_fragment(
+            self.get_fragment_name(), self.fragment_kind, self.get_fragment_key(), self.arender_body
+        )
+
+    async def aget_object(self):
+        """
+        Функция находит объект страницы по slug асинхронным ORM.
+        """
+        queryset = self.get_queryset()
+        try:
+            return await queryset.aget(**{self.get_slug_field(): self.kwargs[self.slug_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404('Объект не найден')
+
+    async def arender_body(self):
+        self.object = await self.aget_object()
+        return await sync_to_async(self.render_object_body)()
+
+
+class CartMixin(View):
+
+    @cached_property
+    def cart(self):
         """
+        Функция находит открытую корзину по идентификатору из сессии одним запросом.
+        Если в сессии нет корзины, для вошедшего пользователя ищется его открытая корзина.
+        Если корзины нет, возвращается пустая несохраненная корзина: она будет создана только при первом
+        изменении (см. get_cart_for_update).
+        :return: Объект корзины.
+        """
+        request = self.request
+        carts = Cart.objects.filter(in_order=False)
         if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
-            if not customer:
-                customer = Customer.objects.create(
-                    user=request.user
-                )
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
-            if not cart:
-                cart = Cart.objects.create(owner=customer)
+            carts = carts.filter(owner__user=request.user)
+        else:
+            carts = carts.filter(owner__isnull=True)
+        cart_id = request.session.get(CART_SESSION_KEY)
+        if cart_id is not None:
+            cart = carts.filter(pk=cart_id).first()
+        elif request.user.is_authenticated:
+            cart = carts.order_by('-id').first()
         else:
-            cart = Cart.objects.filter(for_anonymous_user=True).first()
-            if not cart:
-                cart = Cart.objects.create(for_anonymous_user=True)
-        self.cart = cart
-        return super().dispatch(request, *args, **kwargs)
+            cart = None
+        if cart is None:
+            forget_cart(request.session)
+            return Cart(for_anonymous_user=not request.user.is_authenticated)
+        if cart_id is None:
+            remember_cart(request.session, cart)
+        return cart
 
+    def get_cart_for_update(self):
+        """
+        Функция возвращает сохраненную корзину, создавая ее (и покупателя) при первом изменении корзины.
+        У каждой анонимной сессии своя корзина.
+        :return: Объект корзины.
+        """
+        cart = self.cart
+        if cart.pk is None:
+            if self.request.user.is_authenticated:
+                cart.owner, _ = Customer.objects.get_or_create(user=self.request.user)
+            cart.save()
+            remember_cart(self.request.session, cart)
+        return cart
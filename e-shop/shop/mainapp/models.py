@@ -1,27 +1,22 @@
-import sys
-from PIL import Image
-from django.db import models
+from django.apps import apps
+from django.db import models, router, transaction
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.functions import Coalesce
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.urls import reverse
 from django.utils import timezone
-from io import BytesIO
+from decimal import Decimal
+
+from .images import schedule_renditions, renditions_ready
+from .routers import use_primary
+from .storage import product_image_storage
 
 '''C помощью этой команды, мы говорим django, что хотим использовать именно того пользователя, который указан в settings_AUTH_USER_MODEL'''
 User = get_user_model()
 
 
-def get_models_for_count(*model_names):
-    '''
-    Функция принимает переменное количество аргументов и возвращает список объектов `Count`, по одному для каждого аргумента
-    :возвращает: список объектов Count.
-
-    '''
-    return [models.Count(model_name) for model_name in model_names]
-
-
 def get_product_url(obj, viewname):
     '''
     
@@ -36,27 +31,74 @@ def get_product_url(obj, viewname):
     return reverse(viewname, kwargs={'ct_model': ct_model, 'slug': obj.slug})
 
 
+# Характеристики моделей товаров, вычисленные один раз для каждой модели: model -> [(verbose_name, имя поля)].
+_spec_fields = {}
+
+
+def get_spec_fields(model):
+    '''
+    Функция возвращает характеристики модели товара, построенные по метаданным ее полей (verbose_name).
+    Общие для всех товаров поля (категория, название, цена и т.д.) в характеристики не входят.
+    :param model: Класс модели товара.
+    :возвращает: список пар (название, имя поля).
+    '''
+    if model not in _spec_fields:
+        common_fields = {'id'} | {field.name for field in Product._meta.fields}
+        _spec_fields[model] = [
+            (str(field.verbose_name), field.attname)
+            for field in model._meta.concrete_fields
+            if field.name not in common_fields
+        ]
+    return _spec_fields[model]
+
+
 class LatestProductsManager:
 
     @staticmethod
     def get_products_for_main_page(*args, **kwargs):
         '''
-        Функция возвращает список объектов заданных моделей, отсортированных по названию модели
-        :возвращает: список объектов разных типов.
+        Функция возвращает последние товары заданных моделей из индекса каталога одним запросом.
+        Товары модели with_respect_to (если она передана) идут первыми.
+        :возвращает: список объектов CatalogProduct.
+        '''
+        return list(LatestProductsManager._get_main_page_queryset(*args, **kwargs))
+
+    @staticmethod
+    async def aget_products_for_main_page(*args, **kwargs):
+        '''
+        Асинхронный вариант get_products_for_main_page.
+        :возвращает: список объектов CatalogProduct.
         '''
+        return [product async for product in LatestProductsManager._get_main_page_queryset(*args, **kwargs)]
+
+    # Количество последних товаров каждой модели на главной странице.
+    MAIN_PAGE_LIMIT = 5
+
+    @staticmethod
+    def _get_main_page_queryset(*args, **kwargs):
+        # Для каждой модели - свой некоррелированный подзапрос с LIMIT по индексу (product_type, id): он
+        # выполняется один раз и читает MAIN_PAGE_LIMIT строк, а строки товаров выбираются по первичному ключу
+        # (MULTI-INDEX OR), поэтому время запроса не зависит от размера каталога.
         with_respect_to = kwargs.get('with_respect_to')
-        products = []
-        ct_models = ContentType.objects.filter(model__in=args)
-        for ct_model in ct_models:
-            model_products = ct_model.model_class()._base_manager.all().order_by('-id')[:5]
-            products.extend(model_products)
-        if with_respect_to:
-            ct_model = ContentType.objects.filter(model=with_respect_to)
-            if ct_model.exists():
-                if with_respect_to in args:
-                    return sorted(
-                        products, key=lambda x: x.__class__._meta.model_name.startswith(with_respect_to), reverse=True
-                    )
+        if not args:
+            return CatalogProduct.objects.none()
+        condition = models.Q()
+        for product_type in args:
+            latest_ids = CatalogProduct.objects.filter(
+                product_type=product_type
+            ).order_by('-id').values('id')[:LatestProductsManager.MAIN_PAGE_LIMIT]
+            condition |= models.Q(id__in=models.Subquery(latest_ids))
+        products = CatalogProduct.objects.filter(condition)
+        if with_respect_to in args:
+            products = products.annotate(
+                is_preferred=models.Case(
+                    models.When(product_type=with_respect_to, then=models.Value(0)),
+                    default=models.Value(1),
+                    output_field=models.IntegerField()
+                )
+            ).order_by('is_preferred', '-id')
+        else:
+            products = products.order_by('-id')
         return products
 
 
@@ -70,10 +112,9 @@ class LatestProducts:
 # Класс, который используется для управления категориями.
 class CategoryManager(models.Manager):
 
-    CATEGORY_NAME_COUNT_NAME = {
-        'Платья': 'dress__count',
-        'Юбки': 'skirt__count'
-    }
+    # Ключ и время жизни (в секундах) кэша готовой структуры левой боковой панели.
+    SIDEBAR_CACHE_KEY = 'mainapp:sidebar_categories'
+    SIDEBAR_CACHE_TIMEOUT = 60 * 60
 
     def get_queryset(self):
         '''
@@ -83,21 +124,64 @@ class CategoryManager(models.Manager):
         '''
         return super().get_queryset()
 
-      '''
-
-    Функция получает категории для левой боковой панели и аннотирует их количеством платьев и юбок в каждой категории
-    :возвращает: список словарей. 
-    
-      '''
     def get_categories_for_left_sidebar(self):
-        models = get_models_for_count('dress', 'skirt')
-        qs = list(self.get_queryset().annotate(*models))
-        data = [
-            dict(name=c.name, url=c.get_absolute_url(), count=getattr(c, self.CATEGORY_NAME_COUNT_NAME[c.name]))
-            for c in qs
-        ]
+        '''
+        Функция получает категории для левой боковой панели с количеством товаров в каждой категории.
+        Количество считается независимым подзапросом к индексу каталога, готовая структура хранится в кэше
+        и сбрасывается сигналами при сохранении и удалении товаров и категорий. Кэш заполняется из основной
+        базы данных: промах обычно следует сразу за записью, а реплика может отставать, и устаревшие данные
+        остались бы в кэше на SIDEBAR_CACHE_TIMEOUT.
+        :возвращает: список словарей (name, url, count, updated_at).
+        '''
+        data = cache.get(self.SIDEBAR_CACHE_KEY)
+        if data is None:
+            with use_primary():
+                data = [self._sidebar_item(c) for c in self._get_sidebar_queryset()]
+            cache.set(self.SIDEBAR_CACHE_KEY, data, self.SIDEBAR_CACHE_TIMEOUT)
+        return data
+
+    async def aget_categories_for_left_sidebar(self):
+        '''
+        Асинхронный вариант get_categories_for_left_sidebar (тот же кэш).
+        :возвращает: список словарей.
+        '''
+        data = await cache.aget(self.SIDEBAR_CACHE_KEY)
+        if data is None:
+            with use_primary():
+                data = [self._sidebar_item(c) async for c in self._get_sidebar_queryset()]
+            await cache.aset(self.SIDEBAR_CACHE_KEY, data, self.SIDEBAR_CACHE_TIMEOUT)
         return data
 
+    @staticmethod
+    def _sidebar_item(category):
+        return dict(
+            name=category.name, url=category.get_absolute_url(), count=category.count, updated_at=category.updated_at
+        )
+
+    def _get_sidebar_queryset(self):
+        product_count = CatalogProduct.objects.filter(
+            category=models.OuterRef('pk')
+        ).order_by().values('category').annotate(count=models.Count('id')).values('count')
+        return self.get_queryset().annotate(
+            count=Coalesce(models.Subquery(product_count), 0)
+        ).order_by('id')
+
+    def invalidate_sidebar(self):
+        '''
+        Функция сбрасывает кэш левой боковой панели.
+        '''
+        cache.delete(self.SIDEBAR_CACHE_KEY)
+
+    def touch(self, category_ids):
+        '''
+        Функция отмечает категории измененными (например, после изменения или удаления их товаров).
+        Время изменения категорий входит в валидаторы страниц каталога (ETag, Last-Modified).
+        :param category_ids: Идентификаторы категорий.
+        '''
+        category_ids = {category_id for category_id in category_ids if category_id is not None}
+        if category_ids:
+            self.filter(pk__in=category_ids).update(updated_at=timezone.now())
+
 
 ''' 
 Класс Category является подклассом класса Model. 
@@ -114,6 +198,8 @@ class Category(models.Model):
 
     name = models.CharField(max_length=255, verbose_name='Имя категории')
     slug = models.SlugField(unique=True)
+    # Время последнего изменения категории или любого ее товара (см. CategoryManager.touch).
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
     objects = CategoryManager()
 
     def __str__(self):
@@ -131,6 +217,7 @@ class Category(models.Model):
 : image - изображение
 : description - описание товара
 : price - стоимость
+: updated_at - время последнего изменения
 
 '''
 class Product(models.Model):
@@ -141,9 +228,10 @@ class Product(models.Model):
     category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE)
     title = models.CharField(max_length=255, verbose_name='Наименование')
     slug = models.SlugField(unique=True)
-    image = models.ImageField(verbose_name='Изображение')
+    image = models.ImageField(verbose_name='Изображение', storage=product_image_storage)
     description = models.TextField(verbose_name='Описание', null=True)
     price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
     def __str__(self):
         return self.title
@@ -155,25 +243,17 @@ class Product(models.Model):
         '''
         return self.__class__.__name__.lower()
 
+    def save(self, *args, **kwargs):
         """
-        
-        Он берет изображение, преобразует его в RGB, изменяет его размер, сохраняет его в filestream, а затем сохраняет filestream в поле image
-        
+        Исходное изображение сохраняется как есть в хэшированном хранилище (одинаковые файлы хранятся один раз).
+        Если изображение было загружено заново и для него еще нет вариантов, после сохранения
+        его варианты (миниатюра, карточка, страница товара в JPEG и WebP) создаются в фоновом пуле.
+        Сохранения без нового изображения (например, смена цены) изображение не трогают.
         """
-    def save(self, *args, **kwargs):
-        image = self.image
-        img = Image.open(image)
-        new_img = img.convert('RGB')
-        resized_new_img = new_img.resize((400, 400), Image.ANTIALIAS)
-        filestream = BytesIO()
-        resized_new_img.save(filestream, 'JPEG', quality=90)
-        filestream.seek(0)
-        name = '{}.{}'.format(*self.image.name.split('.'))
-        print(self.image. name, name)
-        self.image = InMemoryUploadedFile(
-            filestream, 'ImageField', name, 'jpeg/image', sys.getsizeof(filestream), None
-        )
+        image_changed = bool(self.image) and not self.image._committed
         super().save(*args, **kwargs)
+        if image_changed and not renditions_ready(self.image.name):
+            schedule_renditions(self.image.name)
 
 
 '''Платье - наш продукт, который имеет стиль, структуру, крой, силуэт, цвет и длину.'''
@@ -231,10 +311,351 @@ class Skirt(Product):
         return get_product_url(self, 'product_detail')
 
 
+def get_product_models():
+    '''
+    Функция возвращает модели товаров - все установленные модели-наследники Product (Dress, Skirt, ...).
+    Индекс каталога, поиск и импорт берут список моделей отсюда, поэтому новая модель товара подключается
+    к ним без изменения их кода.
+    :возвращает: список классов моделей.
+    '''
+    return [model for model in apps.get_models() if issubclass(model, Product)]
+
+
+# Класс, который используется для управления индексом каталога.
+class CatalogProductManager(models.Manager):
+
+    # Порядки сортировки страницы категории: имя -> поля ORDER BY (последнее поле - id для однозначности).
+    SORT_NEWEST = 'new'
+    SORT_PRICE_ASC = 'price'
+    SORT_PRICE_DESC = '-price'
+    SORT_ORDERS = {
+        SORT_NEWEST: ('-id',),
+        SORT_PRICE_ASC: ('price', 'id'),
+        SORT_PRICE_DESC: ('-price', '-id'),
+    }
+    CATEGORY_PAGE_SIZE = 12
+
+    def sync_product(self, product):
+        '''
+        Функция создает или обновляет строку индекса каталога для переданного товара.
+        :param product: Объект Dress, Skirt или другой модели-наследника Product.
+        :возвращает: объект CatalogProduct.
+        '''
+        catalog_product, _ = self.update_or_create(
+            content_type=ContentType.objects.get_for_model(product),
+            object_id=product.pk,
+            defaults={
+                'product_type': product.get_model_name(),
+                'category_id': product.category_id,
+                'title': product.title,
+                'slug': product.slug,
+                'price': product.price,
+                'image': product.image.name,
+            }
+        )
+        return catalog_product
+
+    def sync_products(self, products):
+        '''
+        Функция создает или обновляет строки индекса каталога для пачки товаров одной модели
+        (одна вставка с обновлением при конфликте и один запрос для чтения строк).
+        :param products: Список сохраненных объектов одной модели-наследника Product.
+        :возвращает: словарь {id товара: CatalogProduct}.
+        '''
+        if not products:
+            return {}
+        content_type = ContentType.objects.get_for_model(products[0])
+        self.bulk_create(
+            [
+                CatalogProduct(
+                    content_type=content_type, object_id=product.pk, product_type=product.get_model_name(),
+                    category_id=product.category_id, title=product.title, slug=product.slug,
+                    price=product.price, image=product.image.name,
+                )
+                for product in products
+            ],
+            update_conflicts=True, unique_fields=['content_type', 'object_id'],
+            update_fields=['product_type', 'category', 'title', 'slug', 'price', 'image'],
+        )
+        return {
+            catalog_product.object_id: catalog_product
+            for catalog_product in self.filter(
+                content_type=content_type, object_id__in=[product.pk for product in products]
+            )
+        }
+
+    def get_products_by_slugs(self, keys):
+        '''
+        Функция находит товары сразу по нескольким парам (имя модели, slug) одним запросом.
+        :param keys: Итерируемый объект пар (product_type, slug).
+        :возвращает: словарь {(product_type, slug): CatalogProduct}.
+        '''
+        condition = models.Q()
+        for product_type, slug in set(keys):
+            condition |= models.Q(product_type=product_type, slug=slug)
+        if not condition:
+            return {}
+        return {(product.product_type, product.slug): product for product in self.filter(condition)}
+
+    def get_cart_lines(self, cart):
+        '''
+        Функция возвращает товары корзины из индекса каталога с количеством из строк корзины одним запросом
+        (без обхода GenericForeignKey строк корзины). Запрос читает строки корзины, поэтому выполняется
+        в основной базе данных, а не в реплике каталога.
+        :param cart: Сохраненный объект корзины.
+        :возвращает: список объектов CatalogProduct с атрибутом qty.
+        '''
+        cart_lines = CartProduct.objects.filter(
+            cart=cart, content_type=models.OuterRef('content_type'), object_id=models.OuterRef('object_id')
+        )
+        return list(
+            self.using(router.db_for_write(CartProduct))
+            .annotate(qty=models.Subquery(cart_lines.values('qty')[:1]))
+            .filter(qty__isnull=False).order_by('id')
+        )
+
+    def get_category_page(self, category, sort=SORT_NEWEST, cursor=None, page_size=CATEGORY_PAGE_SIZE,
+                          facets=None):
+        '''
+        Функция возвращает одну страницу товаров категории с пагинацией по ключу (keyset): вместо OFFSET
+        запрос продолжает выборку после последнего показанного товара, поэтому стоимость страницы не зависит
+        от ее номера и размера каталога.
+        :param category: Объект категории.
+        :param sort: Порядок сортировки из SORT_ORDERS.
+        :param cursor: Курсор, полученный с предыдущей страницы (см. parse_cursor), или None.
+        :param page_size: Количество товаров на странице.
+        :param facets: Выбранные фасеты {атрибут: список значений} или None.
+        :возвращает: (список товаров, курсор следующей страницы или None).
+        '''
+        products = self.filter(category=category).order_by(*self.SORT_ORDERS[sort])
+        if facets:
+            products = ProductFacet.objects.filter_products(products, category, facets)
+        if cursor is not None:
+            price, pk = cursor
+            if sort == self.SORT_NEWEST:
+                products = products.filter(id__lt=pk)
+            # Граница price__gte (price__lte) повторяет условие OR в форме, по которой SQLite ищет в индексе
+            # (category, price, id) диапазон цен, а не просматривает все товары категории.
+            elif sort == self.SORT_PRICE_ASC:
+                products = products.filter(
+                    models.Q(price__gt=price) | models.Q(price=price, id__gt=pk), price__gte=price
+                )
+            else:
+                products = products.filter(
+                    models.Q(price__lt=price) | models.Q(price=price, id__lt=pk), price__lte=price
+                )
+        products = list(products[:page_size + 1])
+        if len(products) <= page_size:
+            return products, None
+        last = products[page_size - 1]
+        return products[:page_size], '{}_{}'.format(last.price, last.id)
+
+    @staticmethod
+    def parse_cursor(value):
+        '''
+        Функция разбирает курсор вида "<цена>_<id>".
+        :возвращает: (Decimal, int) или None, если курсор не задан или некорректен.
+        '''
+        try:
+            price, pk = value.split('_')
+            return Decimal(price).quantize(Decimal('0.01')), int(pk)
+        except (AttributeError, ValueError, ArithmeticError):
+            return None
+
+    def remove_product(self, product):
+        '''
+        Функция удаляет строку индекса каталога для переданного товара.
+        :param product: Объект Dress, Skirt или другой модели-наследника Product.
+        '''
+        self.filter(
+            content_type=ContentType.objects.get_for_model(product), object_id=product.pk
+        ).delete()
+
+
+''' 
+Товар каталога - денормализованная строка индекса, по одной на каждый Dress, Skirt или другой товар.
+Позволяет главной странице, страницам категорий и корзине читать товары всех типов одним запросом.
+: content_type, object_id - ссылка на исходный товар
+: product_type - имя модели товара ('dress', 'skirt')
+: category, title, slug, price, image - копии полей исходного товара
+Порядок создания определяется первичным ключом строки индекса.
+Строки поддерживаются в актуальном состоянии сигналами post_save и post_delete (см. signals.py).
+
+'''
+class CatalogProduct(models.Model):
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    product_type = models.CharField(max_length=100, verbose_name='Тип товара')
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE)
+    title = models.CharField(max_length=255, verbose_name='Наименование')
+    slug = models.SlugField()
+    price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
+    image = models.ImageField(verbose_name='Изображение')
+    objects = CatalogProductManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_catalog_product_object'),
+            models.UniqueConstraint(fields=['product_type', 'slug'], name='unique_catalog_product_slug'),
+        ]
+        indexes = [
+            models.Index(fields=['product_type', 'id'], name='catalog_type_id_idx'),
+            models.Index(fields=['category', 'id'], name='catalog_category_id_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='catalog_category_price_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    def get_model_name(self):
+        '''
+        Возвращает имя модели исходного товара
+
+        '''
+        return self.product_type
+
+    def get_absolute_url(self):
+        '''
+        Функция возвращает URL страницы сведений об исходном товаре
+        :возвращает: Представление product_detail.
+        '''
+        return reverse('product_detail', kwargs={'ct_model': self.product_type, 'slug': self.slug})
+
+
+# Класс, который используется для управления индексом фасетов.
+class ProductFacetManager(models.Manager):
+
+    # Атрибуты товаров, по которым можно фильтровать страницу категории.
+    FACET_FIELDS = ('color', 'length', 'silhouette', 'cut', 'style', 'landing')
+
+    @staticmethod
+    def normalize(value):
+        '''
+        Функция приводит значение атрибута к единому виду (без лишних пробелов, в нижнем регистре).
+        '''
+        return ' '.join(str(value).split()).lower()
+
+    def get_labels(self):
+        '''
+        Функция возвращает названия фасетов из метаданных полей моделей товаров.
+        :возвращает: словарь {атрибут: название}.
+        '''
+        labels = {}
+        for model in Product.__subclasses__():
+            for name, attname in get_spec_fields(model):
+                if attname in self.FACET_FIELDS:
+                    labels.setdefault(attname, name)
+        return labels
+
+    def sync_product(self, catalog_product, product):
+        '''
+        Функция заново записывает фасеты товара.
+        :param catalog_product: Строка индекса каталога товара.
+        :param product: Сам товар.
+        '''
+        self.filter(catalog_product=catalog_product).delete()
+        self.bulk_create([
+            ProductFacet(
+                catalog_product=catalog_product, category_id=catalog_product.category_id,
+                attribute=attname, value=self.normalize(getattr(product, attname))
+            )
+            for _, attname in get_spec_fields(product.__class__)
+            if attname in self.FACET_FIELDS and getattr(product, attname)
+        ])
+
+    def sync_products(self, pairs):
+        '''
+        Функция заново записывает фасеты пачки товаров одним удалением и одной пакетной вставкой.
+        :param pairs: Список пар (строка индекса каталога, товар).
+        '''
+        self.filter(catalog_product__in=[catalog_product for catalog_product, _ in pairs]).delete()
+        self.bulk_create([
+            ProductFacet(
+                catalog_product=catalog_product, category_id=catalog_product.category_id,
+                attribute=attname, value=self.normalize(getattr(product, attname))
+            )
+            for catalog_product, product in pairs
+            for _, attname in get_spec_fields(product.__class__)
+            if attname in self.FACET_FIELDS and getattr(product, attname)
+        ])
+
+    def filter_products(self, products, category, selected):
+        '''
+        Функция оставляет товары, подходящие под выбранные фасеты: внутри атрибута значения объединяются
+        через ИЛИ, разные атрибуты - через И. Каждый атрибут - один подзапрос по индексу фасетов.
+        :param products: Набор запросов CatalogProduct.
+        :param category: Объект категории.
+        :param selected: Словарь {атрибут: список значений}.
+        :возвращает: отфильтрованный набор запросов.
+        '''
+        for attribute, values in selected.items():
+            products = products.filter(id__in=self.filter(
+                category=category, attribute=attribute, value__in=values
+            ).values('catalog_product_id'))
+        return products
+
+    def get_counts(self, category, selected):
+        '''
+        Функция считает товары для каждого значения каждого фасета категории с учетом выбранных фасетов.
+        Для невыбранных атрибутов учитываются все выбранные фильтры (один GROUP BY запрос), для каждого
+        выбранного атрибута - все фильтры, кроме его собственного (еще по запросу на атрибут).
+        :param category: Объект категории.
+        :param selected: Словарь {атрибут: список значений}.
+        :возвращает: словарь {атрибут: [(значение, количество), ...]}.
+        '''
+        groups = [(None, selected)] + [
+            (attribute, {a: v for a, v in selected.items() if a != attribute}) for attribute in selected
+        ]
+        counts = {}
+        for attribute, filters in groups:
+            facets = self.filter(category=category)
+            if attribute is None:
+                facets = facets.exclude(attribute__in=list(selected))
+            else:
+                facets = facets.filter(attribute=attribute)
+            if filters:
+                facets = facets.filter(catalog_product__in=self.filter_products(
+                    CatalogProduct.objects.filter(category=category), category, filters
+                ))
+            rows = facets.values('attribute', 'value').annotate(count=models.Count('id')).order_by('attribute', 'value')
+            for row in rows:
+                counts.setdefault(row['attribute'], []).append((row['value'], row['count']))
+        return counts
+
+
+'''
+Фасет товара - нормализованное значение одного атрибута (цвет, длина, силуэт...) товара каталога.
+Строки с одинаковыми (category, attribute, value) образуют список товаров для этого значения фильтра.
+Строки поддерживаются в актуальном состоянии сигналом post_save и удаляются вместе со строкой каталога.
+
+'''
+class ProductFacet(models.Model):
+
+    catalog_product = models.ForeignKey(
+        CatalogProduct, verbose_name='Товар каталога', on_delete=models.CASCADE, related_name='facets'
+    )
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE)
+    attribute = models.CharField(max_length=100, verbose_name='Атрибут')
+    value = models.CharField(max_length=255, verbose_name='Значение')
+    objects = ProductFacetManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['catalog_product', 'attribute'], name='unique_product_facet'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'attribute', 'value', 'catalog_product'], name='facet_posting_idx'),
+        ]
+
+    def __str__(self):
+        return '{}: {}'.format(self.attribute, self.value)
+
+
 '''Товар в корзине - это товар, который находится в корзине.'''
 class CartProduct(models.Model):
 
-    user = models.ForeignKey('Customer', verbose_name='Покупатель', on_delete=models.CASCADE)
+    user = models.ForeignKey('Customer', verbose_name='Покупатель', on_delete=models.CASCADE, null=True, blank=True)
     cart = models.ForeignKey('Cart', verbose_name='Корзина', on_delete=models.CASCADE, related_name='related_products')
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
@@ -242,6 +663,13 @@ class CartProduct(models.Model):
     qty = models.PositiveIntegerField(default=1)
     final_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Общая цена')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cart', 'content_type', 'object_id'], name='unique_cart_product_line'
+            ),
+        ]
+
     def __str__(self):
         '''
         Метод __str__ вызывается, когда вы вызываете str() для объекта.
@@ -260,6 +688,35 @@ class CartProduct(models.Model):
 
 
 '''Корзина позволяет пользователям выбирать нужные продукты и временно хранить их'''
+class CartManager(models.Manager):
+
+    def get_abandoned(self, cutoff):
+        '''
+        Функция возвращает брошенные корзины: не оформленные и не изменявшиеся с момента cutoff.
+        Выборка идет по индексу (in_order, updated_at), старые корзины первыми.
+        :param cutoff: Момент времени; корзины, измененные позже, не считаются брошенными.
+        '''
+        return self.filter(in_order=False, updated_at__lt=cutoff).order_by('updated_at', 'id')
+
+    def delete_abandoned(self, cutoff, batch_size=500):
+        '''
+        Функция удаляет одну пачку брошенных корзин вместе с их товарами в короткой транзакции.
+        Корзины выбираются внутри транзакции (с блокировкой строк там, где база данных ее поддерживает),
+        поэтому корзина, измененная после выбора пачки другим запросом, не удаляется.
+        :param cutoff: См. get_abandoned.
+        :param batch_size: Наибольшее количество корзин в пачке.
+        :возвращает: словарь {метка модели: количество удаленных строк}; пустой, если удалять нечего.
+        '''
+        with transaction.atomic():
+            ids = list(
+                self.get_abandoned(cutoff).select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return {}
+            _, deleted = self.filter(pk__in=ids, in_order=False, updated_at__lt=cutoff).delete()
+        return deleted
+
+
 class Cart(models.Model):
 
     owner = models.ForeignKey('Customer', null=True, verbose_name='Владелец', on_delete=models.CASCADE)
@@ -268,6 +725,15 @@ class Cart(models.Model):
     final_price = models.DecimalField(max_digits=9, default=0, decimal_places=2, verbose_name='Общая цена')
     in_order = models.BooleanField(default=False)
     for_anonymous_user = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    objects = CartManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'in_order'], name='cart_owner_in_order_idx'),
+            # Поиск брошенных корзин (см. команду collect_abandoned_carts).
+            models.Index(fields=['in_order', 'updated_at'], name='cart_in_order_updated_idx'),
+        ]
 
     def __str__(self):
         """
@@ -276,12 +742,22 @@ class Cart(models.Model):
         """
         return str(self.id)
 
+    def get_cart_products(self):
+        """
+        Функция возвращает товары корзины вместе с самими продуктами (Dress, Skirt, ...).
+        Продукты загружаются одним запросом на каждый тип контента, а не по запросу на каждую строку.
+        :возвращает: список объектов CartProduct.
+        """
+        if self.pk is None:
+            return []
+        return list(self.products.order_by('id').prefetch_related('content_object'))
+
     
 ''' Клиент, который использует магазин. 
     :user - пользователь 
     :phone - телефон
     :address - адресс
-    :orders - заказы покупателя. ManyToManyField - отношение многие ко многим. То есть у покупателя может быть много заказов, а у заказа может быть много покупателей
+    Заказы покупателя доступны через related_orders (внешний ключ Order.customer).
 '''
 
 class Customer(models.Model):
@@ -289,17 +765,67 @@ class Customer(models.Model):
     user = models.ForeignKey(User, verbose_name='Пользователь', on_delete=models.CASCADE)
     phone = models.CharField(max_length=20, verbose_name='Номер телефона', null=True, blank=True)
     address = models.CharField(max_length=255, verbose_name='Адрес', null=True, blank=True)
-    orders = models.ManyToManyField('Order', verbose_name='Заказы покупателя', related_name='related_order')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['phone'], name='customer_phone_idx'),
+        ]
 
     def __str__(self):
-      """
-      Метод __str__ должен возвращать строковое представление объекта
-      :возвращает: Покупатель: Иван Иванов
-      
-      """
+        """
+        Метод __str__ должен возвращать строковое представление объекта
+        :возвращает: Покупатель: Иван Иванов
+
+        """
         return "Покупатель: {} {}".format(self.user.first_name, self.user.last_name)
 
 
+class OrderManager(models.Manager):
+
+    def get_customer_orders(self, customer):
+        '''
+        Функция возвращает историю заказов покупателя, новые первыми. Сумма заказа хранится в самом заказе,
+        поэтому список читается одним запросом по индексу (customer, created_at) без обхода корзин.
+        :param customer: Объект покупателя.
+        '''
+        return self.filter(customer=customer).order_by('-created_at', '-id')
+
+    def place_order(self, order, cart):
+        '''
+        Функция оформляет заказ по корзине одной транзакцией. Сначала корзина помечается оформленной
+        условным UPDATE (только если она еще открыта): это блокирует корзину, и изменения корзины
+        из параллельных запросов ждут конца транзакции. Затем товары корзины со снимком цен читаются уже
+        внутри транзакции, поэтому заказ содержит ровно те строки, которые были в корзине при оформлении.
+        После этого вставляются заказ с итоговой суммой и пакетом его строки. Если корзину уже оформил
+        параллельный запрос или она пуста, ничего не записывается.
+        :param order: Несохраненный объект заказа (заполненный из формы, с покупателем).
+        :param cart: Сохраненный объект корзины.
+        :возвращает: сохраненный заказ или None, если корзина пуста или уже оформлена.
+        '''
+        with transaction.atomic():
+            if not Cart.objects.filter(pk=cart.pk, in_order=False).update(in_order=True):
+                return None
+            products = CatalogProduct.objects.get_cart_lines(cart)
+            if not products:
+                transaction.set_rollback(True)
+                return None
+            lines = [
+                OrderLine(
+                    product_type=product.product_type, object_id=product.object_id, title=product.title,
+                    price=product.price, qty=product.qty
+                )
+                for product in products
+            ]
+            order.cart = cart
+            order.final_price = sum(line.final_price for line in lines)
+            order.save(force_insert=True)
+            for line in lines:
+                line.order = order
+            OrderLine.objects.bulk_create(lines)
+        cart.in_order = True
+        return order
+
+
 ''' Класс Заказ:
     :customer - покупатель
     :first_name - имя покупателя
@@ -311,6 +837,7 @@ class Customer(models.Model):
     :comment - комментарий к заказу
     :created_at - дата создания
     :order_date - дата получения
+    :final_price - сумма заказа на момент оформления
 '''
 class Order(models.Model):
 
@@ -338,7 +865,7 @@ class Order(models.Model):
     first_name = models.CharField(max_length=255, verbose_name='Имя')
     last_name = models.CharField(max_length=255, verbose_name='Фамилия')
     phone = models.CharField(max_length=20, verbose_name='Телефон')
-    cart = models.ForeignKey(Cart, verbose_name='Корзина', on_delete=models.CASCADE, null=True, blank=True)
+    cart = models.ForeignKey(Cart, verbose_name='Корзина', on_delete=models.SET_NULL, null=True, blank=True)
     address = models.CharField(max_length=1024, verbose_name='Адрес', null=True, blank=True)
     status = models.CharField(
         max_length=100,
@@ -353,8 +880,45 @@ class Order(models.Model):
         default=BUYING_TYPE_SELF
     )
     comment = models.TextField(verbose_name='Комментарий к заказу', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True, verbose_name='Дата создания заказа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания заказа')
     order_date = models.DateField(verbose_name='Дата получения заказа', default=timezone.now)
+    final_price = models.DecimalField(max_digits=9, default=0, decimal_places=2, verbose_name='Сумма заказа')
+    objects = OrderManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-created_at'], name='order_customer_created_idx'),
+            # Фильтры и поиск списка заказов в админке.
+            models.Index(fields=['status'], name='order_status_idx'),
+            models.Index(fields=['buying_type'], name='order_buying_type_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            models.Index(fields=['phone'], name='order_phone_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
+
+
+''' Строка заказа - неизменяемый снимок товара на момент оформления заказа:
+    :order - заказ
+    :product_type - имя модели товара (dress, skirt)
+    :object_id - идентификатор товара
+    :title - название товара
+    :price - цена за единицу
+    :qty - количество
+'''
+class OrderLine(models.Model):
+
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='lines', on_delete=models.CASCADE)
+    product_type = models.CharField(max_length=100, verbose_name='Тип товара')
+    object_id = models.PositiveIntegerField(verbose_name='Идентификатор товара')
+    title = models.CharField(max_length=255, verbose_name='Наименование')
+    price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
+    qty = models.PositiveIntegerField(verbose_name='Количество')
+
+    def __str__(self):
+        return '{} x {}'.format(self.title, self.qty)
+
+    @property
+    def final_price(self):
+        return self.price * self.qty
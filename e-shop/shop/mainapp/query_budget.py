@@ -0,0 +1,123 @@
+import os
+import sys
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+# Запросы, выполненные из файлов вне проекта (Django, библиотеки) и из модулей замеров mainapp,
+# относятся к ближайшему вызову из остального кода проекта.
+PROJECT_DIR = os.path.abspath(settings.BASE_DIR) + os.sep
+IGNORED_FILES = {
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ('query_budget.py', 'middleware.py', 'metrics.py', 'template_backend.py')
+}
+
+# Управление точками сохранения транзакций не считается запросом: в тестах каждый atomic() вложен
+# в транзакцию теста и дает лишние SAVEPOINT, которых нет при обычной работе.
+SAVEPOINT_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def get_query_budget(view):
+    """
+    Функция возвращает бюджет запросов к базе данных для представления: атрибут query_budget класса
+    представления (или самой функции), либо None, если бюджет не задан.
+    :param view: Класс представления или функция, возвращенная as_view().
+    """
+    view_class = getattr(view, 'view_class', view)
+    return getattr(view_class, 'query_budget', None)
+
+
+def get_call_site():
+    """
+    Функция возвращает место в коде проекта, из которого выполняется запрос: 'mainapp/views.py:42 (get)'.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename.startswith(PROJECT_DIR) and filename not in IGNORED_FILES
+                and os.sep + 'site-packages' + os.sep not in filename):
+            return '{}:{} ({})'.format(
+                os.path.relpath(filename, PROJECT_DIR), frame.f_lineno, frame.f_code.co_name
+            )
+        frame = frame.f_back
+    return '<вне проекта>'
+
+
+# Место вызова запросов, выполненных до превышения бюджета, если места вызова собираются только после него.
+WITHIN_BUDGET = '<в пределах бюджета>'
+
+
+class QueryBudget:
+    '''
+    Контекстный менеджер считает запросы ко всем базам данных (кроме SAVEPOINT) и запоминает место
+    вызова каждого из них. Поиск места вызова проходит по стеку, поэтому с collect_call_sites=False
+    (промежуточный слой) места вызова запоминаются только для запросов сверх бюджета.
+    Пример:
+        with QueryBudget(CartView) as budget:
+            client.get('/cart/')
+        if budget.exceeded:
+            print(budget.report())
+    '''
+
+    def __init__(self, budget=None, collect_call_sites=True):
+        self.budget = budget if budget is None or isinstance(budget, int) else get_query_budget(budget)
+        self.collect_call_sites = collect_call_sites
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.startswith(SAVEPOINT_PREFIXES):
+            over_budget = self.budget is not None and len(self.queries) >= self.budget
+            call_site = get_call_site() if self.collect_call_sites or over_budget else WITHIN_BUDGET
+            self.queries.append((call_site, sql))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    async def __aenter__(self):
+        # Асинхронный код запроса обращается к базе данных через sync_to_async, а соединения принадлежат
+        # потоку, в котором выполняется синхронный код, поэтому обертки устанавливаются в этом потоке.
+        return await sync_to_async(self.__enter__)()
+
+    async def __aexit__(self, *exc_info):
+        await sync_to_async(self._stack.close)()
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def exceeded(self):
+        return self.budget is not None and len(self.queries) > self.budget
+
+    def group_by_call_site(self):
+        """
+        Функция группирует выполненные запросы по месту вызова, сохраняя порядок первого появления.
+        :return: OrderedDict {место вызова: [SQL, ...]}.
+        """
+        grouped = OrderedDict()
+        for call_site, sql in self.queries:
+            grouped.setdefault(call_site, []).append(sql)
+        return grouped
+
+    def report(self):
+        """
+        Функция возвращает текстовый отчет: количество запросов против бюджета и SQL по местам вызова
+        (повторяющиеся запросы одного места выводятся один раз с количеством).
+        """
+        lines = ['Выполнено запросов: {}, бюджет: {}'.format(len(self.queries), self.budget)]
+        for call_site, queries in self.group_by_call_site().items():
+            lines.append('{} - {}'.format(call_site, len(queries)))
+            for sql in OrderedDict.fromkeys(queries):
+                lines.append('    [{}] {}'.format(queries.count(sql), sql))
+        return '\n'.join(lines)
@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Признак того, что текущий запрос (или блок кода) читает только из основной базы данных.
+_use_primary = ContextVar('use_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Контекстный менеджер направляет все чтения внутри блока в основную базу данных, например чтобы
+    сразу прочитать только что записанные данные (реплика может отставать).
+    """
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def is_catalog_model(model):
+    """
+    Функция проверяет, относится ли модель к каталогу (категории, товары и индексы каталога).
+    """
+    from .models import Category, CatalogProduct, Product, ProductFacet
+    return issubclass(model, (Category, CatalogProduct, Product, ProductFacet))
+
+
+class ReplicaRouter:
+    '''
+    Маршрутизатор баз данных: чтения каталога уходят в реплику (база данных DATABASE_REPLICA_ALIAS,
+    если она описана в DATABASES), все остальное - корзины, заказы, покупатели и любые записи - в основную
+    базу данных. Чтения каталога тоже идут в основную базу данных внутри транзакции основной базы данных
+    и внутри use_primary(), чтобы не читать устаревшие данные после собственной записи.
+    Миграции выполняются только в основной базе данных, реплика получает их вместе с данными.
+    '''
+
+    @property
+    def replica(self):
+        alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', 'replica')
+        return alias if alias in settings.DATABASES else None
+
+    def db_for_read(self, model, **hints):
+        if self.replica is None or _use_primary.get() or not is_catalog_model(model):
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же данные, что и основная база данных.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != self.replica
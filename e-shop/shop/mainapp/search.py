@@ -0,0 +1,156 @@
+import re
+
+from django.db import connection
+
+from .models import CatalogProduct, get_product_models, get_spec_fields
+
+
+# Виртуальная таблица FTS5: rowid совпадает с id строки индекса каталога (CatalogProduct).
+SEARCH_TABLE = 'mainapp_product_search'
+
+SEARCH_PAGE_SIZE = 24
+
+# Максимальное количество слов запроса, которые передаются в FTS5.
+MAX_QUERY_TERMS = 8
+
+
+def is_available():
+    """
+    Функция проверяет, что база данных поддерживает полнотекстовый поиск FTS5 (SQLite).
+    """
+    return connection.vendor == 'sqlite'
+
+
+def get_document(product):
+    """
+    Функция возвращает индексируемые поля товара: название, описание и все характеристики.
+    :param product: Объект Dress, Skirt или другой модели-наследника Product.
+    :return: (title, description, specs).
+    """
+    specs = ' '.join(str(getattr(product, attname)) for _, attname in get_spec_fields(product.__class__))
+    return product.title, product.description or '', specs
+
+
+def index_product(catalog_product, product):
+    """
+    Функция добавляет или заменяет документ товара в поисковом индексе.
+    :param catalog_product: Строка индекса каталога товара.
+    :param product: Сам товар.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(SEARCH_TABLE), [catalog_product.pk])
+        cursor.execute(
+            'INSERT INTO {} (rowid, title, description, specs) VALUES (%s, %s, %s, %s)'.format(SEARCH_TABLE),
+            [catalog_product.pk, *get_document(product)]
+        )
+
+
+def index_products(pairs):
+    """
+    Функция добавляет или заменяет документы пачки товаров в поисковом индексе одним удалением
+    и одной пакетной вставкой.
+    :param pairs: Список пар (строка индекса каталога, товар).
+    """
+    if not is_available() or not pairs:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid IN ({})'.format(SEARCH_TABLE, ', '.join(['%s'] * len(pairs))),
+            [catalog_product.pk for catalog_product, _ in pairs]
+        )
+        _insert_rows(cursor, [[catalog_product.pk, *get_document(product)] for catalog_product, product in pairs])
+
+
+def remove_product(content_type_id, object_id):
+    """
+    Функция удаляет документ товара из поискового индекса (до удаления строки индекса каталога).
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid IN ('
+            'SELECT id FROM {} WHERE content_type_id = %s AND object_id = %s)'.format(
+                SEARCH_TABLE, CatalogProduct._meta.db_table
+            ),
+            [content_type_id, object_id]
+        )
+
+
+def rebuild(models=None, batch_size=1000):
+    """
+    Функция полностью пересоздает поисковый индекс по всем товарам переданных моделей.
+    :param models: Модели товаров; по умолчанию все модели товаров (см. get_product_models).
+    :param batch_size: Количество документов в одной вставке.
+    :return: Количество проиндексированных товаров.
+    """
+    if not is_available():
+        return 0
+    if models is None:
+        models = get_product_models()
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(SEARCH_TABLE))
+        for model in models:
+            catalog_ids = dict(
+                CatalogProduct.objects.filter(product_type=model._meta.model_name).values_list('object_id', 'id')
+            )
+            rows = []
+            for product in model._base_manager.order_by('id').iterator(chunk_size=batch_size):
+                if product.id in catalog_ids:
+                    rows.append([catalog_ids[product.id], *get_document(product)])
+                if len(rows) == batch_size:
+                    count += _insert_rows(cursor, rows)
+                    rows = []
+            count += _insert_rows(cursor, rows)
+        cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(SEARCH_TABLE))
+    return count
+
+
+def _insert_rows(cursor, rows):
+    if rows:
+        cursor.executemany(
+            'INSERT INTO {} (rowid, title, description, specs) VALUES (%s, %s, %s, %s)'.format(SEARCH_TABLE), rows
+        )
+    return len(rows)
+
+
+def build_match_query(query):
+    """
+    Функция превращает строку пользователя в безопасный запрос FTS5: каждое слово ищется как префикс,
+    все слова должны встречаться в документе. Операторы FTS5 из строки пользователя не передаются.
+    :return: Строка запроса MATCH или пустая строка.
+    """
+    terms = re.findall(r'\w+', query.lower())[:MAX_QUERY_TERMS]
+    return ' '.join('"{}"*'.format(term) for term in terms)
+
+
+def search(query, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    Функция ищет товары по названию, описанию и характеристикам и возвращает страницу результатов,
+    упорядоченных по релевантности (bm25, совпадение в названии весит больше).
+    :param query: Строка поиска.
+    :param page: Номер страницы, начиная с 1.
+    :param page_size: Количество товаров на странице.
+    :return: (список CatalogProduct, есть ли следующая страница).
+    """
+    match = build_match_query(query)
+    if not match:
+        return [], False
+    offset = (page - 1) * page_size
+    if is_available():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, 10.0, 1.0, 3.0) '
+                'LIMIT %s OFFSET %s'.format(SEARCH_TABLE),
+                [match, page_size + 1, offset]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        products = CatalogProduct.objects.in_bulk(ids[:page_size])
+        results = [products[pk] for pk in ids[:page_size] if pk in products]
+        return results, len(ids) > page_size
+    products = CatalogProduct.objects.filter(title__icontains=query.strip()).order_by('-id')
+    results = list(products[offset:offset + page_size + 1])
+    return results[:page_size], len(results) > page_size
@@ -0,0 +1,131 @@
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Category, CatalogProduct, ProductFacet, Cart, get_product_models
+from . import search
+from .fragments import bump_version, bump_versions
+from .utils import remember_cart, forget_cart
+
+
+# Модели товаров (наследники Product). Обработчики индекса каталога подключаются к каждой из них: сохранение
+# и удаление остальных моделей (сессий, корзин) их не вызывает, и Django удаляет такие строки без выборки.
+PRODUCT_MODELS = get_product_models()
+
+
+def remember_previous_state(sender, instance, raw=False, **kwargs):
+    """
+    Функция перед сохранением товара запоминает его прежние категорию и slug (одним запросом), чтобы после
+    сохранения сбросить и фрагменты прежних страниц, если товар перенесен или переименован.
+    :param instance: Сохраняемый товар.
+    """
+    instance._previous_state = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._previous_state = sender._base_manager.filter(pk=instance.pk).values(
+        'category_id', 'category__slug', 'slug'
+    ).first()
+
+
+def sync_catalog_product(sender, instance, raw=False, created=False, **kwargs):
+    """
+    Функция обновляет строку индекса каталога после сохранения товара
+    и отмечает измененной категорию товара (и прежнюю категорию, если товар перенесен).
+    :param instance: Сохраненный товар.
+    """
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    category_ids = {instance.category_id}
+    if previous is not None:
+        category_ids.add(previous['category_id'])
+    Category.objects.touch(category_ids)
+    catalog_product = CatalogProduct.objects.sync_product(instance)
+    search.index_product(catalog_product, instance)
+    ProductFacet.objects.sync_product(catalog_product, instance)
+    Category.objects.invalidate_sidebar()
+    bump_product_versions(instance, previous)
+
+
+def remove_catalog_product(sender, instance, **kwargs):
+    """
+    Функция удаляет строку индекса каталога после удаления товара и отмечает измененной его категорию.
+    :param instance: Удаленный товар.
+    """
+    Category.objects.touch([instance.category_id])
+    search.remove_product(ContentType.objects.get_for_model(instance).pk, instance.pk)
+    CatalogProduct.objects.remove_product(instance)
+    Category.objects.invalidate_sidebar()
+    bump_product_versions(instance)
+
+
+def bump_product_versions(product, previous=None):
+    """
+    Функция сбрасывает закэшированные фрагменты страницы товара и страницы его категории, а также страницы
+    товара под прежним slug и прежней категории, если они изменились.
+    :param product: Товар.
+    :param previous: Прежние значения товара (category__slug, slug) или None.
+    """
+    model_name = product.get_model_name()
+    slugs = {product.slug}
+    category_slugs = {product.category.slug}
+    if previous is not None:
+        slugs.add(previous['slug'])
+        category_slugs.add(previous['category__slug'])
+    for slug in slugs:
+        bump_version('product', '{}:{}'.format(model_name, slug))
+    for category_slug in category_slugs:
+        bump_version('category', category_slug)
+
+
+for product_model in PRODUCT_MODELS:
+    pre_save.connect(remember_previous_state, sender=product_model)
+    post_save.connect(sync_catalog_product, sender=product_model)
+    post_delete.connect(remove_catalog_product, sender=product_model)
+
+
+@receiver(pre_save, sender=Category)
+def remember_previous_category(sender, instance, raw=False, **kwargs):
+    """
+    Функция перед сохранением категории запоминает ее прежние название и slug (одним запросом).
+    :param instance: Сохраняемая категория.
+    """
+    instance._previous_state = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._previous_state = Category._base_manager.filter(pk=instance.pk).values('name', 'slug').first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    """
+    Функция сбрасывает кэш левой боковой панели и фрагменты страницы категории (и страницы под прежним slug)
+    после ее изменения или удаления. Фрагменты страниц товаров содержат название и ссылку категории,
+    поэтому при их изменении сбрасываются и версии всех товаров категории (одной записью в кэш).
+    """
+    Category.objects.invalidate_sidebar()
+    previous = getattr(instance, '_previous_state', None)
+    bump_versions('category', {instance.slug, previous['slug'] if previous else instance.slug})
+    if previous is None or (previous['name'], previous['slug']) == (instance.name, instance.slug):
+        return
+    bump_versions('product', [
+        '{}:{}'.format(product_type, slug)
+        for product_type, slug in CatalogProduct.objects.filter(category=instance).values_list('product_type', 'slug')
+    ])
+
+
+@receiver(user_logged_in)
+def restore_user_cart(sender, request, user, **kwargs):
+    """
+    Функция после входа пользователя сохраняет в сессии его открытую корзину (или убирает анонимную),
+    чтобы значок корзины сразу показывал верное количество товаров.
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    cart = Cart.objects.filter(owner__user=user, in_order=False).order_by('-id').first()
+    if cart is None:
+        forget_cart(request.session)
+    else:
+        remember_cart(request.session, cart)
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils.deconstruct import deconstructible
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла определяется хэшем SHA-256 его содержимого: images/ab/abcd...ef.jpg.
+    Одинаковые загрузки хранятся один раз, а URL файла никогда не меняет содержимое (его можно кэшировать навсегда).
+    """
+
+    DIRECTORY = 'images'
+
+    def is_content_addressed(self, name):
+        """
+        Функция проверяет, что файл лежит в каталоге хэшированных файлов.
+        """
+        return name.startswith(self.DIRECTORY + '/')
+
+    def hashed_name(self, name, content):
+        """
+        Функция вычисляет имя файла по хэшу содержимого, сохраняя расширение исходного имени.
+        """
+        hasher = hashlib.sha256()
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        content.seek(0)
+        digest = hasher.hexdigest()
+        return '{}/{}/{}{}'.format(self.DIRECTORY, digest[:2], digest, os.path.splitext(name)[1].lower())
+
+    def get_available_name(self, name, max_length=None):
+        """
+        Имя хэшированного файла однозначно, поэтому суффиксы не добавляются. Если файл с тем же хэшем
+        успел записать параллельный запрос, FileExistsError прерывает повторные попытки в _save.
+        """
+        if self.is_content_addressed(name) and self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if not self.exists(name):
+            try:
+                return super()._save(name, content)
+            except FileExistsError:
+                pass
+        # Повторная загрузка обновляет время изменения файла: сборщик (collect_media_garbage) не удаляет
+        # недавно измененные файлы, даже если ссылка на них еще не сохранена.
+        os.utime(self.path(name))
+        return name
+
+    def replace(self, name, content):
+        """
+        Функция записывает файл под заданным именем (без хэширования, например вариант изображения) и заменяет
+        прежний файл с тем же именем. Содержимое пишется во временный файл в том же каталоге, который затем
+        переименовывается поверх прежнего: читатели видят старый или новый файл, но не его отсутствие.
+        :param name: Имя файла в хранилище.
+        :param content: Объект File с содержимым.
+        :return: Имя файла в хранилище.
+        """
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Хранилище статических файлов для collectstatic: имя каждого файла содержит хэш его содержимого (такие файлы
+    кэшируются клиентом навсегда), а рядом с текстовыми файлами сохраняются сжатые варианты: .gz и, если
+    установлен пакет brotli, .br. Вариант сохраняется, только если он меньше исходного файла. Сжатие выполняется
+    один раз при сборке, при ответе вариант выбирается по Accept-Encoding (см. mainapp.views.StaticAssetView).
+    """
+
+    COMPRESSED_EXTENSIONS = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.xml', '.html', '.ico')
+    # Файлы меньше этого размера (в байтах) не сжимаются: выигрыш меньше накладных расходов.
+    MIN_COMPRESSED_SIZE = 256
+
+    def stored_name(self, name):
+        """
+        Пока collectstatic не выполнен (разработка, тесты), шаблоны ссылаются на исходные имена файлов.
+        """
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(paths) | set(self.hashed_files.values())):
+            if name.endswith(self.COMPRESSED_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        """
+        Функция сохраняет сжатые варианты файла. gzip не записывает время сжатия, поэтому сборка воспроизводима.
+        :param name: Имя файла в хранилище.
+        """
+        with self.open(name) as original:
+            content = original.read()
+        variants = {'.gz': None, '.br': None}
+        if len(content) >= self.MIN_COMPRESSED_SIZE:
+            variants['.gz'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants['.br'] = brotli.compress(content, quality=11)
+        for suffix, compressed in variants.items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            if compressed is not None and len(compressed) < len(content):
+                self._save(name + suffix, ContentFile(compressed))
+
+
+def get_reference_counts():
+    """
+    Функция считает, сколько строк всех моделей ссылается на каждый файл хэшированного хранилища.
+    Подсчет выполняется одним GROUP BY запросом на каждое файловое поле.
+    :return: Словарь {имя файла: количество ссылок}.
+    """
+    counts = {}
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if not isinstance(field, models.FileField) or not isinstance(field.storage, ContentAddressedStorage):
+                continue
+            rows = model._base_manager.exclude(**{field.name: ''}).values(field.name).annotate(
+                count=models.Count('pk')
+            ).order_by()
+            for row in rows:
+                counts[row[field.name]] = counts.get(row[field.name], 0) + row['count']
+    return counts
+
+
+product_image_storage = ContentAddressedStorage()
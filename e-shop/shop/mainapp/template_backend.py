@@ -0,0 +1,29 @@
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates, Template as BaseTemplate, reraise
+
+from .metrics import template_timer
+
+
+class Template(BaseTemplate):
+
+    def render(self, context=None, request=None):
+        """
+        Рендеринг шаблона с замером времени для метрик текущего запроса (см. mainapp.metrics).
+        """
+        with template_timer():
+            return super().render(context, request)
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    '''
+    Стандартный шаблонизатор Django, шаблоны которого замеряют время своего рендеринга.
+    '''
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,34 @@
+from django import template
+
+from ..images import RENDITIONS, rendition_name, renditions_ready
+
+
+register = template.Library()
+
+
+@register.filter
+def rendition_url(image, rendition):
+    """
+    Фильтр возвращает URL варианта изображения в JPEG, а пока варианты не созданы - URL исходного изображения.
+    Пример: {{ product.image|rendition_url:'card' }}
+    """
+    if not image:
+        return ''
+    if not renditions_ready(image.name):
+        return image.url
+    return image.storage.url(rendition_name(image.name, rendition))
+
+
+@register.filter
+def srcset(image, fmt='jpeg'):
+    """
+    Фильтр возвращает значение атрибута srcset со всеми вариантами изображения в заданном формате.
+    Пока варианты не созданы, возвращается пустая строка, и браузер использует атрибут src.
+    Пример: {{ product.image|srcset:'webp' }}
+    """
+    if not image or not renditions_ready(image.name):
+        return ''
+    return ', '.join(
+        '{} {}w'.format(image.storage.url(rendition_name(image.name, rendition, fmt)), width)
+        for rendition, (width, _) in RENDITIONS.items()
+    )
@@ -1,7 +1,9 @@
-from ..models import Skirt, Dress
 from django import template
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
+from ..fragments import get_or_render_fragment
+from ..models import get_spec_fields
 
 
 register = template.Library()
@@ -11,40 +13,37 @@ TABLE_HEAD = """
               <tbody>
             """
 
-TABLE_TAIL= """
+TABLE_TAIL = """
               </tbody>
             </table>
             """
 
-TABLE_CONTENT= """
+TABLE_CONTENT = """
                 <tr>
-                    <td>{name}</td>
-                    <td>{value}</td>
+                    <td>{}</td>
+                    <td>{}</td>
                 </tr>
                 """
-PRODUCT_SPEC= {
-    'dress': {
-        'Фасон': 'style',
-        'Состав': 'structure',
-        'Крой': 'сut',
-        'Силуэт': 'silhouette',
-        'Цвет': 'color',
-        'Длина': 'length',
-    },
-    'skirt': {
-        'Фасон': 'style',
-        'Состав': 'structure',
-        'Крой': 'сut',
-        'Силуэт': 'silhouette',
-        'Посадка': 'landing',
-        'Длина': 'length',
-    }
-}
-
-def get_product_spec(product, model_name):
-    table_content=''
-    for name, value in PRODUCT_SPEC[model_name].items():
-        table_content += TABLE_CONTENT.format(name=name, value= getattr(product, value))
-    return table_content
 
 
+def get_product_spec(product):
+    """
+    Функция отрисовывает таблицу характеристик товара одним проходом по полям.
+    """
+    rows = format_html_join(
+        '', TABLE_CONTENT, ((name, getattr(product, attname)) for name, attname in get_spec_fields(product.__class__))
+    )
+    return format_html('{}{}{}', mark_safe(TABLE_HEAD), rows, mark_safe(TABLE_TAIL))
+
+
+@register.simple_tag
+def product_spec(product):
+    """
+    Тег выводит таблицу характеристик товара. Таблица кэшируется для текущей версии товара,
+    поэтому повторная отрисовка не требует прохода по полям.
+    Пример: {% product_spec product %}
+    """
+    return get_or_render_fragment(
+        'spec', 'product', '{}:{}'.format(product.get_model_name(), product.slug),
+        lambda: get_product_spec(product)
+    )
@@ -1,21 +1,111 @@
+import csv
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from decimal import Decimal
+from io import BytesIO, StringIO
 from unittest import mock
-from django.test import TestCase, RequestFactory
+from PIL import Image
+from django.test import Client, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.contrib.sessions.models import Session
+from django.db import IntegrityError, connection
+from django.db.utils import ConnectionDoesNotExist
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_delete, post_save
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.template import Context, Template
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Category, Dress, CartProduct, Cart, Customer
-from .views import recalc_cart, AddToCartView, BaseView
+from .images import RENDITIONS, RENDITION_FORMATS, generate_renditions, rendition_name
+from . import images, metrics, search
+from .storage import get_reference_counts, product_image_storage
+from .templatetags.specifications import get_spec_fields
+from .models import (
+    Category, Dress, Skirt, CartProduct, Cart, Customer, CatalogProduct, LatestProducts, ProductFacet,
+    Order, OrderLine, get_product_models
+)
+from .query_budget import QueryBudget, WITHIN_BUDGET
+from .db import get_sqlite_pragmas
+from .fragments import get_or_render_fragment
+from .routers import ReplicaRouter, use_primary
+from .views import (
+    AddToCartView, BaseView, CartView, CategoryDetailView, ProductDetailView, SearchView, ChangeQTYView,
+    DeleteFromCartView, CheckoutView, MakeOrderView, AsyncBaseView, AsyncCategoryDetailView, AsyncProductDetailView
+)
+from .admin import ApproximateCountPaginator
+from .exporter import filter_orders, iter_csv
+from .utils import recalc_cart, add_to_cart, change_cart_qty, remove_from_cart, estimate_row_count
 
 
 
 User = get_user_model()
 
+TEST_MEDIA_ROOT = tempfile.mkdtemp()
 
+
+def tearDownModule():
+    shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+
+def make_image(name='dress_image.jpg', color='black'):
+    """
+    Функция создает небольшое JPEG-изображение в памяти для загрузки в поле image.
+    """
+    filestream = BytesIO()
+    Image.new('RGB', (10, 10), color).save(filestream, 'JPEG')
+    return SimpleUploadedFile(name, content=filestream.getvalue(), content_type="image/jpg")
+
+
+def create_dress(category, number=0, **fields):
+    """
+    Функция создает платье с типовыми характеристиками: название "Dress <number>", slug "dress-<number>",
+    цена 100.00 и новое изображение. Любое поле можно переопределить именованным аргументом.
+    """
+    values = {
+        'title': 'Dress {}'.format(number), 'slug': 'dress-{}'.format(number), 'price': Decimal('100.00'),
+        'style': 'style', 'structure': 'cotton', 'cut': 'cut', 'silhouette': 'silhouette', 'color': 'black',
+        'length': 'maxi',
+    }
+    values.update(fields)
+    if 'image' not in values:
+        values['image'] = make_image()
+    return Dress.objects.create(category=category, **values)
+
+
+class QueryBudgetAssertionsMixin:
+
+    @contextmanager
+    def assertWithinQueryBudget(self, view_class):
+        """
+        Проверка не дает коду внутри блока выполнить больше запросов, чем query_budget представления.
+        При превышении в сообщении выводится SQL, сгруппированный по месту вызова.
+        """
+        with QueryBudget(view_class) as budget:
+            yield budget
+        if budget.exceeded:
+            self.fail('{}: {}'.format(view_class.__name__, budget.report()))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
 class ShopTestCases(TestCase):
     def setUp(self) -> None:
         self.user = User.objects.create(username='testuser', password='password')
         self.category = Category.objects.create(name='Платья', slug='dress')
-        image = SimpleUploadedFile ("dress_image.jpg", content=b'', content_type="image/jpg")
+        image = make_image()
         self.dress = Dress.objects.create(
             category = self.category,
             title = "Test Dress",
@@ -57,6 +147,7 @@ class ShopTestCases(TestCase):
         factory = RequestFactory()
         request = factory.get('')
         request.user = self.user
+        request.session = SessionStore()
         response = AddToCartView.as_view()(request, ct_model="dress", slug="test-slug")
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, '/cart/')
@@ -76,3 +167,1517 @@ class ShopTestCases(TestCase):
             response = BaseView.as_view()(request)
             self.assertEqual(response.status_code, 444)
 
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CatalogProductTestCases(TestCase):
+    def setUp(self) -> None:
+        self.dress_category = Category.objects.create(name='Платья', slug='dress')
+        self.skirt_category = Category.objects.create(name='Юбки', slug='skirt')
+        self.dresses = [create_dress(self.dress_category, i, price=Decimal('100.00') + i) for i in range(7)]
+        self.skirt = Skirt.objects.create(
+            category=self.skirt_category, title="Test Skirt", slug="test-skirt", image=make_image('skirt.jpg'),
+            price=Decimal('1500.00'), style="pencil", structure="wool", cut="straight", silhouette="fitted",
+            landing="high", length="midi",
+        )
+
+    def test_catalog_follows_product_save_and_delete(self):
+        """
+        Сохранение товара обновляет строку индекса, удаление товара удаляет ее.
+        """
+        dress = self.dresses[0]
+        dress.price = Decimal('999.00')
+        dress.save()
+        catalog_product = CatalogProduct.objects.get(product_type='dress', slug=dress.slug)
+        self.assertEqual(catalog_product.price, Decimal('999.00'))
+        self.assertEqual(catalog_product.get_absolute_url(), dress.get_absolute_url())
+        dress.delete()
+        self.assertFalse(CatalogProduct.objects.filter(product_type='dress', slug=dress.slug).exists())
+
+    def test_catalog_signals_only_follow_products(self):
+        """
+        Обработчики индекса каталога подключены только к моделям товаров: сохранение и удаление корзин
+        и сессий их не вызывает, а сессии удаляются одним DELETE без выборки строк.
+        """
+        for model in (CartProduct, Cart, Session):
+            self.assertFalse(post_save.has_listeners(model), model)
+            self.assertFalse(post_delete.has_listeners(model), model)
+        self.assertTrue(post_delete.has_listeners(Dress))
+        self.assertTrue(Collector(using='default').can_fast_delete(Session.objects.all()))
+
+    def test_main_page_products_in_one_query(self):
+        """
+        Главная страница получает последние 5 товаров каждого типа одним запросом, товары with_respect_to идут первыми.
+        """
+        with self.assertNumQueries(1):
+            products = LatestProducts.objects.get_products_for_main_page('dress', 'skirt', with_respect_to='skirt')
+        self.assertEqual(products[0].slug, 'test-skirt')
+        self.assertEqual([p.slug for p in products[1:]], ['dress-6', 'dress-5', 'dress-4', 'dress-3', 'dress-2'])
+        # Подзапросы последних товаров не зависят от строки внешнего запроса и выполняются по одному разу.
+        plan = LatestProducts.objects._get_main_page_queryset('dress', 'skirt').explain()
+        self.assertNotIn('CORRELATED', plan)
+        self.assertIn('catalog_type_id_idx', plan)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SidebarTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.dress_category = Category.objects.create(name='Платья', slug='dress')
+        self.skirt_category = Category.objects.create(name='Юбки', slug='skirt')
+        for number in range(3):
+            create_dress(self.dress_category, number)
+
+    def test_sidebar_counts_are_cached(self):
+        """
+        Первый вызов считает товары одним запросом, повторный обходится без запросов к базе.
+        """
+        with self.assertNumQueries(1):
+            categories = Category.objects.get_categories_for_left_sidebar()
+        self.assertEqual(
+            [{key: value for key, value in category.items() if key != 'updated_at'} for category in categories],
+            [
+                {'name': 'Платья', 'url': '/category/dress/', 'count': 3},
+                {'name': 'Юбки', 'url': '/category/skirt/', 'count': 0},
+            ]
+        )
+        with self.assertNumQueries(0):
+            Category.objects.get_categories_for_left_sidebar()
+
+    def test_sidebar_cache_invalidated_by_product_changes(self):
+        """
+        Сохранение и удаление товара сбрасывают кэш боковой панели.
+        """
+        Category.objects.get_categories_for_left_sidebar()
+        dress = create_dress(self.dress_category, 3)
+        self.assertEqual(Category.objects.get_categories_for_left_sidebar()[0]['count'], 4)
+        dress.delete()
+        self.assertEqual(Category.objects.get_categories_for_left_sidebar()[0]['count'], 3)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CartPageTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(username='testuser', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        self.cart = Cart.objects.create(owner=self.customer)
+        self.dress_category = Category.objects.create(name='Платья', slug='dress')
+        self.skirt_category = Category.objects.create(name='Юбки', slug='skirt')
+        self.image = make_image()
+        ContentType.objects.get_for_models(Dress, Skirt)
+
+    def add_products(self, count):
+        for number in range(count):
+            dress = create_dress(self.dress_category, number, image=self.image)
+            skirt = Skirt.objects.create(
+                category=self.skirt_category, title="Skirt {}".format(number), slug="skirt-{}".format(number),
+                image=self.image, price=Decimal('50.00'), style="pencil", structure="wool", cut="straight",
+                silhouette="fitted", landing="high", length="midi",
+            )
+            for product in (dress, skirt):
+                cart_product = CartProduct.objects.create(user=self.customer, cart=self.cart, content_object=product)
+                self.cart.products.add(cart_product)
+        recalc_cart(self.cart)
+        Category.objects.get_categories_for_left_sidebar()
+
+    def get_cart_page(self):
+        request = RequestFactory().get('/cart/')
+        request.user = self.user
+        request.session = SessionStore()
+        return CartView.as_view()(request)
+
+    def test_cart_page_query_count_does_not_depend_on_cart_size(self):
+        """
+        Страница корзины выполняет фиксированное число запросов: корзина, строки корзины и
+        по одному запросу на каждый тип продукта.
+        """
+        self.add_products(15)
+        with self.assertNumQueries(4):
+            response = self.get_cart_page()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Skirt 14')
+        self.assertContains(response, '2250.00')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SessionCartTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        create_dress(self.category, title="Test Dress", slug="test-slug")
+        ContentType.objects.get_for_models(Dress, Skirt)
+        Category.objects.get_categories_for_left_sidebar()
+
+    def test_browsing_does_not_touch_carts(self):
+        """
+        Просмотр страниц не создает корзин и не выполняет запросов к корзине.
+        """
+        self.client.get('/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_each_anonymous_session_gets_own_cart(self):
+        """
+        Корзина создается при первом добавлении товара, у каждой анонимной сессии она своя.
+        """
+        self.client.get('/add-to-cart/dress/test-slug/')
+        first_cart_id = self.client.session['cart_id']
+        self.assertEqual(self.client.session['cart_total_products'], 1)
+        self.assertContains(self.client.get('/cart/'), 'Test Dress')
+
+        self.client.cookies.clear()
+        response = self.client.get('/cart/')
+        self.assertContains(response, 'пуста')
+        self.client.get('/add-to-cart/dress/test-slug/')
+        self.assertNotEqual(self.client.session['cart_id'], first_cart_id)
+        self.assertEqual(Cart.objects.filter(for_anonymous_user=True).count(), 2)
+
+    def test_adding_product_again_keeps_qty(self):
+        """
+        Повторное добавление товара, который уже есть в корзине, не меняет его количество и итоги корзины.
+        """
+        self.client.get('/add-to-cart/dress/test-slug/')
+        self.client.post('/change-qty/dress/test-slug/', {'qty': 3})
+        self.client.get('/add-to-cart/dress/test-slug/')
+        cart = Cart.objects.get(pk=self.client.session['cart_id'])
+        self.assertEqual(cart.products.get().qty, 3)
+        self.assertEqual((cart.total_products, cart.final_price), (1, Decimal('300.00')))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ImageRenditionsTestCases(TestCase):
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name='Платья', slug='dress')
+
+    def test_renditions_scheduled_only_for_new_images(self):
+        """
+        Варианты создаются после загрузки изображения, но не при сохранении без нового изображения.
+        """
+        with mock.patch('mainapp.models.schedule_renditions') as schedule_renditions:
+            dress = create_dress(self.category, image=make_image('renditions.jpg', 'red'))
+            schedule_renditions.assert_called_once_with(dress.image.name)
+            dress.price = Decimal('200.00')
+            dress.save()
+            schedule_renditions.assert_called_once()
+
+    def test_renditions_are_generated_in_process_pool(self):
+        """
+        После фиксации транзакции варианты создаются в пуле процессов, а не в потоках веб-процесса.
+        Пул, процесс которого аварийно завершился, создается заново.
+        """
+        self.assertIsInstance(images.get_executor(), ProcessPoolExecutor)
+        executor = mock.Mock()
+        with mock.patch.object(images, 'get_executor', return_value=executor):
+            with self.captureOnCommitCallbacks(execute=True):
+                dress = create_dress(self.category, image=make_image('renditions.jpg', 'white'))
+        executor.submit.assert_called_once_with(generate_renditions, dress.image.name)
+
+        broken = mock.Mock(**{'submit.side_effect': BrokenProcessPool})
+        with mock.patch.object(images, '_executor', broken):
+            future = images.submit_renditions('missing.jpg')
+            self.assertIsNot(images._executor, broken)
+            images._executor.shutdown()
+        self.assertIsInstance(future.exception(), FileNotFoundError)
+
+    def test_generate_renditions_and_srcset(self):
+        """
+        После создания вариантов шаблоны получают srcset со всеми вариантами.
+        """
+        with mock.patch('mainapp.models.schedule_renditions'):
+            dress = create_dress(self.category, image=make_image('renditions.jpg', 'blue'))
+        template = Template("{% load renditions %}{{ image|rendition_url:'card' }}|{{ image|srcset:'webp' }}")
+        self.assertEqual(template.render(Context({'image': dress.image})), dress.image.url + '|')
+        generate_renditions(dress.image.name)
+        for fmt in ('jpeg', 'webp'):
+            self.assertTrue(default_storage.exists(rendition_name(dress.image.name, 'thumbnail', fmt)))
+        card_url, webp_srcset = template.render(Context({'image': dress.image})).split('|')
+        self.assertTrue(card_url.endswith('_card.jpg'))
+        self.assertIn('_detail.webp 800w', webp_srcset)
+
+    def test_regeneration_replaces_renditions_in_place(self):
+        """
+        Повторное создание вариантов заменяет файлы на месте: прежний вариант доступен, пока пишется новый.
+        """
+        with mock.patch('mainapp.models.schedule_renditions'):
+            dress = create_dress(self.category, image=make_image('renditions.jpg', 'green'))
+        generate_renditions(dress.image.name)
+        os_replace = os.replace
+        replaced = []
+
+        def replace(source, destination):
+            self.assertTrue(os.path.exists(destination))
+            replaced.append(destination)
+            os_replace(source, destination)
+
+        with mock.patch.object(product_image_storage, 'delete', side_effect=AssertionError), \
+                mock.patch('mainapp.storage.os.replace', side_effect=replace):
+            generate_renditions(dress.image.name)
+        self.assertEqual(len(replaced), len(RENDITIONS) * len(RENDITION_FORMATS))
+        self.assertFalse([
+            name for name in os.listdir(os.path.dirname(replaced[0])) if name.startswith('.tmp-')
+        ])
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ContentAddressedStorageTestCases(TestCase):
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        schedule_renditions = mock.patch('mainapp.models.schedule_renditions')
+        schedule_renditions.start()
+        self.addCleanup(schedule_renditions.stop)
+
+    def upload_dress(self, number):
+        return create_dress(self.category, number, image=make_image('upload.jpg', 'green'))
+
+    def test_identical_uploads_are_stored_once(self):
+        """
+        Одинаковые загрузки получают одно имя по хэшу содержимого, а ссылки на файл подсчитываются.
+        """
+        first, second = self.upload_dress(1), self.upload_dress(2)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('images/'))
+        self.assertEqual(get_reference_counts()[first.image.name], 2)
+
+    def test_garbage_collection_removes_unreferenced_files(self):
+        """
+        Файл удаляется сборщиком только после удаления последнего товара, который на него ссылается.
+        """
+        first, second = self.upload_dress(1), self.upload_dress(2)
+        name = first.image.name
+        first.delete()
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+        second.delete()
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_garbage_collection_keeps_recent_files(self):
+        """
+        Недавно записанные файлы без ссылок не удаляются: ссылка на них может быть в незавершенной транзакции.
+        Повторная загрузка того же файла продлевает этот срок.
+        """
+        dress = self.upload_dress(1)
+        name = dress.image.name
+        dress.delete()
+        old = (timezone.now() - datetime.timedelta(days=2)).timestamp()
+        os.utime(default_storage.path(name), (old, old))
+        self.upload_dress(2).delete()
+        call_command('collect_media_garbage', stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+        os.utime(default_storage.path(name), (old, old))
+        call_command('collect_media_garbage', stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CartLineTestCases(TestCase):
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.cart = Cart.objects.create(for_anonymous_user=True)
+        for number in range(2):
+            create_dress(self.category, number, price=Decimal('100.00') * (number + 1))
+        self.first, self.second = CatalogProduct.objects.order_by('id')
+
+    def test_totals_follow_line_changes(self):
+        """
+        Итоги корзины меняются на величину изменения строки и совпадают с полным пересчетом.
+        """
+        self.assertTrue(add_to_cart(self.cart, self.first))
+        self.assertTrue(add_to_cart(self.cart, self.second, qty=2))
+        change_cart_qty(self.cart, self.first, 3)
+        self.assertEqual((self.cart.total_products, self.cart.final_price), (2, Decimal('700.00')))
+        remove_from_cart(self.cart, self.second)
+        self.assertEqual((self.cart.total_products, self.cart.final_price), (1, Decimal('300.00')))
+        recalc_cart(self.cart)
+        self.assertEqual((self.cart.total_products, self.cart.final_price), (1, Decimal('300.00')))
+
+    def test_repeated_add_does_not_duplicate_line(self):
+        """
+        Повторное добавление товара (например, двойной клик) не создает вторую строку.
+        """
+        add_to_cart(self.cart, self.first)
+        self.assertFalse(add_to_cart(self.cart, self.first))
+        self.assertEqual(self.cart.products.count(), 1)
+        self.assertEqual(self.cart.total_products, 1)
+
+    def test_add_existing_line_sets_qty(self):
+        """
+        Добавление товара, который уже есть в корзине, задает строке новое количество и пересчитывает итоги.
+        """
+        add_to_cart(self.cart, self.first)
+        self.assertFalse(add_to_cart(self.cart, self.first, qty=3, update_existing=True))
+        self.assertEqual(CartProduct.objects.get().qty, 3)
+        self.assertEqual((self.cart.total_products, self.cart.final_price), (1, Decimal('300.00')))
+
+    def test_remove_deletes_line_once(self):
+        """
+        Удаление строки выбирает ее один раз и удаляет вместе со связью с корзиной без повторной выборки.
+        """
+        add_to_cart(self.cart, self.first)
+        # Точка сохранения, выборка строки, удаление связи, удаление строки, обновление и чтение итогов,
+        # освобождение точки сохранения.
+        with self.assertNumQueries(7):
+            remove_from_cart(self.cart, self.first)
+        self.assertFalse(self.cart.products.exists())
+        self.assertFalse(CartProduct.objects.exists())
+
+    def test_other_integrity_errors_are_not_hidden(self):
+        with mock.patch.object(CartProduct.objects, 'bulk_create', side_effect=IntegrityError('NOT NULL')):
+            with self.assertRaises(IntegrityError):
+                add_to_cart(self.cart, self.first)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CartBatchTestCases(TestCase):
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        for number in range(2):
+            create_dress(self.category, number)
+
+    def post_operations(self, *operations):
+        return self.client.post(
+            '/cart/batch/', json.dumps({'operations': list(operations)}), content_type='application/json'
+        )
+
+    def test_batch_applies_operations_and_returns_cart(self):
+        """
+        Все операции выполняются одним запросом, в ответе строки и итоги корзины.
+        """
+        response = self.post_operations(
+            {'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'dress-0'},
+            {'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'dress-1'},
+            {'op': 'change_qty', 'ct_model': 'dress', 'slug': 'dress-0', 'qty': 3},
+            {'op': 'delete_from_cart', 'ct_model': 'dress', 'slug': 'dress-1'},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['total_products'], data['final_price']), (1, '300.00'))
+        self.assertEqual([(line['slug'], line['qty']) for line in data['lines']], [('dress-0', 3)])
+        self.assertEqual(self.client.session['cart_total_products'], 1)
+
+    def test_batch_is_atomic(self):
+        """
+        Если одна операция не выполнима, ни одна не применяется.
+        """
+        self.post_operations({'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'dress-0'})
+        response = self.post_operations(
+            {'op': 'change_qty', 'ct_model': 'dress', 'slug': 'dress-0', 'qty': 5},
+            {'op': 'change_qty', 'ct_model': 'dress', 'slug': 'dress-1', 'qty': 2},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartProduct.objects.get().qty, 1)
+        self.assertEqual(self.post_operations({'op': 'drop_table'}).status_code, 400)
+
+    def test_add_to_cart_sets_qty_of_existing_line(self):
+        self.post_operations({'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'dress-0'})
+        response = self.post_operations({'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'dress-0', 'qty': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([line['qty'] for line in response.json()['lines']], [4])
+        self.assertEqual(response.json()['final_price'], '400.00')
+
+    def test_rejected_batch_creates_no_cart(self):
+        """
+        Отклоненный пакет не создает корзину и покупателя.
+        """
+        user = User.objects.create(username='buyer')
+        self.client.force_login(user)
+        for operations in (
+            [{'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'missing'}],
+            [{'op': 'change_qty', 'ct_model': 'dress', 'slug': 'dress-0', 'qty': 2}],
+        ):
+            self.assertEqual(self.post_operations(*operations).status_code, 400)
+            self.assertFalse(Cart.objects.exists())
+            self.assertFalse(Customer.objects.exists())
+            self.assertNotIn('cart_id', self.client.session)
+        response = self.post_operations({'op': 'add_to_cart', 'ct_model': 'dress', 'slug': 'dress-0'})
+        self.assertEqual(response.json()['total_products'], 1)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class PageFragmentCacheTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.dress = create_dress(self.category, title="Test Dress", slug="test-slug")
+
+    def test_cached_pages_skip_database(self):
+        """
+        Повторный показ страниц товара и категории не выполняет запросов к базе.
+        """
+        for url in ('/products/dress/test-slug/', '/category/dress/'):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertContains(response, 'Test Dress')
+
+    def test_product_save_bumps_fragment_versions(self):
+        """
+        Сохранение товара сразу обновляет страницы товара и категории.
+        """
+        self.client.get('/products/dress/test-slug/')
+        self.client.get('/category/dress/')
+        self.dress.title = 'Renamed Dress'
+        self.dress.save()
+        self.assertContains(self.client.get('/products/dress/test-slug/'), 'Renamed Dress')
+        self.assertContains(self.client.get('/category/dress/'), 'Renamed Dress')
+
+    def test_moved_and_renamed_product_bumps_previous_pages(self):
+        """
+        Перенос товара в другую категорию и смена slug сбрасывают фрагменты прежней категории и прежней
+        страницы товара.
+        """
+        other_category = Category.objects.create(name='Вечерние', slug='evening')
+        self.client.get('/products/dress/test-slug/')
+        self.assertContains(self.client.get('/category/dress/'), 'Test Dress')
+        self.dress.category = other_category
+        self.dress.slug = 'new-slug'
+        self.dress.save()
+        self.assertNotContains(self.client.get('/category/dress/'), 'Test Dress')
+        self.assertContains(self.client.get('/category/evening/'), 'Test Dress')
+        self.assertEqual(self.client.get('/products/dress/test-slug/').status_code, 404)
+        self.assertContains(self.client.get('/products/dress/new-slug/'), 'Test Dress')
+
+    def test_renamed_category_bumps_product_pages(self):
+        """
+        Переименование категории и смена ее slug обновляют страницы ее товаров и сбрасывают страницу
+        категории под прежним slug.
+        """
+        self.assertContains(self.client.get('/products/dress/test-slug/'), 'Платья')
+        self.client.get('/category/dress/')
+        self.category.name = 'Вечерние платья'
+        self.category.slug = 'evening'
+        self.category.save()
+        self.assertContains(
+            self.client.get('/products/dress/test-slug/'),
+            '<li class="breadcrumb-item"><a href="/category/evening/">Вечерние платья</a></li>', html=True
+        )
+        self.assertEqual(self.client.get('/category/dress/').status_code, 404)
+
+    def test_cart_badge_stays_outside_fragment(self):
+        """
+        Значок корзины берется из сессии пользователя, а не из закэшированного фрагмента.
+        """
+        self.client.get('/products/dress/test-slug/')
+        self.client.get('/add-to-cart/dress/test-slug/')
+        response = self.client.get('/products/dress/test-slug/')
+        self.assertContains(response, '<span class="badge badge-pill badge-danger">1</span>', html=True)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SpecificationTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.dress = create_dress(
+            self.category, title="Test Dress", slug="test-slug", style="a-line", structure="<b>cotton</b>",
+            cut="baby doll", silhouette="trapezoid",
+        )
+
+    def test_spec_fields_follow_model_metadata(self):
+        """
+        Характеристики строятся по полям модели, включая крой, без общих полей товара.
+        """
+        self.assertEqual(
+            [name for name, _ in get_spec_fields(Skirt)],
+            ['Фасон', 'Состав', 'Крой', 'Силуэт', 'Посадка', 'Длина']
+        )
+
+    def test_spec_table_is_rendered_escaped_and_cached(self):
+        """
+        Таблица выводит значения с экранированием и кэшируется до следующего сохранения товара.
+        """
+        template = Template("{% load specifications %}{% product_spec product %}")
+        html = template.render(Context({'product': self.dress}))
+        self.assertIn('baby doll', html)
+        self.assertIn('&lt;b&gt;cotton&lt;/b&gt;', html)
+        with mock.patch('mainapp.templatetags.specifications.get_product_spec') as get_product_spec:
+            template.render(Context({'product': self.dress}))
+            get_product_spec.assert_not_called()
+        self.dress.cut = 'wrap'
+        self.dress.save()
+        self.assertIn('wrap', template.render(Context({'product': self.dress})))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CategoryPaginationTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        image = make_image()
+        for number in range(30):
+            create_dress(self.category, number, image=image, price=Decimal('100.00') + number % 4)
+
+    def collect_pages(self, sort):
+        products, cursor = CatalogProduct.objects.get_category_page(self.category, sort, page_size=7)
+        pages = [products]
+        while cursor:
+            with self.assertNumQueries(1):
+                products, cursor = CatalogProduct.objects.get_category_page(
+                    self.category, sort, CatalogProduct.objects.parse_cursor(cursor), page_size=7
+                )
+            pages.append(products)
+        return pages
+
+    def test_keyset_pages_cover_category_in_order(self):
+        """
+        Страницы для каждого порядка сортировки без пропусков и повторов дают все товары категории по порядку.
+        """
+        expected_orders = {
+            'new': CatalogProduct.objects.order_by('-id'),
+            'price': CatalogProduct.objects.order_by('price', 'id'),
+            '-price': CatalogProduct.objects.order_by('-price', '-id'),
+        }
+        for sort, expected in expected_orders.items():
+            pages = self.collect_pages(sort)
+            self.assertEqual([len(page) for page in pages], [7, 7, 7, 7, 2])
+            self.assertEqual([p.id for page in pages for p in page], [p.id for p in expected])
+
+    def test_price_cursor_seeks_in_index(self):
+        """
+        Следующая страница по цене ищет диапазон цен в индексе (category, price, id), а не просматривает категорию.
+        """
+        queries = []
+
+        def capture(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        for sort, bound in (('price', 'price>'), ('-price', 'price<')):
+            queries.clear()
+            with connection.execute_wrapper(capture):
+                CatalogProduct.objects.get_category_page(self.category, sort, (Decimal('102.00'), 10))
+            sql, params = queries[0]
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn('catalog_category_price_idx', plan)
+            self.assertIn(bound, plan)
+
+    def test_category_page_links_next_page(self):
+        """
+        Страница категории показывает первую страницу товаров и ссылку на следующую.
+        """
+        response = self.client.get('/category/dress/?sort=price')
+        first_page = response.context['category_products']
+        self.assertEqual(len(first_page), CatalogProduct.objects.CATEGORY_PAGE_SIZE)
+        self.assertContains(response, 'after=')
+        response = self.client.get('/category/dress/?sort=price&after=' + response.context['next_cursor'])
+        second_page = response.context['category_products']
+        self.assertEqual(len(second_page), CatalogProduct.objects.CATEGORY_PAGE_SIZE)
+        self.assertFalse({p.id for p in first_page} & {p.id for p in second_page})
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProductFacetTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        image = make_image()
+        for number, (color, length) in enumerate([
+            ('Черный', 'макси'), ('черный ', 'мини'), ('Красный', 'макси'), ('белый', 'миди'),
+        ]):
+            create_dress(self.category, number, image=image, color=color, length=length)
+
+    def test_facets_follow_product_changes(self):
+        """
+        Индекс фасетов хранит нормализованные значения и обновляется при изменении и удалении товара.
+        """
+        self.assertEqual(ProductFacet.objects.filter(attribute='color', value='черный').count(), 2)
+        dress = Dress.objects.get(slug='dress-0')
+        dress.color = 'Белый'
+        dress.save()
+        self.assertEqual(ProductFacet.objects.filter(attribute='color', value='черный').count(), 1)
+        dress.delete()
+        self.assertFalse(ProductFacet.objects.filter(value='белый', catalog_product__slug='dress-0').exists())
+
+    def test_counts_are_disjunctive(self):
+        """
+        Количество для атрибута учитывает выбор по остальным атрибутам, но не по нему самому.
+        """
+        with self.assertNumQueries(2):
+            counts = ProductFacet.objects.get_counts(self.category, {'color': ['черный']})
+        self.assertEqual(dict(counts['color']), {'черный': 2, 'красный': 1, 'белый': 1})
+        self.assertEqual(dict(counts['length']), {'макси': 1, 'мини': 1})
+
+    def test_category_page_filters_by_facets(self):
+        """
+        Страница категории отбирает товары по выбранным фасетам и сохраняет их в ссылках сортировки.
+        """
+        response = self.client.get('/category/dress/?color=Черный&color=красный&length=макси')
+        self.assertEqual(
+            sorted(p.slug for p in response.context['category_products']), ['dress-0', 'dress-2']
+        )
+        self.assertContains(response, 'sort=price&amp;color=')
+        response = self.client.get('/category/dress/?color=белый')
+        self.assertEqual([p.slug for p in response.context['category_products']], ['dress-3'])
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SearchTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.skirt_category = Category.objects.create(name='Юбки', slug='skirt')
+        self.dress = create_dress(
+            self.category, title="Вечернее платье", slug="evening", description="Длинное платье из шелка",
+            style="вечерний", structure="шелк", cut="прямой", silhouette="футляр", color="изумрудный", length="макси",
+        )
+        Skirt.objects.create(
+            category=self.skirt_category, title="Юбка-карандаш", slug="pencil", image=make_image(),
+            price=Decimal('50.00'), style="офисный", structure="шерсть", cut="прямой", silhouette="карандаш",
+            landing="высокая", length="миди",
+        )
+
+    def test_search_by_title_description_and_specs(self):
+        """
+        Поиск находит товары по названию, описанию и характеристикам, с учетом префиксов слов.
+        """
+        self.assertEqual([p.slug for p in search.search('изумрудн')[0]], ['evening'])
+        self.assertEqual([p.slug for p in search.search('ШЕЛК')[0]], ['evening'])
+        self.assertEqual({p.slug for p in search.search('прямой')[0]}, {'evening', 'pencil'})
+        self.assertEqual(search.search('" OR NOT')[0], [])
+
+    def test_index_follows_product_changes(self):
+        """
+        Индекс обновляется при сохранении и удалении товара.
+        """
+        self.dress.color = 'алый'
+        self.dress.save()
+        self.assertEqual(search.search('изумрудный')[0], [])
+        self.assertEqual([p.slug for p in search.search('алый')[0]], ['evening'])
+        self.dress.delete()
+        self.assertEqual(search.search('алый')[0], [])
+
+    def test_rebuild_and_search_view(self):
+        """
+        Полная перестройка индекса сохраняет результаты всех моделей товаров, страница поиска их показывает.
+        """
+        self.assertEqual(set(get_product_models()), {Dress, Skirt})
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Проиндексировано товаров: 2', out.getvalue())
+        response = self.client.get('/search/', {'q': 'карандаш'})
+        self.assertContains(response, 'Юбка-карандаш')
+        self.assertNotContains(response, 'Вечернее платье')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SeedAndBenchmarkTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        call_command(
+            'seed_catalog', categories=2, dresses=10, skirts=10, customers=3, carts=4, orders=2, stdout=StringIO()
+        )
+
+    def test_seed_creates_catalog_carts_and_orders(self):
+        """
+        Команда заполнения создает товары в индексах каталога, фасетов и поиска, корзины и заказы по корзинам
+        покупателей.
+        """
+        self.assertEqual(CatalogProduct.objects.filter(slug__startswith='seed-').count(), 20)
+        self.assertEqual(ProductFacet.objects.filter(catalog_product__slug__startswith='seed-').count(), 100)
+        if search.is_available():
+            self.assertEqual(len(search.search('синтетический')[0]), 20)
+        self.assertEqual(Customer.objects.filter(user__username__startswith='seed-user-').count(), 3)
+        self.assertEqual(Cart.objects.filter(in_order=False).count(), 4)
+        self.assertEqual(Cart.objects.filter(in_order=True).count(), 2)
+        for cart in Cart.objects.all():
+            self.assertEqual(cart.total_products, cart.products.count())
+
+    def test_benchmark_writes_json_report(self):
+        """
+        Команда замеров записывает в JSON задержки, количество запросов и память для каждого представления.
+        """
+        output = os.path.join(TEST_MEDIA_ROOT, 'benchmark.json')
+        call_command('benchmark_views', iterations=2, warmup=1, output=output, stdout=StringIO())
+        with open(output, encoding='utf-8') as report:
+            results = json.load(report)
+        self.assertEqual(set(results['views']), {
+            'base', 'category_detail', 'product_detail', 'add_to_cart', 'change_qty', 'cart', 'delete_from_cart'
+        })
+        for view in results['views'].values():
+            self.assertLess(view['status'], 400)
+            self.assertLessEqual(view['p50_ms'], view['p95_ms'])
+            self.assertGreater(view['queries'], 0)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AsgiBenchmarkTestCases(TransactionTestCase):
+    # Запросы к ASGI-приложению выполняются в отдельных потоках со своими соединениями,
+    # поэтому данные каталога должны быть зафиксированы.
+
+    def setUp(self) -> None:
+        cache.clear()
+        call_command(
+            'seed_catalog', categories=1, dresses=3, skirts=3, customers=1, carts=1, orders=0, stdout=StringIO()
+        )
+
+    def test_asgi_benchmark_compares_sync_and_async_views(self):
+        """
+        Замеры под ASGI записывают пропускную способность синхронных и асинхронных страниц каталога.
+        """
+        output = os.path.join(TEST_MEDIA_ROOT, 'benchmark_asgi.json')
+        call_command('benchmark_asgi', requests=4, concurrency='1,2', warmup=1, output=output, stdout=StringIO())
+        with open(output, encoding='utf-8') as report:
+            results = json.load(report)
+        self.assertEqual(set(results['views']), {'base', 'category_detail', 'product_detail'})
+        for modes in results['views'].values():
+            self.assertEqual(set(modes), {'sync', 'async'})
+            for levels in modes.values():
+                self.assertEqual(set(levels), {'1', '2'})
+                for view in levels.values():
+                    self.assertEqual(view['status'], [200])
+                    self.assertGreater(view['requests_per_second'], 0)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class QueryBudgetTestCases(QueryBudgetAssertionsMixin, TransactionTestCase):
+    # Транзакции представлений открываются запросом BEGIN, как при обычной работе: внутри транзакции
+    # TestCase они стали бы точками сохранения, которые бюджет не считает.
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        image = make_image()
+        for number in range(20):
+            create_dress(self.category, number, image=image)
+        self.user = User.objects.create(username='testuser', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+
+    def walk_views(self):
+        """
+        Обход основных представлений с холодным кэшем; каждое должно уложиться в свой бюджет запросов.
+        """
+        cache.clear()
+        product_path = 'dress/dress-0/'
+        with self.assertWithinQueryBudget(BaseView):
+            self.client.get('/')
+        with self.assertWithinQueryBudget(CategoryDetailView):
+            self.client.get('/category/dress/?color=black')
+        with self.assertWithinQueryBudget(ProductDetailView):
+            self.client.get('/products/' + product_path)
+        with self.assertWithinQueryBudget(SearchView):
+            self.client.get('/search/?q=dress')
+        for number in range(1, 6):
+            with self.assertWithinQueryBudget(AddToCartView):
+                self.client.get('/add-to-cart/dress/dress-{}/'.format(number))
+        with self.assertWithinQueryBudget(ChangeQTYView):
+            self.client.post('/change-qty/dress/dress-1/', {'qty': 3})
+        with self.assertWithinQueryBudget(DeleteFromCartView):
+            self.client.get('/remove-from-cart/dress/dress-2/')
+        with self.assertWithinQueryBudget(CartView):
+            self.client.get('/cart/')
+        with self.assertWithinQueryBudget(CheckoutView):
+            self.client.get('/checkout/')
+
+    def test_anonymous_views_within_budget(self):
+        self.walk_views()
+
+    def test_customer_views_within_budget(self):
+        self.client.force_login(self.user)
+        self.walk_views()
+        with self.assertWithinQueryBudget(MakeOrderView):
+            response = self.client.post('/make-order/', {
+                'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '+79000000000', 'address': 'Адрес',
+                'buying_type': 'self', 'order_date': '2030-01-01', 'comment': '',
+            })
+        self.assertEqual(response.url, '/')
+
+    def test_first_add_of_new_customer_within_budget(self):
+        """
+        Первое добавление товара вошедшим пользователем без покупателя создает покупателя и корзину
+        и укладывается в бюджет, как и повторное добавление того же товара.
+        """
+        user = User.objects.create(username='newuser')
+        self.client.force_login(user)
+        for _ in range(2):
+            with self.assertWithinQueryBudget(AddToCartView):
+                self.client.get('/add-to-cart/dress/dress-0/')
+        self.assertEqual(Cart.objects.get(owner__user=user).total_products, 1)
+
+    def test_middleware_flags_request_over_budget(self):
+        """
+        Промежуточный слой пишет в лог отчет по местам вызова и помечает ответ заголовком,
+        если представление превысило бюджет, и не трогает ответы в пределах бюджета.
+        """
+        self.client.get('/add-to-cart/dress/dress-0/')
+        with override_settings(QUERY_BUDGET_ENABLED=True):
+            client = Client()
+            client.cookies = self.client.cookies
+            response = client.get('/cart/')
+            self.assertFalse(response.has_header('X-Query-Budget-Exceeded'))
+            with mock.patch.object(CartView, 'query_budget', 1):
+                with self.assertLogs('mainapp.query_budget', 'WARNING') as logs:
+                    response = client.get('/cart/')
+        self.assertRegex(response['X-Query-Budget-Exceeded'], r'^\d+/1$')
+        # Место вызова ищется только для запросов сверх бюджета.
+        self.assertIn('{} - 1'.format(WITHIN_BUDGET), logs.output[0])
+        self.assertIn('mainapp', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_middleware_is_off_without_debug(self):
+        """
+        Без настройки QUERY_BUDGET_ENABLED промежуточный слой работает только при DEBUG.
+        """
+        with override_settings(DEBUG=False), mock.patch.object(CartView, 'query_budget', 0):
+            del settings.QUERY_BUDGET_ENABLED
+            response = Client().get('/cart/')
+        self.assertFalse(response.has_header('X-Query-Budget-Exceeded'))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class MetricsTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        create_dress(self.category, title="Dress", slug="dress")
+
+    def test_request_metrics_are_recorded_and_exported(self):
+        """
+        Запрос к странице добавляет в гистограммы время, запросы к базе, время шаблонов и размер ответа,
+        а метрики отдаются в формате Prometheus.
+        """
+        count_before, _ = metrics.REQUEST_DURATION.get('category_detail')
+        _, template_before = metrics.TEMPLATE_DURATION.get('category_detail')
+        response = self.client.get('/category/dress/')
+        self.assertEqual(metrics.REQUEST_DURATION.get('category_detail')[0], count_before + 1)
+        self.assertGreater(metrics.TEMPLATE_DURATION.get('category_detail')[1], template_before)
+        self.assertGreater(metrics.DB_QUERIES.get('category_detail')[1], 0)
+        self.assertGreater(metrics.RESPONSE_SIZE.get('category_detail')[1], len(response.content) - 1)
+        response = self.client.get('/internal/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE shop_request_duration_seconds histogram', body)
+        self.assertIn('shop_request_duration_seconds_bucket{view="category_detail",le="+Inf"} ', body)
+        self.assertIn('shop_requests_total{view="category_detail",status="200"} ', body)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_counted_but_not_measured(self):
+        """
+        Незамеренные запросы не попадают в гистограммы, но счетчик запросов учитывает все запросы.
+        """
+        count_before, _ = metrics.REQUEST_DURATION.get('category_detail')
+        requests_before = metrics.REQUESTS.get('category_detail', 200)
+        self.client.get('/category/dress/')
+        self.assertEqual(metrics.REQUEST_DURATION.get('category_detail')[0], count_before)
+        self.assertEqual(metrics.REQUESTS.get('category_detail', 200), requests_before + 1)
+
+    def test_metrics_are_internal(self):
+        response = self.client.get('/internal/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_readiness_probes_database(self):
+        response = self.client.get('/internal/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ready'])
+        self.assertIn('latency_ms', response.json()['databases']['default'])
+        with override_settings(READINESS_MAX_DB_LATENCY=-1):
+            response = self.client.get('/internal/ready/')
+        self.assertEqual(response.status_code, 503)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CheckoutTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.dresses = [
+            create_dress(self.category, number, price=Decimal('100.00') * (number + 1)) for number in range(3)
+        ]
+        self.user = User.objects.create(username='testuser', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        self.client.force_login(self.user)
+        self.order_data = {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '+79000000000', 'address': 'Адрес',
+            'buying_type': 'self', 'order_date': '2030-01-01', 'comment': '',
+        }
+
+    def test_order_keeps_snapshot_of_cart(self):
+        """
+        Заказ хранит строки с названием и ценой товара на момент оформления; изменение цены товара
+        не меняет оформленный заказ, а история заказов читается одним запросом.
+        """
+        self.client.get('/add-to-cart/dress/dress-0/')
+        self.client.get('/add-to-cart/dress/dress-2/')
+        self.client.post('/change-qty/dress/dress-2/', {'qty': 2})
+        cart = Cart.objects.get(owner=self.customer)
+        response = self.client.post('/make-order/', self.order_data)
+        self.assertEqual(response.url, '/')
+        order = Order.objects.get(customer=self.customer)
+        self.assertEqual(order.cart, cart)
+        self.assertEqual(order.final_price, Decimal('700.00'))
+        self.assertEqual(
+            [(line.product_type, line.title, line.price, line.qty) for line in order.lines.order_by('id')],
+            [('dress', 'Dress 0', Decimal('100.00'), 1), ('dress', 'Dress 2', Decimal('300.00'), 2)]
+        )
+        self.assertTrue(Cart.objects.get(pk=cart.pk).in_order)
+        self.dresses[0].price = Decimal('1.00')
+        self.dresses[0].save()
+        self.assertEqual(order.lines.get(title='Dress 0').price, Decimal('100.00'))
+        with self.assertNumQueries(1):
+            history = list(Order.objects.get_customer_orders(self.customer))
+        self.assertEqual([(o.pk, o.final_price) for o in history], [(order.pk, Decimal('700.00'))])
+
+    def test_cart_is_ordered_once(self):
+        """
+        Повторная отправка формы по уже оформленной корзине не создает второй заказ.
+        """
+        self.client.get('/add-to-cart/dress/dress-1/')
+        cart = Cart.objects.get(owner=self.customer)
+        self.assertIsNotNone(Order.objects.place_order(Order(customer=self.customer, **{
+            key: value for key, value in self.order_data.items() if key != 'order_date'
+        }), cart))
+        stale_cart = Cart.objects.get(pk=cart.pk)
+        stale_cart.in_order = False
+        self.assertIsNone(Order.objects.place_order(Order(customer=self.customer, first_name='И'), stale_cart))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderLine.objects.count(), 1)
+        response = self.client.post('/make-order/', self.order_data)
+        self.assertEqual(response.url, '/checkout/')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cart_lines_are_read_after_cart_is_locked(self):
+        """
+        Строки заказа читаются после пометки корзины оформленной, в той же транзакции: изменение корзины
+        не может попасть между чтением строк и оформлением.
+        """
+        self.client.get('/add-to-cart/dress/dress-1/')
+        cart = Cart.objects.get(owner=self.customer)
+        get_cart_lines = CatalogProduct.objects.get_cart_lines
+
+        def read_lines(locked_cart):
+            self.assertTrue(Cart.objects.get(pk=locked_cart.pk).in_order)
+            return get_cart_lines(locked_cart)
+
+        with mock.patch.object(CatalogProduct.objects, 'get_cart_lines', side_effect=read_lines):
+            order = Order.objects.place_order(Order(customer=self.customer, first_name='И'), cart)
+        self.assertEqual(order.final_price, Decimal('200.00'))
+
+    def test_empty_cart_is_not_ordered(self):
+        cart = Cart.objects.create(owner=self.customer)
+        self.assertIsNone(Order.objects.place_order(Order(customer=self.customer, first_name='И'), cart))
+        self.assertFalse(Cart.objects.get(pk=cart.pk).in_order)
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AdminChangelistTestCases(TestCase):
+    CHANGELISTS = ('cartproduct', 'cart', 'customer', 'order', 'dress')
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.image = make_image()
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin_user)
+        self.number = 0
+
+    def add_orders(self, count):
+        """
+        Функция создает count покупателей, каждый со своим платьем в корзине и заказом по ней.
+        """
+        for _ in range(count):
+            self.number += 1
+            dress = create_dress(self.category, self.number, image=self.image)
+            customer = Customer.objects.create(
+                user=User.objects.create(username='user-{}'.format(self.number)), phone=str(self.number)
+            )
+            cart = Cart.objects.create(owner=customer)
+            add_to_cart(cart, CatalogProduct.objects.get(object_id=dress.pk, product_type='dress'))
+            Order.objects.place_order(Order(
+                customer=customer, first_name='И', last_name='И', phone='+7900{}'.format(self.number)
+            ), cart)
+
+    def count_queries(self):
+        counts = {}
+        for model in self.CHANGELISTS:
+            with QueryBudget() as budget:
+                response = self.client.get('/admin/mainapp/{}/'.format(model))
+            self.assertEqual(response.status_code, 200)
+            counts[model] = len(budget)
+        return counts
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_orders(2)
+        few = self.count_queries()
+        self.add_orders(20)
+        self.assertEqual(self.count_queries(), few)
+
+    def test_order_search_by_phone_and_number(self):
+        self.add_orders(3)
+        order = Order.objects.order_by('id').first()
+        response = self.client.get('/admin/mainapp/order/?q={}'.format(order.pk))
+        self.assertEqual(list(response.context['cl'].result_list), [order])
+        response = self.client.get('/admin/mainapp/order/', {'q': '+79002'})
+        self.assertEqual([o.phone for o in response.context['cl'].result_list], ['+79002'])
+
+    def test_large_unfiltered_changelist_uses_estimated_count(self):
+        """
+        Количество строк списка без фильтров берется из статистики ANALYZE, если таблица большая.
+        """
+        self.add_orders(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimate_row_count(Order), 3)
+        with mock.patch.object(ApproximateCountPaginator, 'APPROXIMATE_COUNT_THRESHOLD', 1), \
+                mock.patch('mainapp.admin.estimate_row_count', return_value=5000000):
+            response = self.client.get('/admin/mainapp/order/')
+            self.assertEqual(response.context['cl'].result_count, 5000000)
+            response = self.client.get('/admin/mainapp/order/?status__exact=new')
+            self.assertEqual(response.context['cl'].result_count, 3)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProductImportTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.skirt_category = Category.objects.create(name='Юбки', slug='skirt')
+        self.import_root = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        self.images_dir = os.path.join(self.import_root, 'images')
+        os.mkdir(self.images_dir)
+        for color in ('red', 'blue'):
+            Image.new('RGB', (20, 20), color).save(os.path.join(self.images_dir, color + '.jpg'), 'JPEG')
+        self.rows = [
+            {'type': 'dress', 'category': 'dress', 'title': 'Красное платье', 'slug': 'red-dress', 'price': '150.00',
+             'description': 'Платье', 'image': 'red.jpg', 'style': 'вечерний', 'structure': 'шелк', 'cut': 'прямой',
+             'silhouette': 'футляр', 'color': 'Красный', 'length': 'макси'},
+            {'type': 'skirt', 'category': 'skirt', 'title': 'Синяя юбка', 'slug': 'blue-skirt', 'price': '90',
+             'description': '', 'image': 'blue.jpg', 'style': 'деловой', 'structure': 'шерсть', 'cut': 'прямой',
+             'silhouette': 'карандаш', 'landing': 'высокая', 'length': 'миди'},
+            {'type': 'dress', 'category': 'dress', 'title': 'Без цены', 'slug': 'no-price', 'price': 'abc',
+             'image': 'red.jpg'},
+        ]
+        self.rows.append(dict(self.rows[0], slug='no-image', image='../outside.jpg'))
+
+    def write_catalog(self, rows):
+        path = os.path.join(self.import_root, 'catalog.jsonl')
+        with open(path, 'w', encoding='utf-8') as catalog_file:
+            for row in rows:
+                catalog_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        return path
+
+    def run_import(self, rows):
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            'import_products', self.write_catalog(rows), images=self.images_dir, workers=1, batch_size=2,
+            stdout=stdout, stderr=stderr
+        )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_creates_products_and_indexes(self):
+        stdout, stderr = self.run_import(self.rows)
+        self.assertIn('Создано товаров: 2, обновлено: 0, с ошибками: 2', stdout)
+        self.assertIn('Строка 3: price', stderr)
+        self.assertIn('Строка 4: Нет файла изображения', stderr)
+        dress = Dress.objects.get(slug='red-dress')
+        self.assertEqual(dress.price, Decimal('150.00'))
+        self.assertTrue(dress.image.name.startswith('images/'))
+        self.assertTrue(default_storage.exists(rendition_name(dress.image.name, 'card')))
+        self.assertEqual(
+            set(CatalogProduct.objects.values_list('slug', flat=True)), {'red-dress', 'blue-skirt'}
+        )
+        self.assertTrue(ProductFacet.objects.filter(attribute='color', value='красный').exists())
+        if search.is_available():
+            self.assertEqual([p.slug for p in search.search('юбка')[0]], ['blue-skirt'])
+
+    def test_reimport_is_idempotent(self):
+        self.run_import(self.rows)
+        self.rows[0]['price'] = '120.00'
+        stdout, _ = self.run_import(self.rows)
+        self.assertIn('Создано товаров: 0, обновлено: 2', stdout)
+        self.assertEqual(Dress.objects.count(), 1)
+        self.assertEqual(Skirt.objects.count(), 1)
+        self.assertEqual(CatalogProduct.objects.count(), 2)
+        self.assertEqual(CatalogProduct.objects.get(slug='red-dress').price, Decimal('120.00'))
+        self.assertEqual(ProductFacet.objects.filter(catalog_product__slug='red-dress', attribute='color').count(), 1)
+
+    def test_reimport_into_other_category_bumps_previous_category(self):
+        self.run_import(self.rows[:1])
+        self.assertContains(self.client.get('/category/dress/'), 'Красное платье')
+        self.run_import([dict(self.rows[0], category='skirt')])
+        self.assertNotContains(self.client.get('/category/dress/'), 'Красное платье')
+        self.assertContains(self.client.get('/category/skirt/'), 'Красное платье')
+
+    def test_admin_import_page(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        self.assertContains(self.client.get('/admin/mainapp/dress/'), '/admin/mainapp/dress/import/')
+        with override_settings(PRODUCT_IMPORT_ROOT=self.import_root, PRODUCT_IMPORT_WORKERS=1):
+            with open(self.write_catalog(self.rows[:2]), 'rb') as catalog_file:
+                response = self.client.post('/admin/mainapp/dress/import/', {
+                    'catalog': catalog_file, 'images_dir': 'images',
+                }, follow=True)
+        self.assertContains(response, 'Создано товаров: 2')
+        self.assertEqual(CatalogProduct.objects.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class OrderExportTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        category = Category.objects.create(name='Платья', slug='dress')
+        dresses = [create_dress(category, number) for number in range(2)]
+        customer = Customer.objects.create(user=User.objects.create(username='customer'))
+        for number in range(5):
+            cart = Cart.objects.create(owner=customer)
+            for dress in dresses[:number % 2 + 1]:
+                add_to_cart(cart, CatalogProduct.objects.get(object_id=dress.pk, product_type='dress'))
+            Order.objects.place_order(Order(
+                customer=customer, first_name='Имя', last_name='Фамилия', phone=str(number),
+                status=Order.STATUS_COMPLETED if number < 3 else Order.STATUS_NEW,
+            ), cart)
+        Order.objects.filter(phone='4').update(created_at=timezone.now() - datetime.timedelta(days=30))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def export(self, **params):
+        response = self.client.get('/admin/mainapp/order/export/', params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_has_row_per_line(self):
+        rows = list(csv.DictReader(StringIO(self.export(format='csv'))))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1]['phone'], '1')
+        self.assertEqual([row['line_title'] for row in rows if row['phone'] == '1'], ['Dress 0', 'Dress 1'])
+
+    def test_jsonl_export_is_filtered(self):
+        today = timezone.localdate().isoformat()
+        orders = [
+            json.loads(line) for line in
+            self.export(format='jsonl', status='completed', date_from=today, date_to=today).splitlines()
+        ]
+        self.assertEqual([order['phone'] for order in orders], ['0', '1', '2'])
+        self.assertEqual(len(orders[1]['lines']), 2)
+        self.assertEqual(orders[1]['final_price'], '200.00')
+        orders = self.export(format='jsonl', date_to=(timezone.localdate() - datetime.timedelta(days=1)).isoformat())
+        self.assertEqual([json.loads(line)['phone'] for line in orders.splitlines()], ['4'])
+
+    def test_export_reads_orders_in_chunks(self):
+        """
+        Выгрузка читает заказы одним запросом частями и загружает строки одним запросом на часть.
+        """
+        with mock.patch('mainapp.exporter.EXPORT_CHUNK_SIZE', 2):
+            with QueryBudget() as budget:
+                list(iter_csv(filter_orders()))
+        self.assertEqual(len(budget), 1 + 3)
+
+    def test_export_form_is_shown_without_format(self):
+        response = self.client.get('/admin/mainapp/order/export/')
+        self.assertContains(response, 'name="date_from"')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AbandonedCartTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        category = Category.objects.create(name='Платья', slug='dress')
+        dress = create_dress(category, title="Dress", slug="dress")
+        self.product = CatalogProduct.objects.get(object_id=dress.pk, product_type='dress')
+        self.customer = Customer.objects.create(user=User.objects.create(username='customer'))
+        self.old_carts = []
+        for _ in range(5):
+            cart = Cart.objects.create(for_anonymous_user=True)
+            add_to_cart(cart, self.product)
+            self.old_carts.append(cart)
+        self.fresh_cart = Cart.objects.create(owner=self.customer)
+        add_to_cart(self.fresh_cart, self.product)
+        self.ordered_cart = Cart.objects.create(owner=self.customer)
+        add_to_cart(self.ordered_cart, self.product)
+        self.order = Order.objects.place_order(
+            Order(customer=self.customer, first_name='Имя', last_name='Фамилия', phone='1'), self.ordered_cart
+        )
+        long_ago = timezone.now() - datetime.timedelta(days=60)
+        Cart.objects.exclude(pk=self.fresh_cart.pk).update(updated_at=long_ago)
+
+    def test_cart_change_updates_timestamp(self):
+        cart = self.old_carts[0]
+        cart.refresh_from_db()
+        old_updated_at = cart.updated_at
+        change_cart_qty(cart, self.product, 2)
+        cart.refresh_from_db()
+        self.assertGreater(cart.updated_at, old_updated_at)
+
+    def test_abandoned_carts_are_deleted_in_batches(self):
+        stdout = StringIO()
+        call_command('collect_abandoned_carts', days=30, batch_size=2, stdout=stdout)
+        self.assertFalse(Cart.objects.filter(pk__in=[cart.pk for cart in self.old_carts]).exists())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {self.fresh_cart.pk, self.ordered_cart.pk})
+        self.assertEqual(CartProduct.objects.filter(cart__in=self.old_carts).count(), 0)
+        self.assertEqual(Cart.products.through.objects.count(), 2)
+        self.assertEqual(OrderLine.objects.filter(order=self.order).count(), 1)
+        self.assertIn('Удалено брошенных корзин: 5, пачек: 3', stdout.getvalue())
+        self.assertIn('mainapp.CartProduct: 5', stdout.getvalue())
+
+    def test_dry_run_deletes_nothing(self):
+        stdout = StringIO()
+        call_command('collect_abandoned_carts', days=30, dry_run=True, stdout=stdout)
+        self.assertIn('Найдено брошенных корзин: 5', stdout.getvalue())
+        self.assertEqual(Cart.objects.count(), 7)
+
+    def test_deleted_cart_is_replaced_for_session(self):
+        self.client.get('/add-to-cart/dress/dress/')
+        cart_id = self.client.session['cart_id']
+        Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now() - datetime.timedelta(days=60))
+        stderr = StringIO()
+        call_command('collect_abandoned_carts', days=30, analyze=True, vacuum=True, stdout=StringIO(), stderr=stderr)
+        # Тест выполняется внутри транзакции, а VACUUM в транзакции невозможен.
+        self.assertIn('VACUUM', stderr.getvalue())
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+        response = self.client.get('/cart/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class DatabaseConnectionTestCases(TestCase):
+    def test_sqlite_pragmas_are_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_database_pragmas_override_defaults(self):
+        pragmas = dict(get_sqlite_pragmas({'PRAGMAS': {'journal_mode': None, 'query_only': 'on'}}))
+        self.assertNotIn('journal_mode', pragmas)
+        self.assertEqual(pragmas['query_only'], 'on')
+        self.assertEqual(pragmas['busy_timeout'], 5000)
+
+    def test_router_sends_catalog_reads_to_replica(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(CatalogProduct), 'default')
+        with mock.patch.object(ReplicaRouter, 'replica', 'replica'), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            for model in (Category, Dress, CatalogProduct, ProductFacet):
+                self.assertEqual(router.db_for_read(model), 'replica')
+            for model in (Cart, CartProduct, Customer, Order):
+                self.assertEqual(router.db_for_read(model), 'default')
+            self.assertEqual(router.db_for_write(CatalogProduct), 'default')
+            self.assertFalse(router.allow_migrate('replica', 'mainapp'))
+            with use_primary():
+                self.assertEqual(router.db_for_read(CatalogProduct), 'default')
+        with mock.patch.object(ReplicaRouter, 'replica', 'replica'):
+            # Внутри транзакции основной базы данных каталог читается из нее же.
+            self.assertEqual(router.db_for_read(CatalogProduct), 'default')
+
+    def test_connection_does_not_change_journal_mode(self):
+        """
+        Режим журнала WAL задается миграцией, а не при каждом соединении: открытие базы данных ее не изменяет.
+        """
+        self.assertNotIn('journal_mode', dict(get_sqlite_pragmas(connection.settings_dict)))
+
+    def test_caches_are_refilled_from_primary(self):
+        """
+        Боковая панель и фрагменты страниц после промаха кэша читаются из основной базы данных, а не из реплики,
+        которая может отставать (в тестах реплики нет, и чтение из нее завершилось бы ошибкой).
+        """
+        Category.objects.create(name='Платья', slug='dress')
+        cache.clear()
+        with mock.patch.object(ReplicaRouter, 'replica', 'replica'), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            with self.assertRaises(ConnectionDoesNotExist):
+                Category.objects.count()
+            self.assertEqual(len(Category.objects.get_categories_for_left_sidebar()), 1)
+            fragment = get_or_render_fragment('test', 'category', 'dress', lambda: str(Category.objects.count()))
+            self.assertEqual(fragment, '1')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AsyncCatalogViewTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        category = Category.objects.create(name='Платья', slug='dress')
+        image = make_image()
+        for number in range(3):
+            create_dress(category, number, image=image)
+
+    async def assertSamePage(self, path, view_class):
+        """
+        Асинхронный вариант страницы укладывается в бюджет запросов и отдает ту же страницу, что и синхронный.
+        """
+        await cache.aclear()
+        async with QueryBudget(view_class) as budget:
+            response = await self.async_client.get('/async' + path)
+        if budget.exceeded:
+            self.fail('{}: {}'.format(view_class.__name__, budget.report()))
+        self.assertEqual(response.status_code, 200)
+        await cache.aclear()
+        expected = await self.async_client.get(path)
+        self.assertEqual(response.content.decode(), expected.content.decode())
+        return response
+
+    async def test_async_base_view(self):
+        response = await self.assertSamePage('/', AsyncBaseView)
+        self.assertContains(response, 'Dress 2')
+
+    async def test_async_category_view(self):
+        response = await self.assertSamePage('/category/dress/?color=black', AsyncCategoryDetailView)
+        self.assertContains(response, 'Dress 0')
+
+    async def test_async_product_view(self):
+        response = await self.assertSamePage('/products/dress/dress-1/', AsyncProductDetailView)
+        self.assertContains(response, 'Dress 1')
+        # Повторный запрос берет основную часть страницы из кэша фрагментов.
+        async with QueryBudget() as budget:
+            await self.async_client.get('/async/products/dress/dress-1/')
+        self.assertEqual(len(budget), 0)
+
+    async def test_async_product_view_not_found(self):
+        response = await self.async_client.get('/async/products/dress/missing/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_views_are_measured(self):
+        before = metrics.REQUESTS.get('async_base', 200)
+        await self.async_client.get('/async/')
+        self.assertEqual(metrics.REQUESTS.get('async_base', 200), before + 1)
+        self.assertGreater(metrics.DB_QUERIES.get('async_base')[1], 0)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ConditionalGetTestCases(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.category = Category.objects.create(name='Платья', slug='dress')
+        self.other_category = Category.objects.create(name='Юбки', slug='skirt')
+        self.dresses = [create_dress(self.category, number) for number in range(2)]
+
+    def assertNotModified(self, path):
+        """
+        Повторный запрос с валидаторами первого ответа получает 304 без запросов к базе данных.
+        """
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        not_modified = self.client.get(path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+        return response
+
+    def test_catalog_pages_answer_not_modified(self):
+        for path in (
+            '/', '/category/dress/?sort=price_asc', '/products/dress/dress-0/', '/async/',
+            '/async/products/dress/dress-0/',
+        ):
+            self.assertNotModified(path)
+
+    def test_product_change_updates_timestamps_and_etag(self):
+        response = self.assertNotModified('/products/dress/dress-0/')
+        dress = self.dresses[0]
+        old_updated_at = dress.updated_at
+        dress.price = Decimal('90.00')
+        dress.save()
+        dress.refresh_from_db()
+        self.assertGreater(dress.updated_at, old_updated_at)
+        self.assertGreater(Category.objects.get(pk=self.category.pk).updated_at, old_updated_at)
+        changed = self.client.get('/products/dress/dress-0/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_moved_and_deleted_products_touch_categories(self):
+        moved_at = self.other_category.updated_at
+        dress = self.dresses[1]
+        dress.category = self.other_category
+        dress.save()
+        self.other_category.refresh_from_db()
+        self.assertGreater(self.other_category.updated_at, moved_at)
+        self.category.refresh_from_db()
+        deleted_at = self.category.updated_at
+        self.dresses[0].delete()
+        self.category.refresh_from_db()
+        self.assertGreater(self.category.updated_at, deleted_at)
+
+    def test_cart_badge_change_updates_etag(self):
+        response = self.assertNotModified('/')
+        self.client.get('/add-to-cart/dress/dress-0/')
+        changed = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'badge-danger">1<')
+
+    def test_pending_messages_disable_not_modified(self):
+        self.client.get('/add-to-cart/dress/dress-0/')
+        response = self.client.get('/')
+        self.client.get('/remove-from-cart/dress/dress-0/')
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, STATIC_ROOT=os.path.join(TEST_MEDIA_ROOT, 'static'))
+class AssetServingTestCases(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def get_content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_pages_use_hashed_local_assets(self):
+        response = self.client.get('/')
+        self.assertNotContains(response, 'https://')
+        for name in (
+            'mainapp/vendor/bootstrap-4.0.0/css/bootstrap.min.css', 'mainapp/css/shop-homepage.css',
+            'mainapp/vendor/jquery-3.3.1/jquery.min.js', 'mainapp/vendor/bootstrap-4.0.0/js/bootstrap.min.js',
+        ):
+            url = staticfiles_storage.url(name)
+            self.assertNotEqual(url, '/static/' + name)
+            self.assertContains(response, url)
+
+    def test_hashed_asset_is_immutable_and_precompressed(self):
+        name = staticfiles_storage.stored_name('mainapp/vendor/bootstrap-4.0.0/css/bootstrap.min.css')
+        with staticfiles_storage.open(name) as original:
+            content = original.read()
+        url = '/static/' + name
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(self.get_content(response)), content)
+        for accept_encoding in ('', 'gzip;q=0, deflate'):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(self.get_content(response), content)
+
+    def test_small_files_are_not_compressed(self):
+        name = staticfiles_storage.stored_name('mainapp/css/shop-homepage.css')
+        self.assertFalse(staticfiles_storage.exists(name + '.gz'))
+        response = self.client.get('/static/' + name, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_asset_answers_not_modified(self):
+        url = staticfiles_storage.url('mainapp/vendor/jquery-3.3.1/jquery.min.js')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        not_modified = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertIn('immutable', not_modified['Cache-Control'])
+        # Вариант без сжатия - другое представление с другим ETag.
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_unhashed_and_renamed_files_are_revalidated(self):
+        response = self.client.get('/static/mainapp/css/shop-homepage.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        name = product_image_storage.save('photo.jpg', ContentFile(b'image'))
+        response = self.client.get('/media/' + name)
+        self.assertEqual(self.get_content(response), b'image')
+        self.assertIn('immutable', response['Cache-Control'])
+        rendition = default_storage.save('renditions/photo_card.jpg', ContentFile(b'rendition'))
+        response = self.client.get('/media/' + rendition)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+
+    def test_paths_outside_roots_are_not_served(self):
+        for path in ('/static/..%2Fmedia%2Fsecret.txt', '/media/..%2F..%2Fsettings.py', '/static/mainapp/'):
+            self.assertEqual(self.client.get(path).status_code, 404)
@@ -4,10 +4,15 @@ from .views import (
     BaseView,
     ProductDetailView,
     CategoryDetailView,
+    AsyncBaseView,
+    AsyncProductDetailView,
+    AsyncCategoryDetailView,
+    SearchView,
     CartView,
     AddToCartView,
     DeleteFromCartView,
     ChangeQTYView,
+    CartBatchView,
     CheckoutView,
     MakeOrderView
 )
@@ -17,10 +22,16 @@ urlpatterns = [
     path('', BaseView.as_view(), name='base'),
     path('products/<str:ct_model>/<str:slug>/', ProductDetailView.as_view(), name='product_detail'),
     path('category/<str:slug>/', CategoryDetailView.as_view(), name='category_detail'),
+    path('search/', SearchView.as_view(), name='search'),
     path('cart/', CartView.as_view(), name='cart'),
     path('add-to-cart/<str:ct_model>/<str:slug>/', AddToCartView.as_view(), name='add_to_cart'),
     path('remove-from-cart/<str:ct_model>/<str:slug>/', DeleteFromCartView.as_view(), name='delete_from_cart'),
     path('change-qty/<str:ct_model>/<str:slug>/', ChangeQTYView.as_view(), name='change_qty'),
+    path('cart/batch/', CartBatchView.as_view(), name='cart_batch'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
-    path('make-order/', MakeOrderView.as_view(), name='make_order')
+    path('make-order/', MakeOrderView.as_view(), name='make_order'),
+    # Асинхронные варианты страниц каталога (для ASGI), те же страницы с префиксом async/.
+    path('async/', AsyncBaseView.as_view(), name='async_base'),
+    path('async/products/<str:ct_model>/<str:slug>/', AsyncProductDetailView.as_view(), name='async_product_detail'),
+    path('async/category/<str:slug>/', AsyncCategoryDetailView.as_view(), name='async_category_detail'),
 ]
@@ -1,9 +1,22 @@
-from django.db import models
+import time
+
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+
+# Ключи сессии, в которых хранятся идентификатор открытой корзины и количество товаров в ней.
+CART_SESSION_KEY = 'cart_id'
+CART_TOTAL_SESSION_KEY = 'cart_total_products'
+# Ключ сессии со временем (Unix, в секундах) последнего изменения значка корзины: входит в Last-Modified
+# страниц каталога.
+CART_CHANGED_SESSION_KEY = 'cart_changed_at'
 
 
 def recalc_cart(cart):
     """
     Фукция пересчитывает конечную цену и общее количество товаров в корзине.
+    Представления меняют итоги корзины инкрементально (см. add_to_cart); полный пересчет остается
+    эталоном, с которым тесты сверяют инкрементальные итоги, и способом исправить итоги корзины вручную.
     :param cart: Объект в корзине.
     """
     cart_data = cart.products.aggregate(models.Sum('final_price'), models.Count('id'))
@@ -13,3 +26,154 @@ def recalc_cart(cart):
         cart.final_price = 0
     cart.total_products = cart_data['id__count']
     cart.save()
+
+
+def _update_cart_totals(cart, lines_delta, price_delta):
+    """
+    Функция изменяет итоги корзины на заданные величины и время ее изменения одним UPDATE
+    (через F-выражения) и перечитывает их.
+    """
+    from .models import Cart
+    Cart.objects.filter(pk=cart.pk).update(
+        total_products=models.F('total_products') + lines_delta,
+        final_price=models.F('final_price') + price_delta,
+        updated_at=timezone.now()
+    )
+    cart.refresh_from_db(fields=['total_products', 'final_price', 'updated_at'])
+
+
+def add_to_cart(cart, product, qty=1, update_existing=False):
+    """
+    Функция добавляет товар в корзину и изменяет итоги корзины. Новая строка вставляется одним INSERT.
+    Если строку уже создал, в том числе параллельный запрос, уникальное ограничение отклоняет вставку:
+    существующая строка не меняется, а с update_existing ей задается количество qty (upsert) и итоги корзины
+    меняются на разницу. Остальные ошибки целостности не перехватываются. Повторное добавление (например,
+    двойной клик) не создает вторую строку.
+    :param cart: Сохраненный объект корзины.
+    :param product: Объект CatalogProduct.
+    :param qty: Количество.
+    :param update_existing: Задать количество qty строке, которая уже есть в корзине.
+    :return: True, если строка была создана, False, если она уже была в корзине.
+    """
+    from .models import Cart, CartProduct
+    cart_product = CartProduct(
+        user_id=cart.owner_id, cart=cart, content_type_id=product.content_type_id, object_id=product.object_id,
+        qty=qty, final_price=qty * product.price
+    )
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                CartProduct.objects.bulk_create([cart_product])
+        except IntegrityError:
+            existing = _get_cart_line(cart, product).first()
+            if existing is None:
+                raise
+            if update_existing:
+                _set_line_qty(cart, existing, product, qty)
+            return False
+        Cart.products.through.objects.create(cart_id=cart.pk, cartproduct_id=cart_product.pk)
+        _update_cart_totals(cart, 1, cart_product.final_price)
+    return True
+
+
+def _get_cart_line(cart, product):
+    from .models import CartProduct
+    return CartProduct.objects.select_for_update().only('final_price').filter(
+        cart=cart, content_type_id=product.content_type_id, object_id=product.object_id
+    )
+
+
+def _set_line_qty(cart, cart_product, product, qty):
+    """
+    Функция задает количество строки корзины и на разницу в цене обновляет итоги корзины.
+    Вызывается в транзакции, строка заблокирована select_for_update.
+    """
+    from .models import CartProduct
+    final_price = qty * product.price
+    CartProduct.objects.filter(pk=cart_product.pk).update(qty=qty, final_price=final_price)
+    _update_cart_totals(cart, 0, final_price - cart_product.final_price)
+
+
+def change_cart_qty(cart, product, qty):
+    """
+    Функция меняет количество товара в корзине и на разницу в цене обновляет итоги корзины.
+    :param cart: Объект корзины.
+    :param product: Объект CatalogProduct.
+    :param qty: Новое количество.
+    :raises CartProduct.DoesNotExist: Если товара нет в корзине.
+    """
+    with transaction.atomic():
+        _set_line_qty(cart, _get_cart_line(cart, product).get(), product, qty)
+
+
+def remove_from_cart(cart, product):
+    """
+    Функция удаляет строку товара из корзины и вычитает ее из итогов корзины. Связи строки с корзинами
+    (Cart.products) удаляет каскад вместе со строкой.
+    :param cart: Объект корзины.
+    :param product: Объект CatalogProduct.
+    """
+    from .models import CartProduct
+    with transaction.atomic():
+        cart_product = CartProduct.objects.select_for_update().only('final_price').get(
+            cart=cart, content_type_id=product.content_type_id, object_id=product.object_id
+        )
+        cart_product.delete()
+        _update_cart_totals(cart, -1, -cart_product.final_price)
+
+
+def remember_cart(session, cart):
+    """
+    Функция сохраняет в сессии идентификатор корзины и количество товаров в ней, чтобы следующие запросы
+    находили корзину без поиска покупателя, а значок корзины отображался без запросов к базе.
+    :param session: Сессия текущего запроса.
+    :param cart: Объект корзины.
+    """
+    session[CART_SESSION_KEY] = cart.id
+    if session.get(CART_TOTAL_SESSION_KEY) != cart.total_products:
+        session[CART_CHANGED_SESSION_KEY] = int(time.time())
+    session[CART_TOTAL_SESSION_KEY] = cart.total_products
+
+
+def forget_cart(session):
+    """
+    Функция удаляет из сессии сведения о корзине (например, после оформления заказа).
+    :param session: Сессия текущего запроса.
+    """
+    session.pop(CART_SESSION_KEY, None)
+    if session.pop(CART_TOTAL_SESSION_KEY, None):
+        session[CART_CHANGED_SESSION_KEY] = int(time.time())
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Функция возвращает приблизительное количество строк таблицы модели из статистики базы данных
+    (sqlite_stat1 после ANALYZE, pg_class.reltuples в PostgreSQL, information_schema в MySQL)
+    без полного прохода по таблице.
+    :param model: Класс модели.
+    :param using: Псевдоним базы данных.
+    :return: Оценка количества строк или None, если статистики нет.
+    """
+    from django.db import DatabaseError, connections
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        'sqlite': ('SELECT stat FROM sqlite_stat1 WHERE tbl = %s ORDER BY idx IS NOT NULL LIMIT 1', [table]),
+        'postgresql': ('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table]),
+        'mysql': (
+            'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+            [table]
+        ),
+    }
+    if connection.vendor not in queries:
+        return None
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(*queries[connection.vendor])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
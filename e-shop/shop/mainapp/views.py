@@ -1,38 +1,64 @@
-from django.db import transaction
+import json
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import DatabaseError, connections, transaction
 from django.shortcuts import render
-from django.contrib.contenttypes.models import ContentType
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.views.generic import DetailView, View
 
-from .models import Dress, Skirt, Category, LatestProducts, Customer, Cart, CartProduct
-from .mixins import CategoryDetailMixin, CartMixin
+from .models import Dress, Skirt, Category, LatestProducts, Customer, CartProduct, CatalogProduct, Order
+from .mixins import (
+    CategoryDetailMixin, CartMixin, CachedBodyMixin, AsyncCachedBodyMixin, AsyncRenderMixin, ConditionalPageMixin
+)
+from . import search
 from .forms import OrderForm
-from .utils import recalc_cart
+from .metrics import render_metrics
+from .storage import product_image_storage
+from .utils import add_to_cart, change_cart_qty, remove_from_cart, remember_cart, forget_cart
 
 
-class BaseView(CartMixin, View):
+class BaseView(ConditionalPageMixin, CartMixin, View):
+
+    # Наибольшее количество запросов к базе данных на один запрос к представлению
+    # (проверяется тестами и QueryBudgetMiddleware).
+    query_budget = 3
 
     def get(self, request, *args, **kwargs):
         """
         Функция получает категории для левой боковой панели и товары для главной страницы, а затем отображает
-        в base.html шаблон с контекстом.
+        в base.html шаблон с контекстом. Корзина не запрашивается: значок берется из сессии.
+        Если у клиента актуальная версия страницы, возвращается 304 без выборки товаров.
         :param request: Объект запроса.
         :return: Функция рендеринга возвращается.
         """
         categories = Category.objects.get_categories_for_left_sidebar()
+        response = self.get_not_modified_response(categories)
+        if response is not None:
+            return response
         products = LatestProducts.objects.get_products_for_main_page(
             'dress', 'skirt', with_respect_to='dress'
         )
         context = {
             'categories': categories,
             'products': products,
-            'cart': self.cart
         }
-        return render(request, 'base.html', context)
+        return self.set_validators(render(request, 'base.html', context))
+
 
+class ProductDetailView(CachedBodyMixin, CartMixin, CategoryDetailMixin, DetailView):
 
-class ProductDetailView(CartMixin, CategoryDetailMixin, DetailView):
+    query_budget = 4
 
     # Словарь, который сопоставляет имя модели типа контента классу модели.
     CT_MODEL_MODEL_CLASS = {
@@ -48,28 +74,33 @@ class ProductDetailView(CartMixin, CategoryDetailMixin, DetailView):
         :return: Возвращается метод super().dispatch().
         """
         self.model = self.CT_MODEL_MODEL_CLASS[kwargs['ct_model']]
-        self.queryset = self.model._base_manager.all()
+        self.queryset = self.model._base_manager.select_related('category')
         return super().dispatch(request, *args, **kwargs)
 
     # Определение context_object_name, template_name и slug_url_kwargs для класса представления сведений
     # о продукте.
     context_object_name = 'product'
     template_name = 'product_detail.html'
+    body_template_name = 'product_detail_body.html'
+    fragment_kind = 'product'
+    fragment_key_format = '{ct_model}:{slug}'
     slug_url_kwarg = 'slug'
 
     def get_context_data(self, **kwargs):
         """
         Она берет контекстные данные из родительского класса (в данном случае общего класса DetailView) и
-        добавляет к нему название модели и корзину.
+        добавляет к нему название модели.
         :return: Контекст возвращается.
         """
         context = super().get_context_data(**kwargs)
         context['ct_model'] = self.model._meta.model_name
-        context['cart'] = self.cart
         return context
 
 
-class CategoryDetailView(CartMixin, CategoryDetailMixin, DetailView):
+class CategoryDetailView(CachedBodyMixin, CartMixin, CategoryDetailMixin, DetailView):
+
+    # С фасетами добавляется по одному запросу количеств на каждый выбранный атрибут (до шести).
+    query_budget = 10
 
     # Определение модели, набора запросов, context_object_name, template_name и slug_url_kwargs для
     # класса CategoryDetailView.
@@ -77,97 +108,230 @@ class CategoryDetailView(CartMixin, CategoryDetailMixin, DetailView):
     queryset = Category.objects.all()
     context_object_name = 'category'
     template_name = 'category_detail.html'
+    body_template_name = 'category_detail_body.html'
+    fragment_kind = 'category'
     slug_url_kwarg = 'slug'
 
-    def get_context_data(self, **kwargs):
+    def get_fragment_name(self):
+        cursor = self.get_cursor()
+        return '{}:{}:{}:{}'.format(
+            self.body_template_name, self.get_sort(), '{}_{}'.format(*cursor) if cursor else '',
+            self.get_filter_query()
+        )
+
+
+class AsyncBaseView(AsyncRenderMixin, BaseView):
+    '''
+    Асинхронный вариант BaseView для ASGI: боковая панель и сессия загружаются одновременно, без отдельного
+    потока на весь запрос.
+    '''
+
+    async def get(self, request, *args, **kwargs):
+        return await self.arender('base.html', ('products', self.aget_products))
+
+    async def aget_products(self):
+        return await LatestProducts.objects.aget_products_for_main_page('dress', 'skirt', with_respect_to='dress')
+
+
+class AsyncProductDetailView(AsyncCachedBodyMixin, ProductDetailView):
+    '''
+    Асинхронный вариант ProductDetailView для ASGI.
+    '''
+
+
+class AsyncCategoryDetailView(AsyncCachedBodyMixin, CategoryDetailView):
+    '''
+    Асинхронный вариант CategoryDetailView для ASGI.
+    '''
+
+
+class SearchView(View):
+
+    query_budget = 4
+
+    # Максимальный номер страницы результатов поиска.
+    MAX_PAGE = 50
+
+    def get(self, request, *args, **kwargs):
         """
-        Функция берет контекстные данные из родительского класса (в данном случае общего класса DetailView) и
-        добавляет к нему корзину.
-        :return: Контекст возвращается.
+        Функция ищет товары по строке q в полнотекстовом индексе и отображает страницу результатов.
+        :param request: Объект запроса.
+        :return: Страница результатов поиска.
         """
-        context = super().get_context_data(**kwargs)
-        context['cart'] = self.cart
-        return context
+        query = request.GET.get('q', '').strip()
+        try:
+            page = min(max(int(request.GET.get('page', 1)), 1), self.MAX_PAGE)
+        except ValueError:
+            page = 1
+        products, has_next = search.search(query, page)
+        context = {
+            'categories': Category.objects.get_categories_for_left_sidebar(),
+            'query': query,
+            'products': products,
+            'page': page,
+            'has_next': has_next and page < self.MAX_PAGE,
+        }
+        return render(request, 'search.html', context)
 
 
 class AddToCartView(CartMixin, View):
 
+    # Худший путь - первое добавление вошедшим пользователем без покупателя: создаются покупатель и корзина.
+    query_budget = 15
+
     def get(self, request, *args, **kwargs):
         """
-        Мы получаем тип контента продукта, получаем сам продукт, а затем получаем или
-        создаём объект продукта корзины.
+        Мы находим продукт в индексе каталога (тип контента и идентификатор одним запросом), а затем
+        добавляем строку в корзину (если она уже есть, корзина не меняется) и обновляем итоги корзины.
         :param request: Объект запроса.
         """
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
-        content_type = ContentType.objects.get(model=ct_model)
-        product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product, created = CartProduct.objects.get_or_create(
-            user=self.cart.owner, cart=self.cart, content_type=content_type, object_id=product.id
-        )
-        if created:
-            self.cart.products.add(cart_product)
-        recalc_cart(self.cart)
+        product = CatalogProduct.objects.get(product_type=ct_model, slug=product_slug)
+        cart = self.get_cart_for_update()
+        add_to_cart(cart, product)
+        remember_cart(request.session, cart)
         # messages.add_message(request, messages.INFO, "Товар успешно добавлен").
         return HttpResponseRedirect('/cart/')
 
 
 class DeleteFromCartView(CartMixin, View):
 
+    query_budget = 12
+
     def get(self, request, *args, **kwargs):
         """
         Она получает товар из корзины, учитывая тип содержимого и идентификатор продукта
         : param request: Объект запроса.
         """
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
-        content_type = ContentType.objects.get(model=ct_model)
-        product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner, cart=self.cart, content_type=content_type, object_id=product.id
-        )
-        # Удаление товара из корзины, а затем повторный расчет корзины.
-        self.cart.products.remove(cart_product)
-        cart_product.delete()
-        recalc_cart(self.cart)
+        product = CatalogProduct.objects.get(product_type=ct_model, slug=product_slug)
+        # Удаление товара из корзины и уменьшение итогов корзины.
+        remove_from_cart(self.cart, product)
+        remember_cart(request.session, self.cart)
         messages.add_message(request, messages.INFO, "Товар успешно удален")
         return HttpResponseRedirect('/cart/')
 
 
 class ChangeQTYView(CartMixin, View):
 
+    query_budget = 11
+
     def post(self, request, *args, **kwargs):
         """
-        Она принимает запрос, получает продукт, получает продукт в корзине, получает количество из запроса,
-        устанавливает количество продуктов корзины, сохраняет продукт в корзине, пересчитывает корзину и
-        перенаправляет нас в корзину.
+        Она принимает запрос, получает продукт, получает количество из запроса, меняет количество в строке
+        корзины, на разницу в цене обновляет итоги корзины и перенаправляет нас в корзину.
         :param request: Объект запроса.
         :return: HttpResponseRedirect('/cart/').
         """
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
-        content_type = ContentType.objects.get(model=ct_model)
-        product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner, cart=self.cart, content_type=content_type, object_id=product.id
-        )
+        product = CatalogProduct.objects.get(product_type=ct_model, slug=product_slug)
         qty = int(request.POST.get('qty'))
-        cart_product.qty = qty
-        cart_product.save()
-        recalc_cart(self.cart)
+        change_cart_qty(self.cart, product, qty)
+        remember_cart(request.session, self.cart)
         messages.add_message(request, messages.INFO, "Кол-во успешно изменено")
         return HttpResponseRedirect('/cart/')
 
 
+class CartBatchView(CartMixin, View):
+
+    # Бюджет запросов не задан: количество запросов растет с числом операций в пакете.
+
+    # Операции, которые принимает представление (совпадают с именами маршрутов для одиночных изменений).
+    OPERATIONS = ('add_to_cart', 'change_qty', 'delete_from_cart')
+
+    def post(self, request, *args, **kwargs):
+        """
+        Функция принимает JSON со списком операций над корзиной и выполняет их в одной транзакции.
+        add_to_cart для товара, который уже есть в корзине, задает ему количество qty.
+        Пример тела запроса: {"operations": [{"op": "change_qty", "ct_model": "dress", "slug": "red", "qty": 2}]}
+        Корзина (и покупатель) создаются в той же транзакции после проверки товаров, поэтому отклоненный
+        пакет не оставляет в базе пустую корзину.
+        :param request: Объект запроса.
+        :return: JSON со строками и итогами корзины или с описанием ошибки (код 400).
+        """
+        try:
+            operations = self.parse_operations(request.body)
+            products = CatalogProduct.objects.get_products_by_slugs(
+                (op['ct_model'], op['slug']) for op in operations
+            )
+            for op in operations:
+                if (op['ct_model'], op['slug']) not in products:
+                    raise ValueError('Товар не найден: {}/{}'.format(op['ct_model'], op['slug']))
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        new_cart = self.cart.pk is None
+        try:
+            with transaction.atomic():
+                cart = self.get_cart_for_update()
+                for op in operations:
+                    product = products[(op['ct_model'], op['slug'])]
+                    if op['op'] == 'add_to_cart':
+                        add_to_cart(cart, product, op['qty'], update_existing=True)
+                    elif op['op'] == 'change_qty':
+                        change_cart_qty(cart, product, op['qty'])
+                    else:
+                        remove_from_cart(cart, product)
+        except CartProduct.DoesNotExist:
+            if new_cart:
+                # Созданная корзина откачена вместе с транзакцией.
+                forget_cart(request.session)
+            return JsonResponse({'error': 'Товара нет в корзине'}, status=400)
+        remember_cart(request.session, cart)
+        return JsonResponse({
+            'lines': [
+                {
+                    'ct_model': item.content_object.get_model_name(),
+                    'slug': item.content_object.slug,
+                    'title': item.content_object.title,
+                    'price': str(item.content_object.price),
+                    'qty': item.qty,
+                    'final_price': str(item.final_price),
+                }
+                for item in cart.get_cart_products()
+            ],
+            'total_products': cart.total_products,
+            'final_price': str(cart.final_price),
+        })
+
+    def parse_operations(self, body):
+        """
+        Функция разбирает и проверяет список операций из тела запроса.
+        :return: Список словарей с ключами op, ct_model, slug, qty.
+        """
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError:
+            raise ValueError('Тело запроса должно быть JSON')
+        if not isinstance(data, dict) or not isinstance(data.get('operations'), list):
+            raise ValueError('Ожидается объект со списком operations')
+        operations = []
+        for op in data['operations']:
+            if not isinstance(op, dict) or op.get('op') not in self.OPERATIONS:
+                raise ValueError('Неизвестная операция: {}'.format(op))
+            qty = op.get('qty', 1)
+            if not isinstance(qty, int) or isinstance(qty, bool) or qty < 1:
+                raise ValueError('Количество должно быть положительным целым числом')
+            operations.append({
+                'op': op['op'], 'ct_model': str(op.get('ct_model')), 'slug': str(op.get('slug')), 'qty': qty
+            })
+        return operations
+
+
 class CartView(CartMixin, View):
 
+    query_budget = 8
+
     def get(self, request, *args, **kwargs):
         """
         Функция получает категории для левой боковой панели, а затем отображает cart.html шаблон с
-        корзиной и категориями в контексте.
+        корзиной, её товарами (с предзагруженными продуктами) и категориями в контексте.
         :param request: Объект запроса.
         :return: Корзина возвращается.
         """
         categories = Category.objects.get_categories_for_left_sidebar()
         context = {
             'cart': self.cart,
+            'cart_products': self.cart.get_cart_products(),
             'categories': categories
         }
         return render(request, 'cart.html', context)
@@ -175,6 +339,8 @@ class CartView(CartMixin, View):
 
 class CheckoutView(CartMixin, View):
 
+    query_budget = 7
+
     def get(self, request, *args, **kwargs):
         """
         Она получает категории для левой боковой панели, создает форму заказа и отображает оформление заказа
@@ -186,6 +352,7 @@ class CheckoutView(CartMixin, View):
         form = OrderForm(request.POST or None)
         context = {
             'cart': self.cart,
+            'cart_products': self.cart.get_cart_products(),
             'categories': categories,
             'form': form
         }
@@ -194,34 +361,183 @@ class CheckoutView(CartMixin, View):
 
 class MakeOrderView(CartMixin, View):
 
-    @transaction.atomic
+    query_budget = 10
+
     def post(self, request, *args, **kwargs):
         """
-        Функция принимает запрос, и если форма действительна, она сохраняет форму, сохраняет корзину и
-        перенаправляет на домашнюю страницу.
+        Функция принимает запрос, и если форма действительна, оформляет заказ по корзине одной короткой
+        транзакцией (см. OrderManager.place_order) и перенаправляет на домашнюю страницу.
         :param request: Текущий объект HTTP-запроса.
         :return: Представление возвращает объект HttpResponseRedirect.
         """
         form = OrderForm(request.POST or None)
-        customer = Customer.objects.get(user=request.user)
-        if form.is_valid():
-            new_order = form.save(commit=False)
-            new_order.customer = customer
-            new_order.first_name = form.cleaned_data['first_name']
-            new_order.last_name = form.cleaned_data['last_name']
-            new_order.phone = form.cleaned_data['phone']
-            new_order.address = form.cleaned_data['address']
-            new_order.buying_type = form.cleaned_data['buying_type']
-            new_order.order_date = form.cleaned_data['order_date']
-            new_order.comment = form.cleaned_data['comment']
-            new_order.save()
-            self.cart.in_order = True
-            self.cart.save()
-            new_order.cart = self.cart
-            new_order.save()
-            customer.orders.add(new_order)
-            messages.add_message(request, messages.INFO, 'Спасибо за заказ! Менеджер с Вами свяжется')
-            return HttpResponseRedirect('/')
-        return HttpResponseRedirect('/checkout/')
+        if not form.is_valid() or not request.user.is_authenticated or self.cart.pk is None:
+            return HttpResponseRedirect('/checkout/')
+        new_order = form.save(commit=False)
+        new_order.customer_id = self.cart.owner_id or Customer.objects.get_or_create(user=request.user)[0].pk
+        if Order.objects.place_order(new_order, self.cart) is None:
+            messages.add_message(request, messages.INFO, 'Корзина пуста или заказ по ней уже оформлен')
+            return HttpResponseRedirect('/cart/')
+        forget_cart(request.session)
+        messages.add_message(request, messages.INFO, 'Спасибо за заказ! Менеджер с Вами свяжется')
+        return HttpResponseRedirect('/')
+
 
+class MetricsView(View):
+
+    def get(self, request, *args, **kwargs):
+        """
+        Функция отдает метрики процесса в текстовом формате Prometheus. Доступна только с адресов INTERNAL_IPS.
+        """
+        if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+            raise Http404
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
+
+class ReadinessView(View):
+
+    def get(self, request, *args, **kwargs):
+        """
+        Функция проверяет готовность к приему запросов: каждая база данных должна ответить на SELECT 1
+        быстрее READINESS_MAX_DB_LATENCY секунд.
+        :return: JSON с задержкой каждой базы данных в миллисекундах; код 503, если проверка не пройдена.
+        """
+        ready = True
+        databases = {}
+        for connection in connections.all():
+            started = time.perf_counter()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+            except DatabaseError as error:
+                ready = False
+                databases[connection.alias] = {'error': str(error)}
+                continue
+            latency = time.perf_counter() - started
+            ready = ready and latency <= settings.READINESS_MAX_DB_LATENCY
+            databases[connection.alias] = {'latency_ms': round(latency * 1000, 3)}
+        return JsonResponse({'ready': ready, 'databases': databases}, status=200 if ready else 503)
+
+
+class AssetView(View):
+    '''
+    Отдача файлов из каталога document_root_setting (имя настройки) без отдельного веб-сервера. Если рядом с файлом есть сжатый
+    вариант (.br или .gz, см. mainapp.storage.CompressedManifestStaticFilesStorage), а клиент его принимает,
+    отдается вариант с заголовком Content-Encoding. Файлы, содержимое которых не меняется под тем же именем,
+    кэшируются на ASSET_IMMUTABLE_MAX_AGE секунд без проверки (immutable), остальные - на ASSET_MAX_AGE
+    секунд, после чего проверяются по ETag и Last-Modified.
+    '''
+
+    query_budget = 0
+
+    # Сжатые варианты в порядке предпочтения: кодировка -> суффикс файла.
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    # Имя настройки с каталогом файлов. Значение читается при каждом запросе, а не при импорте модуля,
+    # поэтому каталог можно переопределить (override_settings в тестах).
+    document_root_setting = None
+
+    def is_immutable(self, path):
+        """
+        Функция проверяет, что имя файла однозначно определяет его содержимое.
+        """
+        return False
+
+    def find(self, path):
+        """
+        Функция возвращает абсолютный путь к файлу или None. Путь за пределами каталога файлов не ищется.
+        """
+        try:
+            full_path = safe_join(getattr(settings, self.document_root_setting), path)
+        except SuspiciousFileOperation:
+            return None
+        return full_path if os.path.isfile(full_path) else None
+
+    def get_accepted_encodings(self):
+        """
+        Функция возвращает кодировки из заголовка Accept-Encoding, которые клиент принимает (q > 0).
+        """
+        encodings = set()
+        for item in self.request.headers.get('Accept-Encoding', '').split(','):
+            encoding, _, params = item.partition(';')
+            quality = params.strip()[2:] if params.strip().startswith('q=') else '1'
+            try:
+                if float(quality) > 0:
+                    encodings.add(encoding.strip().lower())
+            except ValueError:
+                continue
+        return encodings
+
+    def get(self, request, path):
+        """
+        Функция отдает файл (или его сжатый вариант) либо 304, если у клиента актуальная версия.
+        :param path: Путь к файлу относительно каталога файлов.
+        """
+        full_path = self.find(path)
+        if full_path is None:
+            raise Http404
+        variants = [
+            (encoding, full_path + suffix) for encoding, suffix in self.ENCODINGS
+            if os.path.isfile(full_path + suffix)
+        ]
+        accepted = self.get_accepted_encodings() if variants else set()
+        encoding, served_path = next(
+            ((encoding, variant) for encoding, variant in variants if encoding in accepted), (None, full_path)
+        )
+        stat = os.stat(served_path)
+        etag = quote_etag('{:x}-{:x}{}'.format(int(stat.st_mtime), stat.st_size, '-' + encoding if encoding else ''))
+        response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+            response = FileResponse(
+                open(served_path, 'rb'), content_type=content_type, filename=os.path.basename(full_path)
+            )
+            response['Last-Modified'] = http_date(stat.st_mtime)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        if variants:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        if self.is_immutable(path):
+            patch_cache_control(response, public=True, max_age=settings.ASSET_IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=settings.ASSET_MAX_AGE)
+        return response
+
+
+class StaticAssetView(AssetView):
+    '''
+    Статические файлы из STATIC_ROOT (после collectstatic). При DEBUG = True файлы, которые еще не собраны,
+    ищутся в каталогах static приложений.
+    '''
+
+    # Имя файла после collectstatic: <имя>.<12 символов хэша>.<расширение>.
+    HASHED_NAME_RE = re.compile(r'^(?P<name>.+)\.[0-9a-f]{12}(?P<ext>\.[^./]+)?$')
+
+    document_root_setting = 'STATIC_ROOT'
+
+    def find(self, path):
+        full_path = super().find(path)
+        if full_path is None and settings.DEBUG:
+            full_path = finders.find(path)
+        return full_path
+
+    def is_immutable(self, path):
+        match = self.HASHED_NAME_RE.match(path)
+        if match is None:
+            return False
+        name = match.group('name') + (match.group('ext') or '')
+        return getattr(staticfiles_storage, 'hashed_files', {}).get(name) == path
+
+
+class MediaAssetView(AssetView):
+    '''
+    Медиафайлы из MEDIA_ROOT. Изображения товаров в хэшированном хранилище не меняются под тем же именем,
+    а варианты изображений пересоздаются под прежними именами и кэшируются на ограниченное время.
+    '''
+
+    document_root_setting = 'MEDIA_ROOT'
+
+    def is_immutable(self, path):
+        return product_image_storage.is_content_addressed(path)
@@ -44,6 +44,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mainapp.middleware.PrimaryDatabaseMiddleware',
+    'mainapp.middleware.MetricsMiddleware',
+    'mainapp.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,11 +55,32 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Сравнивать количество запросов к базе данных с бюджетом представления (mainapp.middleware).
+# Включено только при разработке; в рабочем режиме включается явно для диагностики.
+QUERY_BUDGET_ENABLED = DEBUG
+
+# Метрики запросов (mainapp.middleware.MetricsMiddleware): доля замеряемых запросов от 0 до 1.
+# Метрики доступны по адресу /internal/metrics/ только с адресов INTERNAL_IPS.
+METRICS_ENABLED = True
+METRICS_SAMPLE_RATE = 1.0
+INTERNAL_IPS = ['127.0.0.1']
+
+# Импорт товаров из админки: папки изображений ищутся внутри PRODUCT_IMPORT_ROOT,
+# изображения обрабатываются в PRODUCT_IMPORT_WORKERS процессах.
+PRODUCT_IMPORT_ROOT = os.path.join(BASE_DIR, 'import')
+PRODUCT_IMPORT_WORKERS = 2
+
+# Количество процессов, в которых создаются варианты загруженных изображений товаров (mainapp.images).
+RENDITION_WORKERS = 2
+
+# Проверка готовности (/internal/ready/) не проходит, если ответ базы данных дольше этого времени (секунды).
+READINESS_MAX_DB_LATENCY = 0.5
+
 ROOT_URLCONF = 'shop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'mainapp.template_backend.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +89,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'mainapp.context_processors.cart',
             ],
         },
     },
@@ -76,10 +101,60 @@ WSGI_APPLICATION = 'shop.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Соединения живут CONN_MAX_AGE секунд и переиспользуются между запросами (с проверкой перед
+# повторным использованием), вместо открытия нового соединения на каждый запрос.
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Реплика для чтения каталога (mainapp.routers.ReplicaRouter): копия основной базы данных, например
+# файл SQLite, который обновляется репликацией, или Postgres. Включается переменной окружения SHOP_REPLICA_DB
+# (путь к файлу SQLite). В тестах реплика - зеркало основной базы данных.
+DATABASE_REPLICA_ALIAS = 'replica'
+if os.environ.get('SHOP_REPLICA_DB'):
+    DATABASES[DATABASE_REPLICA_ALIAS] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['SHOP_REPLICA_DB'],
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # Реплика только читается (режим журнала в ней задает процесс, который ее обновляет).
+        'PRAGMAS': {'query_only': 'on'},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['mainapp.routers.ReplicaRouter']
+
+# PRAGMA, которые выполняются для каждого нового соединения с SQLite (mainapp.db.configure_connection):
+# synchronous = normal в режиме WAL не теряет целостность базы данных, cache_size в КиБ (отрицательное
+# значение), mmap_size в байтах, busy_timeout в миллисекундах - сколько запрос ждет освобождения блокировки
+# записи вместо ошибки "database is locked". Режим журнала WAL (чтение во время записи) хранится в файле
+# базы данных и включается один раз миграцией mainapp 0013, а не при каждом соединении: простое открытие
+# базы данных ее не изменяет.
+# Ключ PRAGMAS в описании базы данных дополняет или переопределяет эти значения.
+SQLITE_PRAGMAS = {
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 134217728,
+    'temp_store': 'memory',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Кэш процесса используется для боковой панели категорий. Для нескольких процессов сервера его следует
+# заменить общим кэшем (Redis, Memcached), чтобы сброс по сигналам был виден всем процессам.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop',
     }
 }
 
@@ -126,6 +201,14 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL ='/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# collectstatic добавляет к именам файлов хэш содержимого и сохраняет рядом с текстовыми файлами сжатые
+# варианты (mainapp.storage.CompressedManifestStaticFilesStorage). Статические и медиафайлы отдает само
+# приложение (mainapp.views.StaticAssetView и MediaAssetView): файлы с хэшем в имени кэшируются клиентом
+# на ASSET_IMMUTABLE_MAX_AGE секунд без проверки, остальные - на ASSET_MAX_AGE секунд.
+STATICFILES_STORAGE = 'mainapp.storage.CompressedManifestStaticFilesStorage'
+ASSET_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+ASSET_MAX_AGE = 60 * 60 * 24
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
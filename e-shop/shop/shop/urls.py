@@ -13,16 +13,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
 from django.conf  import settings
 
+from mainapp.views import MetricsView, ReadinessView, StaticAssetView, MediaAssetView
+
+
+def asset_path(prefix):
+    return r'^{}(?P<path>.+)$'.format(re.escape(prefix.lstrip('/')))
+
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('internal/metrics/', MetricsView.as_view(), name='metrics'),
+    path('internal/ready/', ReadinessView.as_view(), name='readiness'),
+    re_path(asset_path(settings.STATIC_URL), StaticAssetView.as_view(), name='static_asset'),
+    re_path(asset_path(settings.MEDIA_URL), MediaAssetView.as_view(), name='media_asset'),
     path('', include('mainapp.urls')),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root= settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root= settings.MEDIA_ROOT)